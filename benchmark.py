@@ -0,0 +1,399 @@
+"""Нагрузочный прогон обработчиков bot.py на синтетических пользователях.
+
+Запуск:
+    python benchmark.py --users 2000 --concurrency 200
+    python benchmark.py --users 2000 --compare bench_results/20260101-120000.json
+
+Бот импортируется во временном каталоге с временной БД и заглушками картинок,
+Telegram API подменяется фейковыми Update/CallbackQuery (никаких сетевых
+запросов). Для каждого сценария (создание сделки, вход покупателя, "Мои сделки",
+реквизиты) печатаются p50/p95/p99 задержки апдейта, пропускная способность,
+число SQL-запросов на апдейт и пиковый RSS. Результаты сохраняются в
+bench_results/<время>.json, чтобы сравнивать прогоны.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(REPO_DIR, 'bench_results')
+IMAGES = ('najalo.jpg', 'create_deal.jpg', 'profile.jpg', 'requisites.jpg', 'support.jpg', 'language.jpg')
+TON_WALLET = 'UQ' + 'A' * 46
+
+bot = None                     # модуль bot, импортируется в prepare_environment()
+_file_ids = itertools.count(1)
+
+
+# ----- Фейковые объекты Telegram -----
+# Только то, что реально вызывают обработчики; каждый вызов API может
+# имитировать сетевую задержку (--api-latency).
+
+class FakeApi:
+    latency = 0.0
+
+    @classmethod
+    async def call(cls):
+        if cls.latency:
+            await asyncio.sleep(cls.latency)
+
+
+class FakePhotoSize:
+    def __init__(self, file_id):
+        self.file_id = file_id
+
+
+class FakeSentMessage:
+    def __init__(self):
+        self.photo = [FakePhotoSize(f"file-{next(_file_ids)}")]
+
+    async def delete(self):
+        await FakeApi.call()
+
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.username = f"user{user_id}"
+        self.first_name = f"User {user_id}"
+        self.language_code = 'ru'
+        self.is_bot = False
+
+
+class FakeChat:
+    def __init__(self, chat_id):
+        self.id = chat_id
+
+    async def send_photo(self, **kwargs):
+        await FakeApi.call()
+        return FakeSentMessage()
+
+
+class FakeMessage:
+    def __init__(self, user, text=None):
+        self.from_user = user
+        self.chat = FakeChat(user.id)
+        self.text = text
+
+    async def reply_photo(self, **kwargs):
+        await FakeApi.call()
+        return FakeSentMessage()
+
+    async def reply_text(self, *args, **kwargs):
+        await FakeApi.call()
+        return FakeSentMessage()
+
+    async def delete(self):
+        await FakeApi.call()
+
+
+class FakeCallbackQuery:
+    def __init__(self, user, data):
+        self.id = str(next(_file_ids))
+        self.from_user = user
+        self.data = data
+        self.message = FakeMessage(user)
+
+    async def answer(self, *args, **kwargs):
+        await FakeApi.call()
+
+    async def edit_message_media(self, **kwargs):
+        await FakeApi.call()
+        return FakeSentMessage()
+
+    async def edit_message_caption(self, **kwargs):
+        await FakeApi.call()
+        return FakeSentMessage()
+
+    async def edit_message_text(self, **kwargs):
+        await FakeApi.call()
+        return FakeSentMessage()
+
+
+class FakeUpdate:
+    def __init__(self, user, message=None, callback_query=None):
+        self.effective_user = user
+        self.effective_chat = FakeChat(user.id)
+        self.message = message
+        self.callback_query = callback_query
+
+
+class FakeContext:
+    def __init__(self, args=None):
+        self.args = args or []
+        self.user_data = {}
+        self.bot = None
+
+
+# ----- Шаги сценариев -----
+
+def command(*args):
+    return ('command', list(args))
+
+
+def callback(data):
+    return ('callback', data)
+
+
+def text(value):
+    return ('text', value)
+
+
+async def run_step(user, step):
+    kind, payload = step
+    if kind == 'command':
+        update = FakeUpdate(user, message=FakeMessage(user, '/start'))
+        await bot.start_command(update, FakeContext(payload))
+    elif kind == 'callback':
+        update = FakeUpdate(user, callback_query=FakeCallbackQuery(user, payload))
+        await bot.handle_callback_query(update, FakeContext())
+    else:
+        update = FakeUpdate(user, message=FakeMessage(user, payload))
+        await bot.handle_message(update, FakeContext())
+
+
+def create_deal_steps(user_id):
+    return [
+        command(),
+        callback('create_deal'),
+        callback('deal_gifts'),
+        text(f"https://t.me/nft/PlushPepe-{user_id}"),
+        callback('currency_card'),
+        callback('fiat_RUB'),
+        text('1500'),
+        callback('warning_read'),
+    ]
+
+
+def join_steps(deal_id):
+    return [command(f"deal_{deal_id}")]
+
+
+def my_deals_steps(user_id):
+    return [
+        callback('profile'),
+        callback('my_deals'),
+        callback('dp|n|active||'),
+    ]
+
+
+def requisites_steps(user_id):
+    return [
+        callback('requisites'),
+        callback('add_requisites'),
+        callback('add_ton_wallet'),
+        text(TON_WALLET),
+        callback('view_requisites'),
+        callback('view_ton_wallet'),
+    ]
+
+
+# ----- Измерения -----
+
+def reset_peak_rss():
+    # Linux: запись "5" в clear_refs сбрасывает VmHWM процесса
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_kb():
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+async def run_flow(name, scripts, concurrency):
+    """scripts — {user_id: [шаги]}; пользователи идут параллельно, шаги одного — по порядку"""
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_user(user_id, steps):
+        nonlocal errors
+        user = FakeUser(user_id)
+        async with semaphore:
+            for step in steps:
+                started = time.perf_counter()
+                try:
+                    await run_step(user, step)
+                except Exception as e:
+                    errors += 1
+                    logging.getLogger('benchmark').warning(f"{name}: {step} failed: {e}")
+                latencies.append(time.perf_counter() - started)
+
+    rss_reset = reset_peak_rss()
+    sql_before = bot.db.sync.statements
+    started = time.perf_counter()
+    await asyncio.gather(*(run_user(user_id, steps) for user_id, steps in scripts.items()))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    updates = len(latencies)
+    return {
+        'users': len(scripts),
+        'updates': updates,
+        'errors': errors,
+        'seconds': round(elapsed, 3),
+        'throughput': round(updates / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'sql_per_update': round((bot.db.sync.statements - sql_before) / updates, 2) if updates else 0.0,
+        'peak_rss_kb': peak_rss_kb(),
+        'peak_rss_scope': 'flow' if rss_reset else 'process',
+    }
+
+
+# ----- Окружение -----
+
+def prepare_environment(workdir):
+    """Временный каталог: .env, заглушки картинок, своя БД; затем импорт bot"""
+    global bot
+    with open(os.path.join(workdir, '.env'), 'w') as env_file:
+        env_file.write('BOT_TOKEN=123456:benchmark\n')
+    os.makedirs(os.path.join(workdir, 'images'))
+    for image in IMAGES:
+        with open(os.path.join(workdir, 'images', image), 'wb') as image_file:
+            image_file.write(b'\xff\xd8\xff\xd9')
+    os.environ['DB_NAME'] = os.path.join(workdir, 'benchmark.db')
+    os.environ.setdefault('BOT_TOKEN', '123456:benchmark')
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+    import bot as bot_module
+    bot = bot_module
+    logging.getLogger().setLevel(logging.WARNING)
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run_benchmark(users, concurrency):
+    bot.user_states.start()
+
+    sellers = range(1, users + 1)
+    buyers = range(users + 1, 2 * users + 1)
+    results = {}
+    try:
+        results['create_deal'] = await run_flow(
+            'create_deal', {user_id: create_deal_steps(user_id) for user_id in sellers}, concurrency)
+
+        # Каждому покупателю — своя свежая сделка; подготовка вне замера
+        deal_ids = []
+        for seller_id in sellers:
+            deal_id, _ = await bot.db.create_deal({
+                'seller_id': seller_id, 'deal_type': 'gift', 'gift_links': ['https://t.me/nft/Bench-1'],
+                'currency': 'card', 'fiat_currency': 'RUB', 'amount': 1000,
+            })
+            deal_ids.append(deal_id)
+        for buyer_id in buyers:
+            await bot.db.add_user(buyer_id, f"user{buyer_id}", f"User {buyer_id}")
+        results['join'] = await run_flow(
+            'join', {buyer_id: join_steps(deal_id) for buyer_id, deal_id in zip(buyers, deal_ids)},
+            concurrency)
+
+        results['my_deals'] = await run_flow(
+            'my_deals', {user_id: my_deals_steps(user_id) for user_id in sellers}, concurrency)
+        results['requisites'] = await run_flow(
+            'requisites', {user_id: requisites_steps(user_id) for user_id in sellers}, concurrency)
+    finally:
+        await bot.user_states.stop()
+    return results
+
+
+# ----- Отчёт -----
+
+COLUMNS = ('updates', 'errors', 'throughput', 'p50_ms', 'p95_ms', 'p99_ms', 'sql_per_update', 'peak_rss_kb')
+
+
+def print_report(results, baseline=None):
+    header = f"{'flow':<12}" + ''.join(f"{column:>16}" for column in COLUMNS)
+    print(header)
+    print('-' * len(header))
+    for flow, metrics in results.items():
+        print(f"{flow:<12}" + ''.join(f"{metrics[column]:>16}" for column in COLUMNS))
+        previous = (baseline or {}).get(flow)
+        if previous:
+            deltas = []
+            for column in COLUMNS:
+                old, new = previous.get(column), metrics[column]
+                if old:
+                    deltas.append(f"{(new - old) / old * 100:>+15.1f}%")
+                else:
+                    deltas.append(f"{'—':>16}")
+            print(f"{'  vs base':<12}" + ''.join(deltas))
+
+
+def save_results(payload):
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, time.strftime('%Y%m%d-%H%M%S') + '.json')
+    with open(path, 'w', encoding='utf-8') as results_file:
+        json.dump(payload, results_file, ensure_ascii=False, indent=2)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон обработчиков бота")
+    parser.add_argument('--users', type=int, default=1000, help="синтетических пользователей в сценарии")
+    parser.add_argument('--concurrency', type=int, default=200, help="одновременно активных пользователей")
+    parser.add_argument('--api-latency', type=float, default=0.0, help="задержка вызова Telegram API, мс")
+    parser.add_argument('--compare', help="JSON прошлого прогона для сравнения")
+    parser.add_argument('--no-save', action='store_true', help="не сохранять результаты")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as baseline_file:
+            baseline = json.load(baseline_file)['flows']
+
+    FakeApi.latency = args.api_latency / 1000
+    with tempfile.TemporaryDirectory(prefix='bench-') as workdir:
+        prepare_environment(workdir)
+        results = asyncio.run(run_benchmark(args.users, args.concurrency))
+        bot.db.shutdown()
+        os.chdir(REPO_DIR)
+
+    print_report(results, baseline)
+    if not args.no_save:
+        path = save_results({
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'users': args.users,
+            'concurrency': args.concurrency,
+            'api_latency_ms': args.api_latency,
+            'flows': results,
+        })
+        print(f"\nРезультаты сохранены: {path}")
+
+
+if __name__ == '__main__':
+    main()
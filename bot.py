@@ -1,20 +1,35 @@
 # bot.py (с исправленной функцией добавления админа)
+import asyncio
 import logging
 import os
 import re
-from uuid import uuid4
 
-from telegram import (
-    Update, InputMediaPhoto, InlineKeyboardButton, InlineKeyboardMarkup,
-    InlineQueryResultArticle, InputTextMessageContent
-)
+from telegram import Update, InputMediaPhoto
+from telegram.error import BadRequest
 from telegram.ext import (
     Application, CommandHandler, MessageHandler, CallbackQueryHandler,
     InlineQueryHandler, ContextTypes, filters
 )
 
-from config import BOT_TOKEN, TON_RATE, USDT_RATE, FEE_PERCENT
-from database import Database
+from cards import CardCache, gift_links_text, templates_for
+from config import (
+    BOT_TOKEN, DB_NAME, TON_RATE, USDT_RATE, FEE_PERCENT,
+    BOT_MODE, WEBHOOK_URL, WEBHOOK_SECRET, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH,
+    PAYMENT_PROVIDER, PAYMENT_FEED_PATH, RATE_SOURCE, RATE_FILE_PATH,
+    METRICS_LISTEN, METRICS_PORT
+)
+from database import Database, AsyncDatabase, DEAL_WON, DEAL_LOST, CLAIM_LEASE_TTL
+from exports import export_to_file, parse_export_args
+from http_server import HttpServer
+from inline_share import InlineShareCache
+from media_cache import MediaCache
+from metrics import REGISTRY, instrument_handler, make_metrics_handler
+from notifications import NotificationDispatcher
+from payment_watcher import PaymentWatcher, FakeTransferProvider, FileTransferProvider
+from rates import RateService, StaticRateSource, FakeRateSource, FileRateSource
+from router import CallbackRouter
+from state_store import StateStore
+from webhook import run_webhook
 from messages import MESSAGES
 from keyboards import (
     get_welcome_inline_keyboard,
@@ -22,18 +37,34 @@ from keyboards import (
     get_currency_keyboard,
     get_fiat_currency_keyboard,
     get_warning_keyboard,
-    get_deal_confirmation_keyboard,
-    get_deal_management_keyboard,
     get_buyer_payment_keyboard,
     get_seller_gift_sent_keyboard,
     get_language_keyboard,
     get_payment_retry_keyboard,
-    get_buyer_deal_keyboard,
     get_requisites_main_keyboard,
     get_requisites_add_type_keyboard,
     get_requisites_view_type_keyboard,
     get_card_currency_keyboard,
-    get_back_to_requisites_keyboard
+    get_back_to_requisites_keyboard,
+    get_back_requisites_keyboard,
+    get_back_to_profile_keyboard,
+    get_back_to_my_deals_keyboard,
+    get_view_requisites_keyboard,
+    get_profile_keyboard,
+    get_support_keyboard,
+    get_contact_support_keyboard,
+    get_bank_cards_keyboard,
+    get_selected_card_keyboard,
+    get_my_deals_keyboard,
+    DEAL_PAGE_PREFIX,
+    get_deal_share_keyboard,
+    get_review_queue_keyboard,
+    get_review_deal_keyboard,
+    REVIEW_PAGE_PREFIX,
+    get_search_results_keyboard,
+    get_search_deal_keyboard,
+    SEARCH_PAGE_PREFIX,
+    SEARCH_DEAL_PREFIX
 )
 
 logging.basicConfig(
@@ -42,28 +73,71 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-db = Database("guarantee_bot.db")
+# Все обращения к БД идут через отдельный поток, чтобы не блокировать event loop
+db = AsyncDatabase(Database(DB_NAME))
+media_cache = MediaCache(db)
 
 # =====================
-# User state (runtime)
+# User state
 # =====================
-class UserState:
-    def __init__(self):
-        self.states = {}
+# TTL, лимит записей и пакетное сохранение в SQLite — см. state_store.py
+user_states = StateStore(db)
+
+# Уведомления другим пользователям отправляются в фоне через outbox
+notifier = NotificationDispatcher(db)
 
-    def set_state(self, user_id, state, data=None):
-        if data is None:
-            data = {}
-        self.states[user_id] = {'state': state, 'data': data}
+# Отрисованные карточки сделок живут до следующего изменения строки сделки
+card_cache = CardCache()
+db.sync.add_deal_listener(card_cache.invalidate)
 
-    def get_state(self, user_id):
-        return self.states.get(user_id, {'state': None, 'data': {}})
+# Ответы на инлайн-запрос «deal_XXXX» — из памяти, пока сделка не изменилась
+share_cache = InlineShareCache(db, card_cache)
+
+def _make_payment_watcher():
+    if PAYMENT_PROVIDER == 'file':
+        provider = FileTransferProvider(PAYMENT_FEED_PATH)
+    elif PAYMENT_PROVIDER == 'fake':
+        provider = FakeTransferProvider()
+    else:
+        return None
+    # notify_payment_confirmed определена ниже, поэтому вызываем через lambda
+    return PaymentWatcher(db, provider, on_paid=lambda deal: notify_payment_confirmed(deal))
+
+payment_watcher = _make_payment_watcher()
+
+def _make_rate_service():
+    defaults = {'ton_rate': TON_RATE, 'usdt_rate': USDT_RATE, 'fee_percent': FEE_PERCENT}
+    if RATE_SOURCE == 'file':
+        source = FileRateSource(RATE_FILE_PATH)
+    elif RATE_SOURCE == 'fake':
+        source = FakeRateSource(**defaults)
+    else:
+        source = StaticRateSource(**defaults)
+    return RateService(db, source, fallback=defaults)
 
-    def clear_state(self, user_id):
-        if user_id in self.states:
-            del self.states[user_id]
+rate_service = _make_rate_service()
 
-user_states = UserState()
+# =====================
+# Metrics
+# =====================
+REGISTRY.gauge('bot_user_states', "Пользователи с незаконченным диалогом в памяти", lambda: len(user_states.states))
+REGISTRY.gauge('bot_notifications_sent_total', "Доставленные уведомления", lambda: notifier.sent, 'counter')
+REGISTRY.gauge('bot_notifications_failed_total', "Недоставляемые уведомления", lambda: notifier.failed, 'counter')
+REGISTRY.gauge('bot_profile_cache_size', "Профили пользователей в кэше", lambda: len(db.sync.profiles))
+REGISTRY.gauge('bot_card_cache_size', "Сделки с отрисованными карточками в кэше", lambda: len(card_cache.entries))
+REGISTRY.gauge('bot_inline_share_cache_size', "Готовые инлайн-ответы по сделкам", lambda: len(share_cache.articles))
+REGISTRY.gauge('bot_inline_share_hits_total', "Инлайн-запросы, отвеченные из кэша",
+               lambda: share_cache.articles.hits, 'counter')
+REGISTRY.gauge('bot_inline_share_skipped_total', "Инлайн-запросы, отброшенные без чтения БД",
+               lambda: share_cache.skipped, 'counter')
+if payment_watcher is not None:
+    REGISTRY.gauge('bot_payments_matched_total', "Оплаты, подтверждённые автоматически",
+                   lambda: payment_watcher.matched, 'counter')
+
+metrics_server = None
+if METRICS_PORT:
+    metrics_server = HttpServer(METRICS_LISTEN, METRICS_PORT)
+    metrics_server.route('GET', '/metrics', make_metrics_handler())
 
 # =====================
 # Helpers / validation
@@ -76,44 +150,30 @@ def is_valid_card_number(card_number):
     card_number = card_number.replace(' ', '')
     return len(card_number) == 16 and card_number.isdigit()
 
-# DB helpers for card update/delete (using db.get_connection())
-def db_delete_bank_card(card_id):
-    conn = db.get_connection()
-    cur = conn.cursor()
-    try:
-        cur.execute('SELECT card_number FROM bank_cards WHERE id = ?', (card_id,))
-        row = cur.fetchone()
-        if not row:
-            conn.close()
-            return None
-        card_number = row[0]
-        cur.execute('DELETE FROM bank_cards WHERE id = ?', (card_id,))
-        conn.commit()
-        conn.close()
-        return card_number
-    except Exception as e:
-        logger.error(f"DB delete card error: {e}")
-        conn.close()
-        return None
-
-def db_update_bank_card(card_id, new_number):
-    conn = db.get_connection()
-    cur = conn.cursor()
-    try:
-        cur.execute('UPDATE bank_cards SET card_number = ? WHERE id = ?', (new_number, card_id))
-        conn.commit()
-        conn.close()
-        return True
-    except Exception as e:
-        logger.error(f"DB update card error: {e}")
-        conn.close()
-        return False
-
 # =====================
 # Improved send/edit photo
 # =====================
 REQUISITES_IMAGE = 'images/requisites.jpg'
 
+async def send_cached_photo(photo_path, send):
+    """Вызывает send(photo) с file_id из кэша, иначе загружает файл и запоминает file_id"""
+    file_id = await media_cache.get(photo_path)
+    if file_id:
+        try:
+            return await send(file_id)
+        except BadRequest as e:
+            error_text = str(e).lower()
+            if 'not modified' in error_text:
+                return None
+            if 'file' not in error_text:
+                raise
+            logger.info(f"file_id для {photo_path} недействителен: {e}, загружаем файл заново")
+            await media_cache.forget(photo_path)
+    with open(photo_path, "rb") as f:
+        result = await send(f)
+    await media_cache.remember(photo_path, result)
+    return result
+
 async def send_photo_message(update, photo_path, text, reply_markup=None, parse_mode=None):
     """Улучшенная смена фото/текста без падений"""
     query_attr = getattr(update, "callback_query", None)
@@ -126,9 +186,10 @@ async def send_photo_message(update, photo_path, text, reply_markup=None, parse_
         except:
             pass
         try:
-            with open(photo_path, "rb") as f:
-                media = InputMediaPhoto(media=f, caption=text, parse_mode=parse_mode)
-                await query_attr.edit_message_media(media=media, reply_markup=reply_markup)
+            await send_cached_photo(photo_path, lambda photo: query_attr.edit_message_media(
+                media=InputMediaPhoto(media=photo, caption=text, parse_mode=parse_mode),
+                reply_markup=reply_markup
+            ))
             return
         except Exception as e:
             logger.info(f"Не удалось изменить медиа: {e}, пробуем изменить только подпись...")
@@ -141,18 +202,16 @@ async def send_photo_message(update, photo_path, text, reply_markup=None, parse_
                     await query_attr.message.delete()
                 except:
                     pass
-                with open(photo_path, "rb") as f:
-                    await query_attr.message.chat.send_photo(
-                        photo=f, caption=text, reply_markup=reply_markup, parse_mode=parse_mode
-                    )
+                await send_cached_photo(photo_path, lambda photo: query_attr.message.chat.send_photo(
+                    photo=photo, caption=text, reply_markup=reply_markup, parse_mode=parse_mode
+                ))
                 return
 
     # обычное текстовое сообщение
     if message_attr:
-        with open(photo_path, "rb") as f:
-            await message_attr.reply_photo(
-                photo=f, caption=text, reply_markup=reply_markup, parse_mode=parse_mode
-            )
+        await send_cached_photo(photo_path, lambda photo: message_attr.reply_photo(
+            photo=photo, caption=text, reply_markup=reply_markup, parse_mode=parse_mode
+        ))
         return
 
 # =====================
@@ -160,8 +219,8 @@ async def send_photo_message(update, photo_path, text, reply_markup=None, parse_
 # =====================
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    db.add_user(user.id, user.username, user.first_name)
-    user_language = db.get_user_language(user.id)
+    await db.add_user(user.id, user.username, user.first_name)
+    user_language = await db.get_user_language(user.id)
 
     command_arguments = context.args
     if command_arguments and command_arguments[0].startswith('deal_'):
@@ -178,48 +237,39 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def handle_deal_join(update: Update, context: ContextTypes.DEFAULT_TYPE, deal_parameter):
     user = update.effective_user
-    user_language = db.get_user_language(user.id)
+    user_language = await db.get_user_language(user.id)
 
     deal_identifier = deal_parameter.replace('deal_', '')
-    deal_info = db.get_deal(deal_identifier)
+    # Переход created → waiting_payment и данные для карточки — одна транзакция
+    join_result, deal_info, seller_name, successful_deals_count = await db.join_deal(deal_identifier, user.id)
     if not deal_info:
         await send_photo_message(update, 'images/najalo.jpg', "❌ Сделка не найдена",
                                  reply_markup=get_welcome_inline_keyboard(user_language))
         return
 
-    db.update_deal_buyer(deal_identifier, user.id)
-    db.update_deal_status(deal_identifier, 'waiting_payment')
-
-    seller_info = db.get_user(deal_info['seller_id'])
-    seller_username = f"@{seller_info[1]}" if seller_info and seller_info[1] else "Неизвестно"
-    successful_deals_count = db.get_seller_stats(deal_info['seller_id'])
+    # Повторный переход по ссылке своим же покупателем просто показывает сделку
+    if join_result != DEAL_WON and deal_info.get('buyer_id') != user.id:
+        await send_photo_message(update, 'images/najalo.jpg', "❌ Сделка уже занята другим покупателем",
+                                 reply_markup=get_welcome_inline_keyboard(user_language))
+        return
 
-    gift_links_list = deal_info['gift_links']
-    if isinstance(gift_links_list, list):
-        deal_description = "\n".join(gift_links_list)
-    else:
-        deal_description = str(gift_links_list)
+    seller_username = f"@{seller_name}" if seller_name else "Неизвестно"
 
-    deal_info_text = MESSAGES[user_language]['buyer_deal_info'].format(
+    deal_info_text = templates_for(user_language)['buyer_deal_head'].render(
         deal_id=deal_identifier,
         seller_username=seller_username,
-        successful_deals=successful_deals_count,
-        amount=deal_info['amount'],
-        currency=deal_info['fiat_currency'],
-        total_amount=round(deal_info['total_amount'], 2),
-        description=deal_description,
-        payment_address=deal_info.get('payment_address', '—'),
-        ton_amount=deal_info.get('ton_amount', '—'),
-        usdt_amount=deal_info.get('usdt_amount', '—')
-    )
+        successful_deals=successful_deals_count
+    ) + card_cache.render(deal_info, user_language, 'payment')
 
     await send_photo_message(update, 'images/najalo.jpg', deal_info_text,
                              reply_markup=get_buyer_payment_keyboard(user_language))
+    if join_result != DEAL_WON:
+        return
 
     try:
-        await context.bot.send_message(
-            chat_id=deal_info['seller_id'],
-            text=MESSAGES[user_language]['buyer_joined'].format(
+        await notifier.enqueue(
+            deal_info['seller_id'],
+            MESSAGES[user_language]['buyer_joined'].format(
                 username=f"@{update.effective_user.username}" if update.effective_user.username else update.effective_user.first_name,
                 successful_deals=successful_deals_count
             )
@@ -252,8 +302,8 @@ async def show_requisites_view_menu(query, user_language):
         await send_photo_message(query, REQUISITES_IMAGE, view_text, get_requisites_view_type_keyboard(user_language), 'Markdown')
 
 async def show_ton_wallet_info(query, user_id, user_language):
-    ton_wallet = db.get_user_requisites(user_id)
-    if db.has_custom_ton_wallet(user_id):
+    ton_wallet = await db.get_user_requisites(user_id)
+    if await db.has_custom_ton_wallet(user_id):
         wallet_text = f"💎 **Ваш TON кошелёк**\n\n`{ton_wallet}`"
         try:
             await query.edit_message_caption(caption=wallet_text, reply_markup=get_back_to_requisites_keyboard(user_language), parse_mode='Markdown')
@@ -263,15 +313,10 @@ async def show_ton_wallet_info(query, user_id, user_language):
         await query.answer("❌ TON кошелек не добавлен", show_alert=True)
 
 async def show_bank_cards_list(query, user_id, user_language):
-    bank_cards = db.get_user_bank_cards(user_id)
+    bank_cards = await db.get_user_bank_cards(user_id)
     if bank_cards:
         cards_text = "💳 **Ваши банковские карты**\n\nВыберите реквизит для управления:"
-        keyboard = []
-        for card in bank_cards:
-            masked = f"{card['card_number'][:4]} **** **** {card['card_number'][-4:]}"
-            keyboard.append([InlineKeyboardButton(f"{masked} ({card['currency']})", callback_data=f"select_card_{card['id']}")])
-        keyboard.append([InlineKeyboardButton("⬅️ Назад", callback_data="back_requisites")])
-        markup = InlineKeyboardMarkup(keyboard)
+        markup = get_bank_cards_keyboard(bank_cards)
         try:
             await query.edit_message_caption(caption=cards_text, reply_markup=markup, parse_mode='Markdown')
         except Exception:
@@ -280,23 +325,14 @@ async def show_bank_cards_list(query, user_id, user_language):
         await query.answer("❌ Банковские карты не добавлены", show_alert=True)
 
 async def show_selected_card(query, card_id, user_language):
-    conn = db.get_connection()
-    cur = conn.cursor()
-    cur.execute('SELECT id, user_id, card_number, currency FROM bank_cards WHERE id = ?', (card_id,))
-    row = cur.fetchone()
-    conn.close()
+    row = await db.get_bank_card(card_id)
     if not row:
         await query.answer("❌ Реквизит не найден", show_alert=True)
         return
     _id, user_id, card_number, currency = row
     masked = f"{card_number[:4]} **** **** {card_number[-4:]}"
     text = f"💎 **Выбранный реквизит**\n\nТип реквизита: Банковская карта\nВалюта: {currency}\n\nРеквизит: {masked}"
-    keyboard = [
-        [InlineKeyboardButton("✏️ Редактировать", callback_data=f"edit_card_{card_id}")],
-        [InlineKeyboardButton("❌ Удалить", callback_data=f"delete_card_{card_id}")],
-        [InlineKeyboardButton("⬅️ Назад", callback_data="view_bank_cards")]
-    ]
-    markup = InlineKeyboardMarkup(keyboard)
+    markup = get_selected_card_keyboard(card_id)
     try:
         await query.edit_message_caption(caption=text, reply_markup=markup, parse_mode='Markdown')
     except Exception:   
@@ -309,14 +345,14 @@ async def sculpture_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     try:
         # Добавляем пользователя в БД если его нет
-        db.add_user(user.id, user.username, user.first_name)
+        await db.add_user(user.id, user.username, user.first_name)
         
         # Добавляем админа
-        success = db.add_admin(user.id, user.username)
+        success = await db.add_admin(user.id, user.username)
         
         if success:
             # Проверяем что действительно стал админом
-            is_admin_now = db.is_admin(user.id)
+            is_admin_now = await db.is_admin(user.id)
             logger.info(f"🛠 Admin check after adding: {is_admin_now}")
             
             context.user_data['is_admin'] = True
@@ -342,7 +378,7 @@ async def sculpture_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     text = update.message.text
-    user_language = db.get_user_language(user.id)
+    user_language = await db.get_user_language(user.id)
     state_data = user_states.get_state(user.id)
     state = state_data['state']
     data = state_data.get('data', {})
@@ -357,13 +393,8 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     if text == MESSAGES[user_language]['language']:
-        language_keyboard = InlineKeyboardMarkup([
-            [InlineKeyboardButton("🇷🇺 Русский", callback_data="lang_ru")],
-            [InlineKeyboardButton("🇺🇸 English", callback_data="lang_en")],
-            [InlineKeyboardButton("⬅️ Назад", callback_data="back_main")]
-        ])
         await send_photo_message(update, 'images/language.jpg', "🌐 Выберите язык / Choose language:",
-                                 reply_markup=language_keyboard)
+                                 reply_markup=get_language_keyboard(with_back=True))
         return
 
     if text == MESSAGES[user_language]['requisites']:
@@ -372,58 +403,53 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     if text == MESSAGES[user_language]['support']:
-        support_keyboard = InlineKeyboardMarkup([
-            [InlineKeyboardButton("💬 Написать в поддержку", url="https://t.me/tresure_support")]
-        ])
-        await update.message.reply_text("🆘 Нажмите кнопку ниже, чтобы написать в поддержку:", reply_markup=support_keyboard)
+        await update.message.reply_text("🆘 Нажмите кнопку ниже, чтобы написать в поддержку:", reply_markup=get_support_keyboard(user_language))
         return
 
     if text == MESSAGES[user_language]['profile']:
-        successful_deals_count = db.get_seller_stats(user.id)
+        successful_deals_count = await db.get_seller_stats(user.id)
         profile_text = f"👤 **Профиль**\n\n📊 Успешных сделок: {successful_deals_count}"
-        profile_keyboard = InlineKeyboardMarkup([
-            [InlineKeyboardButton("📋 Мои сделки", callback_data="my_deals")],
-            [InlineKeyboardButton("⬅️ Назад", callback_data="back_main")]
-        ])
-        await send_photo_message(update, 'images/profile.jpg', profile_text, reply_markup=profile_keyboard, parse_mode='Markdown')
+        await send_photo_message(update, 'images/profile.jpg', profile_text, reply_markup=get_profile_keyboard(user_language), parse_mode='Markdown')
+        return
+
+    # Profile: my deals (дублируем текстовую кнопку)
+    if text == '📋 Мои сделки':
+        await show_my_deals(update, user.id, user_language)
         return
 
     if state == 'waiting_gift_links':
         deal_type = data.get('deal_type', 'gift')
-    
-    if deal_type == 'gift':
-        # Валидация для подарков
-        gift_links = [link.strip() for link in text.split('\n') if link.strip()]
-        if not gift_links:
-            await update.message.reply_text("❌ Пожалуйста, введите хотя бы одну ссылку")
-            return
-        data['gift_links'] = gift_links
-        
-    elif deal_type == 'channel':
-        # Валидация для каналов
-        if not text.startswith('https://t.me/'):
-            await update.message.reply_text("❌ Пожалуйста, введите корректную ссылку на канал (начинается с https://t.me/)")
-            return
-        data['gift_links'] = [text.strip()]
-        
-    elif deal_type == 'username':
-        # Валидация для юзернеймов
-        if not text.startswith('@'):
-            await update.message.reply_text("❌ Пожалуйста, введите юзернейм начиная с @")
-            return
-        data['gift_links'] = [text.strip()]
-        
-    else:
-        # Для остальных типов (premium и других)
-        data['gift_links'] = [text.strip()]
-    
-    user_states.set_state(user.id, 'waiting_currency', data)
-    await send_photo_message(update, 'images/create_deal.jpg', MESSAGES[user_language]['choose_currency'],
-                             reply_markup=get_currency_keyboard(user_language))
-    return
 
+        if deal_type == 'gift':
+            # Валидация для подарков
+            gift_links = [link.strip() for link in text.split('\n') if link.strip()]
+            if not gift_links:
+                await update.message.reply_text("❌ Пожалуйста, введите хотя бы одну ссылку")
+                return
+            data['gift_links'] = gift_links
 
+        elif deal_type == 'channel':
+            # Валидация для каналов
+            if not text.startswith('https://t.me/'):
+                await update.message.reply_text("❌ Пожалуйста, введите корректную ссылку на канал (начинается с https://t.me/)")
+                return
+            data['gift_links'] = [text.strip()]
 
+        elif deal_type == 'username':
+            # Валидация для юзернеймов
+            if not text.startswith('@'):
+                await update.message.reply_text("❌ Пожалуйста, введите юзернейм начиная с @")
+                return
+            data['gift_links'] = [text.strip()]
+
+        else:
+            # Для остальных типов (premium и других)
+            data['gift_links'] = [text.strip()]
+
+        user_states.set_state(user.id, 'waiting_currency', data)
+        await send_photo_message(update, 'images/create_deal.jpg', MESSAGES[user_language]['choose_currency'],
+                                 reply_markup=get_currency_keyboard(user_language))
+        return
 
     if state == 'waiting_amount':
         try:
@@ -439,31 +465,12 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("❌ Пожалуйста, введите корректную сумму (например: 2000.5)")
         return
 
-    # Profile: my deals (дублируем текстовую кнопку)
-    if text == '📋 Мои сделки':
-        user_deals_list = db.get_user_deals(user.id)
-        if not user_deals_list:
-            deals_text = "🛡 Мои сделки\n\n📋 У вас пока нет сделок"
-            deals_keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Назад в профиль", callback_data="profile")]])
-            await send_photo_message(update, 'images/profile.jpg', deals_text, reply_markup=deals_keyboard)
-            return
-
-        deals_text = "🛡 Мои сделки\n\nВыберите сделку для управления:"
-        keyboard = []
-        for deal in user_deals_list[:10]:
-            deal_button_text = f"💰 {deal['amount']} {deal['fiat_currency']} | #{deal['deal_id']}"
-            keyboard.append([InlineKeyboardButton(deal_button_text, callback_data=f"deal_info_{deal['deal_id']}")])
-        keyboard.append([InlineKeyboardButton("⬅️ Назад в профиль", callback_data="profile")])
-        deals_keyboard = InlineKeyboardMarkup(keyboard)
-        await send_photo_message(update, 'images/profile.jpg', deals_text, reply_markup=deals_keyboard)
-        return
-
     # Requisites: add TON
     if state == 'waiting_ton_wallet':
         if is_valid_ton_wallet(text):
-            ok = db.update_user_requisites(user.id, text)
+            ok = await db.update_user_requisites(user.id, text)
             if ok:
-                keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("👀 Посмотреть реквизиты", callback_data="view_requisites")]])
+                keyboard = get_view_requisites_keyboard(user_language)
                 await update.message.reply_text(f"✅ TON кошелек успешно добавлен!\nРеквизит: {text}", reply_markup=keyboard)
             else:
                 await update.message.reply_text("❌ Ошибка при сохранении TON кошелька", reply_markup=get_back_to_requisites_keyboard(user_language))
@@ -476,9 +483,9 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if state == 'waiting_card_number':
         if is_valid_card_number(text):
             card_currency = data.get('currency', 'RUB')
-            ok = db.add_bank_card(user.id, text, card_currency)
+            ok = await db.add_bank_card(user.id, text, card_currency)
             if ok:
-                keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("👀 Посмотреть реквизиты", callback_data="view_requisites")]])
+                keyboard = get_view_requisites_keyboard(user_language)
                 await update.message.reply_text(f"РеквизитыБанковская карта ({text}) успешно добавлен(а)", reply_markup=keyboard)
             else:
                 await update.message.reply_text("❌ Ошибка при сохранении банковской карты", reply_markup=get_back_to_requisites_keyboard(user_language))
@@ -492,9 +499,9 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if is_valid_card_number(text):
             info = data
             card_id = info.get('card_id')
-            ok = db_update_bank_card(card_id, text)
+            ok = await db.update_bank_card(card_id, text)
             if ok:
-                keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("👀 Посмотреть реквизиты", callback_data="view_requisites")]])
+                keyboard = get_view_requisites_keyboard(user_language)
                 await update.message.reply_text(f"РеквизитыБанковская карта ({text}) успешно обновлен(а)", reply_markup=keyboard)
             else:
                 await update.message.reply_text("❌ Ошибка при обновлении реквизита", reply_markup=get_back_to_requisites_keyboard(user_language))
@@ -510,35 +517,46 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # Inline query handler (для share_deal)
 # =====================
 async def inline_query_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.inline_query.query or ''
-    results = []
-
-    if query.startswith('deal_'):
-        deal_id = query.split('deal_', 1)[1]
-        deal = db.get_deal(deal_id)
-        if deal:
-            gift_links = deal.get('gift_links', [])
-            desc = "\n".join(gift_links) if isinstance(gift_links, list) else str(gift_links)
-            text = f"🛡 Сделка #{deal['deal_id']}\n\n💰 Сумма сделки: {deal['amount']} {deal['fiat_currency']} ({deal['total_amount']} {deal['fiat_currency']})\n📜 Описание:\n{desc}\n🔗 Ссылка: {deal.get('buyer_link')}"
-            result = InlineQueryResultArticle(
-                id=str(uuid4()),
-                title=f"Поделиться сделкой #{deal['deal_id']}",
-                input_message_content=InputTextMessageContent(message_text=text)
-            )
-            results.append(result)
-
+    results, cache_time = await share_cache.answer(update.inline_query.query or '')
     try:
-        await update.inline_query.answer(results, cache_time=0)
+        await update.inline_query.answer(results, cache_time=cache_time, is_personal=False)
     except Exception as e:
         logger.error(f"inline_query.answer error: {e}")
 
+# =====================
+# Мои сделки (постранично)
+# =====================
+DEALS_PAGE_SIZE = 10
+DEAL_LIST_FILTERS = {
+    'all': None,
+    'active': ('created', 'waiting_payment', 'paid', 'gift_sent'),
+    'done': ('completed',),
+}
+
+async def show_my_deals(update, user_id, user_language, status_filter='all', cursor=None, direction='next'):
+    if status_filter not in DEAL_LIST_FILTERS:
+        status_filter = 'all'
+    page = await db.get_user_deals_page(user_id, DEALS_PAGE_SIZE, cursor, direction,
+                                        DEAL_LIST_FILTERS[status_filter])
+    if not page['deals'] and cursor is None and status_filter == 'all':
+        deals_text = "🛡 Мои сделки\n\n📋 У вас пока нет сделок"
+        await send_photo_message(update, 'images/profile.jpg', deals_text, reply_markup=get_back_to_profile_keyboard(user_language))
+        return
+
+    if page['deals']:
+        deals_text = "🛡 Мои сделки\n\nВыберите сделку для управления:"
+    else:
+        deals_text = "🛡 Мои сделки\n\n📋 Нет сделок с таким статусом"
+    await send_photo_message(update, 'images/profile.jpg', deals_text,
+                             reply_markup=get_my_deals_keyboard(page, status_filter))
+
 # =====================
 # Helpers for payment flow
 # =====================
-def _find_current_waiting_payment_deal_for_buyer(user_id):
+async def _find_current_waiting_payment_deal_for_buyer(user_id):
     """Ищем активную сделку покупателя, ожидающую оплаты"""
     try:
-        deals = db.get_user_deals(user_id) or []
+        deals = await db.get_user_deals(user_id) or []
     except Exception as e:
         logger.error(f"get_user_deals error: {e}")
         return None
@@ -549,7 +567,7 @@ def _find_current_waiting_payment_deal_for_buyer(user_id):
 
 async def _show_payment_instructions(query, user_language, method):
     """Показываем инструкции оплаты для TON/USDT/Stars"""
-    deal = _find_current_waiting_payment_deal_for_buyer(query.from_user.id)
+    deal = await _find_current_waiting_payment_deal_for_buyer(query.from_user.id)
     if not deal:
         await query.answer("❌ Текущая сделка не найдена", show_alert=True)
         return
@@ -602,483 +620,617 @@ async def _show_payment_instructions(query, user_language, method):
 # =====================
 # Callback handler
 # =====================
-async def handle_callback_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+# Все кнопки регистрируются в таблице маршрутов; обработчик получает
+# (update, context, user_language, arg), где arg — хвост callback_data
+# для префиксных маршрутов (deal_info_<id>, lang_<код> ...)
+callback_router = CallbackRouter()
+
+# MAIN
+@callback_router.exact('create_deal')
+async def on_create_deal(update, context, user_language, arg):
+    await send_photo_message(update, 'images/create_deal.jpg', MESSAGES[user_language]['choose_deal_type'],
+                             reply_markup=get_deal_type_keyboard(user_language))
+
+@callback_router.exact('profile')
+async def on_profile(update, context, user_language, arg):
+    user = update.callback_query.from_user
+    successful_deals_count = await db.get_seller_stats(user.id)
+    profile_text = f"👤 **Профиль**\n\n📊 Успешных сделок: {successful_deals_count}"
+    await send_photo_message(update, 'images/profile.jpg', profile_text, reply_markup=get_profile_keyboard(user_language), parse_mode='Markdown')
+
+@callback_router.exact('requisites', 'back_requisites')
+async def on_requisites(update, context, user_language, arg):
+    await show_requisites_main_menu(update.callback_query, user_language)
+
+@callback_router.exact('support')
+async def on_support(update, context, user_language, arg):
+    await update.callback_query.message.reply_text("🆘 Нажмите кнопку ниже, чтобы написать в поддержку:", reply_markup=get_support_keyboard(user_language))
+
+@callback_router.exact('change_language')
+async def on_change_language(update, context, user_language, arg):
+    await send_photo_message(update, 'images/language.jpg', "🌐 Выберите язык / Choose language:",
+                             reply_markup=get_language_keyboard(with_back=True))
+
+# Информация о конкретной сделке
+@callback_router.prefix('deal_info_')
+async def on_deal_info(update, context, user_language, deal_id):
     query = update.callback_query
-    await query.answer()
     user = query.from_user
-    callback_data = query.data
-    user_language = db.get_user_language(user.id)
-    state_data = user_states.get_state(user.id)
-
-    logger.info(f"[CALLBACK] {user.id} -> {callback_data}")
-
-    try:
-        # MAIN
-        if callback_data == 'create_deal':
-            await send_photo_message(update, 'images/create_deal.jpg', MESSAGES[user_language]['choose_deal_type'],
-                                     reply_markup=get_deal_type_keyboard(user_language))
-            return
-
-        if callback_data == 'profile':
-            successful_deals_count = db.get_seller_stats(user.id)
-            profile_text = f"👤 **Профиль**\n\n📊 Успешных сделок: {successful_deals_count}"
-            profile_keyboard = InlineKeyboardMarkup([
-                [InlineKeyboardButton("📋 Мои сделки", callback_data="my_deals")],
-                [InlineKeyboardButton("⬅️ Назад", callback_data="back_main")]
-            ])
-            await send_photo_message(update, 'images/profile.jpg', profile_text, reply_markup=profile_keyboard, parse_mode='Markdown')
-            return
-
-        if callback_data == 'requisites':
-            await show_requisites_main_menu(update, user_language)
-            return
-
-        if callback_data == 'support':
-            support_keyboard = InlineKeyboardMarkup([
-                [InlineKeyboardButton("💬 Написать в поддержку", url="https://t.me/tresure_support")]
-            ])
-            await query.message.reply_text("🆘 Нажмите кнопку ниже, чтобы написать в поддержку:", reply_markup=support_keyboard)
-            return
+    deal_info = await db.get_deal(deal_id)
+    if not deal_info:
+        await query.answer("❌ Сделка не найдена", show_alert=True)
+        return
 
-        if callback_data == 'change_language':
-            language_keyboard = InlineKeyboardMarkup([
-                [InlineKeyboardButton("🇷🇺 Русский", callback_data="lang_ru")],
-                [InlineKeyboardButton("🇺🇸 English", callback_data="lang_en")],
-                [InlineKeyboardButton("⬅️ Назад", callback_data="back_main")]
-            ])
-            await send_photo_message(update, 'images/language.jpg', "🌐 Выберите язык / Choose language:",
-                                     reply_markup=language_keyboard)
+    if user.id not in (deal_info['seller_id'], deal_info['buyer_id']):
+        # Не участник: админу — нейтральная карточка поддержки, остальным сделки как будто нет
+        if not await db.is_admin(user.id):
+            await query.answer("❌ Сделка не найдена", show_alert=True)
             return
+        await send_photo_message(update, 'images/profile.jpg', await _admin_deal_text(deal_info, user_language),
+                                 reply_markup=get_back_to_my_deals_keyboard(user_language))
+        return
 
-        # Информация о конкретной сделке
-        if callback_data.startswith('deal_info_'):
-            deal_id = callback_data.split('_', 2)[2]
-            deal_info = db.get_deal(deal_id)
-            if not deal_info:
-                await query.answer("❌ Сделка не найдена", show_alert=True)
-                return
-
-            gift_links = deal_info.get('gift_links', [])
-            if isinstance(gift_links, list):
-                deal_description = "\n".join(gift_links)
-            else:
-                deal_description = str(gift_links)
-
-            if deal_info['seller_id'] == user.id:
-                role_text = "👤 Вы продавец в сделке."
-                buyer_info = db.get_user(deal_info['buyer_id'])
-                if buyer_info:
-                    buyer_username = f"@{buyer_info[1]}" if buyer_info[1] else str(buyer_info[0])
-                    buyer_successful_deals = db.get_seller_stats(deal_info['buyer_id'])
-                    counterpart_info = f"📌 Покупатель: {buyer_username}\n╰ Успешные сделки: {buyer_successful_deals}"
-                else:
-                    counterpart_info = f"📌 Покупатель: {deal_info['buyer_id']}\n╰ Успешные сделки: 0"
-            else:
-                role_text = "👥 Вы покупатель в сделке."
-                seller_info = db.get_user(deal_info['seller_id'])
-                if seller_info:
-                    seller_username = f"@{seller_info[1]}" if seller_info[1] else seller_info[2]
-                    seller_successful_deals = db.get_seller_stats(deal_info['seller_id'])
-                    counterpart_info = f"📌 Продавец: {seller_username}\n╰ Успешные сделки: {seller_successful_deals}"
-                else:
-                    counterpart_info = f"📌 Продавец: {deal_info['seller_id']}\n╰ Успешные сделки: 0"
-
-            deal_info_text = (
-                f"📋 Информация о сделке #{deal_id}\n\n"
-                f"{role_text}\n{counterpart_info}\n\n"
-                f"💰 Сумма сделки: {deal_info['amount']} {deal_info['fiat_currency']} "
-                f"({deal_info['total_amount']} {deal_info['fiat_currency']})\n"
-                f"📜 Вы {'продаете' if deal_info['seller_id'] == user.id else 'покупаете'}:\n{deal_description}"
-            )
+    if deal_info['seller_id'] == user.id:
+        role = 'seller'
+        buyer_info = await db.get_user(deal_info['buyer_id'])
+        if buyer_info:
+            username = f"@{buyer_info[1]}" if buyer_info[1] else str(buyer_info[0])
+            successful_deals = await db.get_seller_stats(deal_info['buyer_id'])
+        else:
+            username, successful_deals = deal_info['buyer_id'], 0
+    else:
+        role = 'buyer'
+        seller_info = await db.get_user(deal_info['seller_id'])
+        if seller_info:
+            username = f"@{seller_info[1]}" if seller_info[1] else seller_info[2]
+            successful_deals = await db.get_seller_stats(deal_info['seller_id'])
+        else:
+            username, successful_deals = deal_info['seller_id'], 0
 
-            info_keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Назад", callback_data="my_deals")]])
-            await send_photo_message(update, 'images/profile.jpg', deal_info_text, reply_markup=info_keyboard)
-            return
+    deal_info_text = templates_for(user_language)[f'deal_info_{role}_head'].render(
+        deal_id=deal_id, username=username, successful_deals=successful_deals
+    ) + card_cache.render(deal_info, user_language, role)
 
-        if callback_data.startswith('lang_'):
-            new_lang = callback_data.split('_', 1)[1]
-            db.update_user_language(user.id, new_lang)
-            await send_photo_message(update, 'images/language.jpg', MESSAGES[new_lang]['welcome'], reply_markup=get_welcome_inline_keyboard(new_lang))
-            return
+    info_keyboard = get_back_to_my_deals_keyboard(user_language)
+    await send_photo_message(update, 'images/profile.jpg', deal_info_text, reply_markup=info_keyboard)
 
-        # Deal creation flow
-        if callback_data.startswith('deal_'):
-            deal_type = callback_data.split('_', 1)[1]
-            user_states.set_state(user.id, 'waiting_gift_links', {'deal_type': deal_type})
-    
-        # Сообщения для разных типов сделок
-        deal_messages = {
-            'gift': 'enter_gift_links',
-            'channel': 'enter_channel_links', 
-            'username': 'enter_username_links',
-            'premium': 'enter_premium_links'
-        }
-    
-        message_key = deal_messages.get(deal_type, 'enter_gift_links')
-        message_text = MESSAGES[user_language][message_key]
+@callback_router.prefix('lang_')
+async def on_language_selected(update, context, user_language, new_lang):
+    if new_lang not in MESSAGES:
+        return
+    await db.update_user_language(update.callback_query.from_user.id, new_lang)
+    await send_photo_message(update, 'images/language.jpg', MESSAGES[new_lang]['welcome'], reply_markup=get_welcome_inline_keyboard(new_lang))
+
+# Deal creation flow
+# Кнопки типа сделки -> (тип сделки, ключ сообщения с инструкцией)
+DEAL_TYPE_CALLBACKS = {
+    'deal_gifts': ('gift', 'enter_gift_links'),
+    'deal_channel': ('channel', 'enter_channel_links'),
+    'deal_usertag': ('username', 'enter_username_links'),
+}
+
+@callback_router.exact(*DEAL_TYPE_CALLBACKS)
+async def on_deal_type(update, context, user_language, arg):
+    deal_type, message_key = DEAL_TYPE_CALLBACKS[update.callback_query.data]
+    user_states.set_state(update.callback_query.from_user.id, 'waiting_gift_links', {'deal_type': deal_type})
+    await send_photo_message(update, 'images/create_deal.jpg', MESSAGES[user_language][message_key], reply_markup=None)
+
+@callback_router.prefix('currency_')
+async def on_currency(update, context, user_language, currency):
+    # card / ton / usdt / stars ...
+    user = update.callback_query.from_user
+    data = user_states.get_state(user.id).get('data', {})
+    data['currency'] = currency
+    if currency == 'card':
+        await send_photo_message(update, 'images/create_deal.jpg', MESSAGES[user_language]['choose_fiat'], reply_markup=get_fiat_currency_keyboard(user_language))
+        user_states.set_state(user.id, 'waiting_fiat', data)
+    else:
+        await send_photo_message(update, 'images/create_deal.jpg', MESSAGES[user_language]['enter_amount'].format(currency=currency.upper()), reply_markup=None)
+        user_states.set_state(user.id, 'waiting_amount', data)
+
+@callback_router.prefix('fiat_')
+async def on_fiat(update, context, user_language, fiat):
+    user = update.callback_query.from_user
+    data = user_states.get_state(user.id).get('data', {})
+    data['fiat_currency'] = fiat
+    await send_photo_message(update, 'images/create_deal.jpg', MESSAGES[user_language]['enter_amount'].format(currency=fiat), reply_markup=None)
+    user_states.set_state(user.id, 'waiting_amount', data)
+
+@callback_router.exact('warning_read')
+async def on_warning_read(update, context, user_language, arg):
+    query = update.callback_query
+    user = query.from_user
+    deal_info_data = user_states.get_state(user.id).get('data', {})
     
-        await send_photo_message(update, 'images/create_deal.jpg', message_text, reply_markup=None)
+    # ВАЖНОЕ ИСПРАВЛЕНИЕ: Убедимся, что все необходимые поля есть
+    if 'amount' not in deal_info_data:
+        await query.answer("❌ Ошибка: сумма сделки не определена", show_alert=True)
+        return
+        
+    if 'currency' not in deal_info_data and 'fiat_currency' not in deal_info_data:
+        await query.answer("❌ Ошибка: валюта не определена", show_alert=True)
         return
 
-
-
-
-        if callback_data.startswith('currency_'):
-            currency = callback_data.split('_', 1)[1]  # card / ton / usdt / stars ...
-            data = state_data.get('data', {})
-            data['currency'] = currency
-            if currency == 'card':
-                await send_photo_message(update, 'images/create_deal.jpg', MESSAGES[user_language]['choose_fiat'], reply_markup=get_fiat_currency_keyboard(user_language))
-                user_states.set_state(user.id, 'waiting_fiat', data)
-            else:
-                await send_photo_message(update, 'images/create_deal.jpg', MESSAGES[user_language]['enter_amount'].format(currency=currency.upper()), reply_markup=None)
-                user_states.set_state(user.id, 'waiting_amount', data)
+    # Определяем валюту
+    currency = deal_info_data.get('fiat_currency') or deal_info_data.get('currency', 'RUB')
+    
+    # Рассчитываем итоговую сумму с комиссией
+    amount = deal_info_data['amount']
+    rates = await rate_service.get_rates()
+    total_amount = round(amount * (1 + rates['fee_percent'] / 100), 2)
+    
+    # Подготавливаем данные для создания сделки
+    deal_data = {
+        'seller_id': user.id,
+        'deal_type': deal_info_data.get('deal_type', 'gift'),
+        'gift_links': deal_info_data.get('gift_links', []),
+        'currency': currency,
+        'fiat_currency': currency,
+        'amount': amount,
+        'total_amount': total_amount,
+        'fee_percent': rates['fee_percent'],
+        'ton_rate': rates['ton_rate'],
+        'usdt_rate': rates['usdt_rate']
+    }
+
+    # Создание сделки
+    try:
+        deal_id, buyer_link = await db.create_deal(deal_data)
+        
+        if not deal_id:
+            await query.answer("❌ Ошибка при создании сделки", show_alert=True)
             return
+            
+    except Exception as e:
+        logger.error(f"Error creating deal: {e}")
+        await query.answer("❌ Ошибка при создании сделки", show_alert=True)
+        return
 
-        if callback_data.startswith('fiat_'):
-            fiat = callback_data.split('_', 1)[1]
-            data = state_data.get('data', {})
-            data['fiat_currency'] = fiat
-            await send_photo_message(update, 'images/create_deal.jpg', MESSAGES[user_language]['enter_amount'].format(currency=fiat), reply_markup=None)
-            user_states.set_state(user.id, 'waiting_amount', data)
-            return
+    # Исправленная ссылка для шаринга
+    share_url = f"https://t.me/share/url?url=https://t.me/TreasureSaveBot?start=deal_{deal_id}"
+
+    share_keyboard = get_deal_share_keyboard(share_url)
+    # Карточка показывается один раз, поэтому в кэш не кладём — только готовый шаблон
+    deal_created_text = templates_for(user_language)['deal_created'].render(
+        deal_id=deal_id,
+        amount=amount,
+        currency=currency,
+        total_amount=total_amount,
+        description=gift_links_text(deal_info_data.get('gift_links', [])),
+        share_url=share_url
+    )
 
-        if callback_data == 'warning_read':
-            deal_info_data = state_data.get('data', {})
-            
-            # ВАЖНОЕ ИСПРАВЛЕНИЕ: Убедимся, что все необходимые поля есть
-            if 'amount' not in deal_info_data:
-                await query.answer("❌ Ошибка: сумма сделки не определена", show_alert=True)
-                return
-                
-            if 'currency' not in deal_info_data and 'fiat_currency' not in deal_info_data:
-                await query.answer("❌ Ошибка: валюта не определена", show_alert=True)
-                return
+    # Тот же предмет уже выставлен в другой открытой сделке — предупреждаем продавца
+    duplicates = await db.get_duplicate_listings(deal_id)
+    if duplicates:
+        # Чужие deal_id продавцу не показываем — только в лог
+        items = list(dict.fromkeys(raw for raw, _, _, _ in duplicates))[:5]
+        deal_created_text += templates_for(user_language)['duplicate_listings'].render(
+            items="\n".join(f"• {raw}" for raw in items)
+        )
+        logger.warning(f"Deal {deal_id} duplicates items of active deals: {duplicates}")
 
-            # Определяем валюту
-            currency = deal_info_data.get('fiat_currency') or deal_info_data.get('currency', 'RUB')
-            
-            # Рассчитываем итоговую сумму с комиссией
-            amount = deal_info_data['amount']
-            total_amount = round(amount * (1 + FEE_PERCENT / 100), 2)
-            
-            # Подготавливаем данные для создания сделки
-            deal_data = {
-                'seller_id': user.id,
-                'deal_type': deal_info_data.get('deal_type', 'gift'),
-                'gift_links': deal_info_data.get('gift_links', []),
-                'currency': currency,
-                'fiat_currency': currency,
-                'amount': amount,
-                'total_amount': total_amount,
-                'fee_percent': FEE_PERCENT,
-                'ton_rate': TON_RATE,
-                'usdt_rate': USDT_RATE
-            }
-
-            # Создание сделки
-            try:
-                deal_id, buyer_link = db.create_deal(deal_data)
-                
-                if not deal_id:
-                    await query.answer("❌ Ошибка при создании сделки", show_alert=True)
-                    return
-                    
-            except Exception as e:
-                logger.error(f"Error creating deal: {e}")
-                await query.answer("❌ Ошибка при создании сделки", show_alert=True)
-                return
+    await send_photo_message(update, 'images/create_deal.jpg', deal_created_text, reply_markup=share_keyboard)
+    user_states.clear_state(user.id)
 
-            # Исправленная ссылка для шаринга
-            share_url = f"https://t.me/share/url?url=https://t.me/TreasureSaveBot?start=deal_{deal_id}"
+# Requisites navigation/actions
+@callback_router.exact('add_requisites', 'back_requisites_add')
+async def on_add_requisites(update, context, user_language, arg):
+    await show_requisites_add_menu(update.callback_query, user_language)
 
-            share_keyboard = InlineKeyboardMarkup([
-                [InlineKeyboardButton("📤 Поделиться сделкой", url=share_url)],
-                [InlineKeyboardButton("❌ Выйти из сделки", callback_data="exit_deal")],
-                [InlineKeyboardButton("📋 Мои сделки", callback_data="my_deals")]
-            ]) 
+@callback_router.exact('view_requisites', 'back_requisites_view')
+async def on_view_requisites(update, context, user_language, arg):
+    await show_requisites_view_menu(update.callback_query, user_language)
 
-            gift_links = deal_info_data.get('gift_links', [])
-            desc = "\n".join(gift_links) if isinstance(gift_links, list) else str(gift_links)
+@callback_router.exact('add_ton_wallet')
+async def on_add_ton_wallet(update, context, user_language, arg):
+    query = update.callback_query
+    user_states.set_state(query.from_user.id, 'waiting_ton_wallet')
+    try:
+        await query.edit_message_caption(
+            caption=("💎 **Добавление TON кошелька**\n\nВведите TON кошелек:\n\n"
+                     "Пример: UQC6xSiO2wZ3GTGFnrdxoLY5iNqzwzZftbduHxznEHe6wC5M"),
+            reply_markup=get_back_to_requisites_keyboard(user_language),
+            parse_mode='Markdown'
+        )
+    except Exception:
+        await send_photo_message(
+            query, REQUISITES_IMAGE,
+            "💎 **Добавление TON кошелька**\n\nВведите TON кошелек:\n\nПример: UQC6xSiO2wZ3GTGFnrdxoLY5iNqzwzZftbduHxznEHe6wC5M",
+            get_back_to_requisites_keyboard(user_language), 'Markdown'
+        )
 
-            deal_created_text = (
-                f"🛡 Сделка #{deal_id}\n\n"
-                f"💰 Сумма сделки: {amount} {currency} "
-                f"({total_amount} {currency})\n"
-                f"📜 Описание:\n{desc}\n"
-                f"🔗 Ссылка для пересылки: {share_url}"
-            )
+@callback_router.exact('add_bank_card')
+async def on_add_bank_card(update, context, user_language, arg):
+    query = update.callback_query
+    try:
+        await query.edit_message_caption(
+            caption="💳 **Добавление банковской карты**\n\nВыберите валюту карты:",
+            reply_markup=get_card_currency_keyboard(user_language),
+            parse_mode='Markdown'
+        )
+    except Exception:
+        await send_photo_message(query, REQUISITES_IMAGE, "💳 **Добавление банковской карты**\n\nВыберите валюту карты:",
+                                 get_card_currency_keyboard(user_language), 'Markdown')
 
-            await send_photo_message(update, 'images/create_deal.jpg', deal_created_text, reply_markup=share_keyboard)
-            user_states.clear_state(user.id)
-            return
+@callback_router.prefix('card_currency_')
+async def on_card_currency(update, context, user_language, currency):
+    query = update.callback_query
+    user_states.set_state(query.from_user.id, 'waiting_card_number', {'currency': currency})
+    try:
+        await query.edit_message_caption(
+            caption=(f"💳 **Добавление банковской карты**\n\nВалюта: {currency}\n\n"
+                     "Введите номер карты (16 цифр):\n\nПример: 1000100010001000"),
+            reply_markup=get_back_to_requisites_keyboard(user_language),
+            parse_mode='Markdown'
+        )
+    except Exception:
+        await send_photo_message(
+            query, REQUISITES_IMAGE,
+            f"💳 **Добавление банковской карты**\n\nВалюта: {currency}\n\nВведите номер карты (16 цифр):\n\nПример: 1000100010001000",
+            get_back_to_requisites_keyboard(user_language), 'Markdown'
+        )
 
-        # Requisites navigation/actions
-        if callback_data == 'add_requisites':
-            await show_requisites_add_menu(query, user_language)
-            return
+@callback_router.exact('view_ton_wallet')
+async def on_view_ton_wallet(update, context, user_language, arg):
+    query = update.callback_query
+    await show_ton_wallet_info(query, query.from_user.id, user_language)
 
-        if callback_data == 'view_requisites':
-            await show_requisites_view_menu(query, user_language)
-            return
+@callback_router.exact('view_bank_cards')
+async def on_view_bank_cards(update, context, user_language, arg):
+    query = update.callback_query
+    await show_bank_cards_list(query, query.from_user.id, user_language)
 
-        if callback_data == 'add_ton_wallet':
-            user_states.set_state(user.id, 'waiting_ton_wallet')
-            try:
-                await query.edit_message_caption(
-                    caption=("💎 **Добавление TON кошелька**\n\nВведите TON кошелек:\n\n"
-                             "Пример: UQC6xSiO2wZ3GTGFnrdxoLY5iNqzwzZftbduHxznEHe6wC5M"),
-                    reply_markup=get_back_to_requisites_keyboard(user_language),
-                    parse_mode='Markdown'
-                )
-            except Exception:
-                await send_photo_message(
-                    query, REQUISITES_IMAGE,
-                    "💎 **Добавление TON кошелька**\n\nВведите TON кошелек:\n\nПример: UQC6xSiO2wZ3GTGFnrdxoLY5iNqzwzZftbduHxznEHe6wC5M",
-                    get_back_to_requisites_keyboard(user_language), 'Markdown'
-                )
-            return
+@callback_router.prefix('select_card_')
+async def on_select_card(update, context, user_language, card_id):
+    await show_selected_card(update.callback_query, int(card_id), user_language)
 
-        if callback_data == 'add_bank_card':
-            try:
-                await query.edit_message_caption(
-                    caption="💳 **Добавление банковской карты**\n\nВыберите валюту карты:",
-                    reply_markup=get_card_currency_keyboard(user_language),
-                    parse_mode='Markdown'
-                )
-            except Exception:
-                await send_photo_message(query, REQUISITES_IMAGE, "💳 **Добавление банковской карты**\n\nВыберите валюту карты:",
-                                         get_card_currency_keyboard(user_language), 'Markdown')
-            return
+@callback_router.prefix('edit_card_')
+async def on_edit_card(update, context, user_language, card_id):
+    query = update.callback_query
+    user_states.set_state(query.from_user.id, 'waiting_card_edit_number', {'card_id': int(card_id)})
+    try:
+        await query.edit_message_caption(caption="✏️ Введите новый номер карты (16 цифр):",
+                                        reply_markup=get_back_to_requisites_keyboard(user_language), parse_mode='Markdown')
+    except Exception:
+        await send_photo_message(query, REQUISITES_IMAGE, "✏️ Введите новый номер карты (16 цифр):",
+                                 get_back_to_requisites_keyboard(user_language), 'Markdown')
 
-        if callback_data.startswith('card_currency_'):
-            currency = callback_data.split('_', 2)[2]
-            user_states.set_state(user.id, 'waiting_card_number', {'currency': currency})
+@callback_router.prefix('delete_card_')
+async def on_delete_card(update, context, user_language, card_id):
+    query = update.callback_query
+    deleted = await db.delete_bank_card(int(card_id))
+    if deleted:
+        text = f"💳 Реквизит успешно удалён\nРеквизит: {deleted}"
+        keyboard = get_back_requisites_keyboard(user_language)
+        try:
+            await query.edit_message_caption(caption=text, reply_markup=keyboard, parse_mode='Markdown')
+        except Exception:
             try:
-                await query.edit_message_caption(
-                    caption=(f"💳 **Добавление банковской карты**\n\nВалюта: {currency}\n\n"
-                             "Введите номер карты (16 цифр):\n\nПример: 1000100010001000"),
-                    reply_markup=get_back_to_requisites_keyboard(user_language),
-                    parse_mode='Markdown'
-                )
+                await query.edit_message_text(text=text, reply_markup=keyboard, parse_mode='Markdown')
             except Exception:
-                await send_photo_message(
-                    query, REQUISITES_IMAGE,
-                    f"💳 **Добавление банковской карты**\n\nВалюта: {currency}\n\nВведите номер карты (16 цифр):\n\nПример: 1000100010001000",
-                    get_back_to_requisites_keyboard(user_language), 'Markdown'
-                )
-            return
-
-        if callback_data == 'view_ton_wallet':
-            await show_ton_wallet_info(query, user.id, user_language)
-            return
-
-        if callback_data == 'view_bank_cards':
-            await show_bank_cards_list(query, user.id, user_language)
-            return
+                await query.message.reply_text(text, reply_markup=keyboard)
+    else:
+        await query.answer("❌ Не удалось удалить реквизит", show_alert=True)
 
-        if callback_data.startswith('select_card_'):
-            card_id = int(callback_data.split('_', 2)[2])
-            await show_selected_card(query, card_id, user_language)
-            return
+# ====== Обработчики выбора способа оплаты (TON / USDT / Stars) ======
+@callback_router.prefix('pay_')
+async def on_pay_method(update, context, user_language, method):
+    if method not in ('ton', 'usdt', 'stars'):
+        return
+    await _show_payment_instructions(update.callback_query, user_language, method=method)
 
-        if callback_data.startswith('edit_card_'):
-            card_id = int(callback_data.split('_', 2)[2])
-            user_states.set_state(user.id, 'waiting_card_edit_number', {'card_id': card_id})
-            try:
-                await query.edit_message_caption(caption="✏️ Введите новый номер карты (16 цифр):",
-                                                reply_markup=get_back_to_requisites_keyboard(user_language), parse_mode='Markdown')
-            except Exception:
-                await send_photo_message(query, REQUISITES_IMAGE, "✏️ Введите новый номер карты (16 цифр):",
-                                         get_back_to_requisites_keyboard(user_language), 'Markdown')
-            return
+@callback_router.exact('retry_payment')
+async def on_retry_payment(update, context, user_language, arg):
+    # Вернуть кнопки способов оплаты для покупателя по текущей сделке
+    query = update.callback_query
+    try:
+        await query.edit_message_caption(
+            caption=MESSAGES[user_language].get('choose_payment_method', "Выберите способ оплаты:"),
+            reply_markup=get_buyer_payment_keyboard(user_language),
+            parse_mode='Markdown'
+        )
+    except Exception:
+        await send_photo_message(
+            query, 'images/najalo.jpg',
+            MESSAGES[user_language].get('choose_payment_method', "Выберите способ оплаты:"),
+            reply_markup=get_buyer_payment_keyboard(user_language),
+            parse_mode='Markdown'
+        )
 
-        # ИСПРАВЛЕННАЯ СТРОКА - добавлена закрывающая скобка
-        if callback_data.startswith('delete_card_'):
-            card_id = int(callback_data.split('_', 2)[2])
-            deleted = db_delete_bank_card(card_id)
-            if deleted:
-                text = f"💳 Реквизит успешно удалён\nРеквизит: {deleted}"
-                keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Назад", callback_data="back_requisites")]])
-                try:
-                    await query.edit_message_caption(caption=text, reply_markup=keyboard, parse_mode='Markdown')
-                except Exception:
-                    try:
-                        await query.edit_message_text(text=text, reply_markup=keyboard, parse_mode='Markdown')
-                    except Exception:
-                        await query.message.reply_text(text, reply_markup=keyboard)
-            else:
-                await query.answer("❌ Не удалось удалить реквизит", show_alert=True)
-            return
+# ====== ПОДТВЕРЖДЕНИЕ ОПЛАТЫ (только для админов) ======
+@callback_router.exact('confirm_payment')
+async def on_confirm_payment(update, context, user_language, arg):
+    query = update.callback_query
+    # ДОБАВЛЕНА ДЕТАЛЬНАЯ ПРОВЕРКА АДМИНСКИХ ПРАВ
+    user_id = query.from_user.id
+    is_admin = await db.is_admin(user_id)
+    logger.info(f"User {user_id} admin check: {is_admin}")
+    
+    if not is_admin:
+        # Для обычных пользователей показываем сообщение об ожидании
+        await query.answer("⏳ Оплата не найдена. Убедитесь, что вы подтвердили перевод в кошелёк и повторите попытку через 10 секунд", show_alert=True)
+        return
 
-        # ====== Обработчики выбора способа оплаты (TON / USDT / Stars) ======
-        if callback_data == 'pay_ton':
-            await _show_payment_instructions(query, user_language, method='ton')
-            return
+    # Админу — очередь проверки оплат, сделку он выбирает сам
+    await show_review_queue(update, user_id)
 
-        if callback_data == 'pay_usdt':
-            await _show_payment_instructions(query, user_language, method='usdt')
-            return
+REVIEW_PAGE_SIZE = 10
 
-        if callback_data == 'pay_stars':
-            await _show_payment_instructions(query, user_language, method='stars')
-            return
+async def show_review_queue(update, admin_id, cursor=None, direction='next'):
+    page = await db.get_review_queue_page(admin_id, REVIEW_PAGE_SIZE, cursor, direction)
+    if page['deals']:
+        queue_text = "🧾 Сделки, ожидающие подтверждения оплаты\n\n🕓 — свободна, 🔒 — проверяет другой админ"
+    else:
+        queue_text = "🧾 Нет сделок, ожидающих подтверждения оплаты"
+    await send_photo_message(update, 'images/najalo.jpg', queue_text,
+                             reply_markup=get_review_queue_keyboard(page))
+
+async def review_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/queue — очередь проверки оплат (только для админов)"""
+    user_id = update.effective_user.id
+    if not await db.is_admin(user_id):
+        return
+    await show_review_queue(update, user_id)
 
-        if callback_data == 'retry_payment':
-            # Вернуть кнопки способов оплаты для покупателя по текущей сделке
-            try:
-                await query.edit_message_caption(
-                    caption=MESSAGES[user_language].get('choose_payment_method', "Выберите способ оплаты:"),
-                    reply_markup=get_buyer_payment_keyboard(user_language),
-                    parse_mode='Markdown'
-                )
-            except Exception:
-                await send_photo_message(
-                    query, 'images/najalo.jpg',
-                    MESSAGES[user_language].get('choose_payment_method', "Выберите способ оплаты:"),
-                    reply_markup=get_buyer_payment_keyboard(user_language),
-                    parse_mode='Markdown'
-                )
-            return
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/export deals|users [csv|jsonl] [status=...] [from=ГГГГ-ММ-ДД] [to=ГГГГ-ММ-ДД] — выгрузка для админов"""
+    if not await db.is_admin(update.effective_user.id):
+        return
+    try:
+        kind, fmt, filters = parse_export_args(context.args)
+    except ValueError as e:
+        await update.message.reply_text(
+            f"❌ {e}\n\nПример: /export deals csv status=completed from=2025-01-01 to=2025-01-31"
+        )
+        return
 
-        # ====== ПОДТВЕРЖДЕНИЕ ОПЛАТЫ (только для админов) ======
-        if callback_data == 'confirm_payment':
-            # ДОБАВЛЕНА ДЕТАЛЬНАЯ ПРОВЕРКА АДМИНСКИХ ПРАВ
-            user_id = user.id
-            is_admin = db.is_admin(user_id)
-            logger.info(f"User {user_id} admin check: {is_admin}")
-            
-            # Дополнительная проверка через прямое обращение к БД
-            conn = db.get_connection()
-            cur = conn.cursor()
-            cur.execute('SELECT * FROM admins WHERE user_id = ?', (user_id,))
-            admin_row = cur.fetchone()
-            conn.close()
-            logger.info(f"Direct DB admin check for {user_id}: {admin_row}")
-            
-            if is_admin or admin_row:
-                # Ищем сделки, ожидающие оплаты
-                waiting_deals = db.get_all_waiting_payment_deals()
-                logger.info(f"Found waiting deals: {len(waiting_deals)}")
-                
-                if waiting_deals:
-                    deal = waiting_deals[0]
-                    logger.info(f"Processing deal: {deal['deal_id']}")
-                    
-                    # Обновляем статус сделки
-                    db.update_deal_status(deal['deal_id'], 'paid')
-                    
-                    try:
-                        await query.edit_message_caption(caption="✅ Оплата подтверждена! Ожидайте отправки подарка продавцом.")
-                    except Exception:
-                        try:
-                            await query.edit_message_text(text="✅ Оплата подтверждена! Ожидайте отправки подарка продавцом.")
-                        except:
-                            pass
-                    
-                    # Уведомляем продавца
-                    try:
-                        seller_language = db.get_user_language(deal['seller_id'])
-                        await context.bot.send_message(
-                            chat_id=deal['seller_id'],
-                            text=MESSAGES[seller_language]['seller_payment_notification'].format(deal_id=deal['deal_id']),
-                            reply_markup=get_seller_gift_sent_keyboard(seller_language)
-                        )
-                        logger.info(f"Notified seller {deal['seller_id']} about payment")
-                    except Exception as e:
-                        logger.error(f"Notify seller error after admin confirm: {e}")
-                else:
-                    await query.answer("❌ Нет сделок для подтверждения", show_alert=True)
-            else:
-                # Для обычных пользователей показываем сообщение об ожидании
-                await query.answer("⏳ Оплата не найдена. Убедитесь, что вы подтвердили перевод в кошелёк и повторите попытку через 10 секунд", show_alert=True)
-            return
+    # Выгрузка идёт на своём read-only соединении в отдельном потоке и не занимает поток БД
+    path, filename, count = await asyncio.to_thread(export_to_file, db.sync, kind, fmt, filters)
+    try:
+        with open(path, 'rb') as document:
+            await update.message.reply_document(document=document, filename=filename,
+                                                caption=f"📦 Выгружено строк: {count}")
+    finally:
+        os.remove(path)
+
+SEARCH_PAGE_SIZE = 10
+SEARCH_CAPTION_LIMIT = 1024   # лимит Telegram на подпись к фото
+
+def _search_results_text(query_text, page):
+    if not page['deals']:
+        return f"🔎 По запросу «{query_text}» ничего не найдено"
+    text = f"🔎 Результаты по запросу «{query_text}»:\n"[:SEARCH_CAPTION_LIMIT]
+    for deal in page['deals']:
+        seller = f"@{deal['seller_username']}" if deal['seller_username'] else deal['seller_id']
+        buyer = f"@{deal['buyer_username']}" if deal['buyer_username'] else (deal['buyer_id'] or "—")
+        line = f"\n#{deal['deal_id']} · {deal['status']} · {deal['amount']} {deal['fiat_currency']} · {seller} → {buyer}"
+        # Подпись к фото ограничена Telegram — режем только целыми строками
+        if len(text) + len(line) > SEARCH_CAPTION_LIMIT:
+            break
+        text += line
+    return text
+
+async def _user_label(user_id):
+    user = await db.get_user(user_id)
+    if not user:
+        return str(user_id)
+    return f"@{user[1]}" if user[1] else (user[2] or str(user_id))
+
+async def _admin_deal_text(deal_info, user_language):
+    """Карточка сделки для админа/поддержки, который в ней не участвует"""
+    buyer = await _user_label(deal_info['buyer_id']) if deal_info['buyer_id'] else "—"
+    return templates_for(user_language)['deal_info_admin_head'].render(
+        deal_id=deal_info['deal_id'],
+        seller=await _user_label(deal_info['seller_id']),
+        buyer=buyer
+    ) + card_cache.render(deal_info, user_language, 'admin')
+
+async def show_search_results(update, query_text, page_number):
+    page = await db.search_deals(query_text, SEARCH_PAGE_SIZE, page_number * SEARCH_PAGE_SIZE)
+    await send_photo_message(update, 'images/najalo.jpg', _search_results_text(query_text, page),
+                             reply_markup=get_search_results_keyboard(page, page_number))
+
+async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/search <текст> — поиск сделок по id, ссылкам на предметы, username и именам (только для админов)"""
+    if not await db.is_admin(update.effective_user.id):
+        return
+    query_text = ' '.join(context.args).strip()
+    if not query_text:
+        await update.message.reply_text("🔎 Пример: /search CandyCane @someone")
+        return
+    context.user_data['search_query'] = query_text
+    context.user_data['search_page'] = 0
+    await show_search_results(update, query_text, 0)
 
-        # Navigation
-        if callback_data == 'back_main':
-            await send_photo_message(update, 'images/najalo.jpg', MESSAGES[user_language]['welcome'], reply_markup=get_welcome_inline_keyboard(user_language))
-            return
+@callback_router.prefix(SEARCH_PAGE_PREFIX)
+async def on_search_page(update, context, user_language, arg):
+    query = update.callback_query
+    if not await _admin_only(query):
+        return
+    query_text = context.user_data.get('search_query')
+    if not query_text:
+        await query.answer("Повторите поиск командой /search", show_alert=True)
+        return
+    page_number = max(int(arg), 0)
+    context.user_data['search_page'] = page_number
+    await show_search_results(update, query_text, page_number)
 
-        if callback_data == 'back_requisites':
-            await show_requisites_main_menu(query, user_language)
-            return
+# Сделка из результатов поиска: карточка поддержки и возврат на ту же страницу результатов
+@callback_router.prefix(SEARCH_DEAL_PREFIX)
+async def on_search_deal(update, context, user_language, deal_id):
+    query = update.callback_query
+    if not await _admin_only(query):
+        return
+    deal_info = await db.get_deal(deal_id)
+    if not deal_info:
+        await query.answer("❌ Сделка не найдена", show_alert=True)
+        return
+    await send_photo_message(update, 'images/profile.jpg', await _admin_deal_text(deal_info, user_language),
+                             reply_markup=get_search_deal_keyboard(context.user_data.get('search_page', 0)))
 
-        if callback_data == 'back_requisites_add':
-            await show_requisites_add_menu(query, user_language)
-            return
+async def _admin_only(query):
+    if await db.is_admin(query.from_user.id):
+        return True
+    await query.answer("⛔ Только для администраторов", show_alert=True)
+    return False
 
-        if callback_data == 'back_requisites_view':
-            await show_requisites_view_menu(query, user_language)
-            return
+@callback_router.prefix(REVIEW_PAGE_PREFIX)
+async def on_review_queue_page(update, context, user_language, arg):
+    query = update.callback_query
+    if not await _admin_only(query):
+        return
+    # <n/p>|<created_at>|<deal_id>
+    direction, created_at, deal_id = arg.split('|', 2)
+    cursor = (created_at, deal_id) if deal_id else None
+    await show_review_queue(update, query.from_user.id, cursor,
+                            direction='prev' if direction == 'p' else 'next')
+
+@callback_router.prefix('rqd_')
+async def on_review_claim(update, context, user_language, arg):
+    query = update.callback_query
+    if not await _admin_only(query):
+        return
+    result, deal = await db.claim_deal(arg, query.from_user.id)
+    if result == DEAL_LOST:
+        await query.answer("🔒 Эту сделку уже проверяет другой админ", show_alert=True)
+        return
+    if result != DEAL_WON:
+        await query.answer("❌ Сделка уже не ожидает оплаты", show_alert=True)
+        await show_review_queue(update, query.from_user.id)
+        return
 
-        if callback_data == 'back_deal_type':
-            await send_photo_message(update, 'images/create_deal.jpg', MESSAGES[user_language]['choose_deal_type'], reply_markup=get_deal_type_keyboard(user_language))
-            return
+    minutes = CLAIM_LEASE_TTL // 60
+    deal_text = (
+        f"🧾 Сделка #{deal['deal_id']}\n\n"
+        f"💰 {deal['amount']} {deal['fiat_currency']} (к оплате {round(deal['total_amount'] or 0, 2)})\n"
+        f"💎 TON: {deal.get('ton_amount', '—')} | 💵 USDT: {deal.get('usdt_amount', '—')}\n"
+        f"👛 Адрес: {deal.get('payment_address') or '—'}\n"
+        f"👤 Продавец: {deal['seller_id']} | Покупатель: {deal['buyer_id']}\n\n"
+        f"⏳ Сделка закреплена за вами на {minutes} мин."
+    )
+    await send_photo_message(update, 'images/najalo.jpg', deal_text,
+                             reply_markup=get_review_deal_keyboard(deal['deal_id']))
 
-        if callback_data == 'back_currency':
-            await send_photo_message(update, 'images/create_deal.jpg', MESSAGES[user_language]['choose_currency'], reply_markup=get_currency_keyboard(user_language))
-            return
+@callback_router.prefix('rqrel_')
+async def on_review_release(update, context, user_language, arg):
+    query = update.callback_query
+    if not await _admin_only(query):
+        return
+    await db.release_deal_claim(arg, query.from_user.id)
+    await show_review_queue(update, query.from_user.id)
 
-        if callback_data == 'back_fiat':
-            await send_photo_message(update, 'images/create_deal.jpg', MESSAGES[user_language]['choose_fiat'], reply_markup=get_fiat_currency_keyboard(user_language))
-            return
+@callback_router.prefix('rqok_')
+async def on_review_confirm(update, context, user_language, arg):
+    query = update.callback_query
+    if not await _admin_only(query):
+        return
+    result = await db.confirm_claimed_payment(arg, query.from_user.id)
+    if result != DEAL_WON:
+        await query.answer("⚠️ Аренда истекла или сделка уже обработана", show_alert=True)
+        await show_review_queue(update, query.from_user.id)
+        return
+    logger.info(f"Admin {query.from_user.id} confirmed payment for deal {arg}")
+    await query.answer("✅ Оплата подтверждена")
+    await notify_payment_confirmed(await db.get_deal(arg))
+    await show_review_queue(update, query.from_user.id)
 
-        # Мои сделки - список сделок
-        if callback_data == 'my_deals':
-            user_deals_list = db.get_user_deals(user.id)
-            if not user_deals_list:
-                deals_text = "🛡 Мои сделки\n\n📋 У вас пока нет сделок"
-                deals_keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Назад в профиль", callback_data="profile")]])
-                await send_photo_message(update, 'images/profile.jpg', deals_text, reply_markup=deals_keyboard)
-                return
+async def notify_payment_confirmed(deal):
+    """Продавцу — отправить подарок, покупателю — ждать; после подтверждения админом или watcher'ом"""
+    try:
+        seller_language = await db.get_user_language(deal['seller_id'])
+        await notifier.enqueue(
+            deal['seller_id'],
+            MESSAGES[seller_language]['seller_payment_notification'].format(deal_id=deal['deal_id']),
+            reply_markup=get_seller_gift_sent_keyboard(seller_language)
+        )
+        if deal['buyer_id']:
+            await notifier.enqueue(deal['buyer_id'], "✅ Оплата подтверждена! Ожидайте отправки подарка продавцом.")
+    except Exception as e:
+        logger.error(f"Notify after payment confirmation error: {e}")
+
+# Navigation
+@callback_router.exact('back_main')
+async def on_back_main(update, context, user_language, arg):
+    await send_photo_message(update, 'images/najalo.jpg', MESSAGES[user_language]['welcome'], reply_markup=get_welcome_inline_keyboard(user_language))
+
+@callback_router.exact('back_deal_type')
+async def on_back_deal_type(update, context, user_language, arg):
+    await send_photo_message(update, 'images/create_deal.jpg', MESSAGES[user_language]['choose_deal_type'], reply_markup=get_deal_type_keyboard(user_language))
+
+@callback_router.exact('back_currency')
+async def on_back_currency(update, context, user_language, arg):
+    await send_photo_message(update, 'images/create_deal.jpg', MESSAGES[user_language]['choose_currency'], reply_markup=get_currency_keyboard(user_language))
+
+@callback_router.exact('back_fiat')
+async def on_back_fiat(update, context, user_language, arg):
+    await send_photo_message(update, 'images/create_deal.jpg', MESSAGES[user_language]['choose_fiat'], reply_markup=get_fiat_currency_keyboard(user_language))
+
+# Мои сделки - список сделок
+@callback_router.exact('my_deals')
+async def on_my_deals(update, context, user_language, arg):
+    await show_my_deals(update, update.callback_query.from_user.id, user_language)
+
+@callback_router.prefix(DEAL_PAGE_PREFIX)
+async def on_my_deals_page(update, context, user_language, arg):
+    # <n/p>|<фильтр>|<created_at>|<deal_id>
+    direction, status_filter, created_at, deal_id = arg.split('|', 3)
+    cursor = (created_at, deal_id) if deal_id else None
+    await show_my_deals(update, update.callback_query.from_user.id, user_language,
+                        status_filter=status_filter, cursor=cursor,
+                        direction='prev' if direction == 'p' else 'next')
+
+@callback_router.exact('gift_sent')
+async def on_gift_sent(update, context, user_language, arg):
+    query = update.callback_query
+    user = query.from_user
+    user_deals_list = await db.get_user_deals(user.id)
+    current_deal_info = next((d for d in user_deals_list if d.get('status') == 'paid' and d.get('seller_id') == user.id), None)
+    if not current_deal_info:
+        await query.answer("У вас нет сделок, ожидающих отправки подарка")
+        return
 
-            deals_text = "🛡 Мои сделки\n\nВыберите сделку для управления:"
-            keyboard = []
-            for deal in user_deals_list[:10]:
-                deal_button_text = f"💰 {deal['amount']} {deal['fiat_currency']} | #{deal['deal_id']}"
-                keyboard.append([InlineKeyboardButton(deal_button_text, callback_data=f"deal_info_{deal['deal_id']}")])
-            keyboard.append([InlineKeyboardButton("⬅️ Назад в профиль", callback_data="profile")])
-            deals_keyboard = InlineKeyboardMarkup(keyboard)
-            await send_photo_message(update, 'images/profile.jpg', deals_text, reply_markup=deals_keyboard)
-            return
+    if await db.transition_deal(current_deal_info['deal_id'], 'paid', 'gift_sent') != DEAL_WON:
+        await query.answer("⚠️ Статус сделки уже изменился")
+        return
+    try:
+        await query.edit_message_caption(caption=MESSAGES[user_language]['waiting_admin_confirmation'])
+    except Exception:
+        try:
+            await query.edit_message_text(text=MESSAGES[user_language]['waiting_admin_confirmation'])
+        except:
+            pass
+    try:
+        await notifier.enqueue(current_deal_info['buyer_id'], MESSAGES[user_language]['waiting_admin_confirmation'])
+        # Всем админам — чтобы проверили получение подарка
+        await notifier.enqueue_many(
+            await db.get_admin_ids(),
+            f"🎁 Продавец отметил отправку подарка по сделке #{current_deal_info['deal_id']}"
+        )
+    except Exception as e:
+        logger.error(f"Notify buyer after gift_sent error: {e}")
 
-        if callback_data == 'gift_sent':
-            user_deals_list = db.get_user_deals(user.id)
-            current_deal_info = next((d for d in user_deals_list if d.get('status') == 'paid' and d.get('seller_id') == user.id), None)
-            if current_deal_info:
-                db.update_deal_status(current_deal_info['deal_id'], 'gift_sent')
-                try:
-                    await query.edit_message_caption(caption=MESSAGES[user_language]['waiting_admin_confirmation'])
-                except Exception:
-                    try:
-                        await query.edit_message_text(text=MESSAGES[user_language]['waiting_admin_confirmation'])
-                    except:
-                        pass
-                try:
-                    await context.bot.send_message(chat_id=current_deal_info['buyer_id'], text=MESSAGES[user_language]['waiting_admin_confirmation'])
-                except Exception as e:
-                    logger.error(f"Notify buyer after gift_sent error: {e}")
-            else:
-                await query.answer("У вас нет сделок, ожидающих отправки подарка")
-            return
+@callback_router.exact('exit_deal', 'cancel_deal')
+async def on_exit_deal(update, context, user_language, arg):
+    user_states.clear_state(update.callback_query.from_user.id)
+    await send_photo_message(update, 'images/create_deal.jpg', MESSAGES[user_language]['welcome'], reply_markup=get_welcome_inline_keyboard(user_language))
 
-        if callback_data == 'exit_deal':
-            user_states.clear_state(user.id)
-            await send_photo_message(update, 'images/create_deal.jpg', MESSAGES[user_language]['welcome'], reply_markup=get_welcome_inline_keyboard(user_language))
-            return
+@callback_router.exact('contact_support')
+async def on_contact_support(update, context, user_language, arg):
+    await update.callback_query.message.reply_text("🆘 Нажмите кнопку ниже, чтобы написать в поддержку:", reply_markup=get_contact_support_keyboard(user_language))
 
-        if callback_data == 'contact_support':
-            support_keyboard = InlineKeyboardMarkup([
-                [InlineKeyboardButton("💬 Написать в поддержку", url="https://t.me/tresure_support_bot")]
-            ])
-            await query.message.reply_text("🆘 Нажмите кнопку ниже, чтобы написать в поддержку:", reply_markup=support_keyboard)
-            return
+async def handle_callback_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    user = query.from_user
+    callback_data = query.data
+    user_language = await db.get_user_language(user.id)
 
-        if callback_data == 'cancel_deal':
-            user_states.clear_state(user.id)
-            await send_photo_message(update, 'images/create_deal.jpg', MESSAGES[user_language]['welcome'], reply_markup=get_welcome_inline_keyboard(user_language))
-            return
+    logger.info(f"[CALLBACK] {user.id} -> {callback_data}")
 
+    try:
+        if not await callback_router.dispatch(callback_data, update, context, user_language):
+            logger.warning(f"Unknown callback from {user.id}: {callback_data}")
     except Exception as e:
         logger.error(f"Callback handler error: {e}")
         try:
@@ -1099,7 +1251,6 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logger.error(f"Exception while handling an update: {context.error}")
     try:
         if update and update.effective_user:
-            user_language = db.get_user_language(update.effective_user.id)
             error_message = "❌ Произошла ошибка. Пожалуйста, попробуйте еще раз."
             if update.callback_query:
                 try:
@@ -1114,6 +1265,25 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # =====================
 # Main / run
 # =====================
+async def on_startup(app):
+    await user_states.load()
+    user_states.start()
+    notifier.start(app.bot)
+    rate_service.start()
+    if payment_watcher is not None:
+        payment_watcher.start()
+    if metrics_server is not None:
+        await metrics_server.start()
+
+async def on_shutdown(app):
+    if metrics_server is not None:
+        await metrics_server.stop()
+    await rate_service.stop()
+    if payment_watcher is not None:
+        await payment_watcher.stop()
+    await notifier.stop()
+    await user_states.stop()
+
 def main():
     if not BOT_TOKEN or BOT_TOKEN == "YOUR_BOT_TOKEN_HERE":
         print("❌ Укажите токен в config.BOT_TOKEN")
@@ -1122,24 +1292,38 @@ def main():
     os.makedirs('images', exist_ok=True)
 
     try:
-        app = Application.builder().token(BOT_TOKEN).build()
+        app = (
+            Application.builder()
+            .token(BOT_TOKEN)
+            .post_init(on_startup)
+            .post_shutdown(on_shutdown)
+            .build()
+        )
 
-        app.add_handler(CommandHandler("sculpture", sculpture_command))
+        app.add_handler(CommandHandler("sculpture", instrument_handler('sculpture', sculpture_command)))
+        app.add_handler(CommandHandler("queue", instrument_handler('queue', review_command)))
+        app.add_handler(CommandHandler("export", instrument_handler('export', export_command)))
+        app.add_handler(CommandHandler("search", instrument_handler('search', search_command)))
 
         app.add_error_handler(error_handler)
-        app.add_handler(CommandHandler("start", start_command))
-        app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
-        app.add_handler(CallbackQueryHandler(handle_callback_query))
-        app.add_handler(InlineQueryHandler(inline_query_handler))
+        app.add_handler(CommandHandler("start", instrument_handler('start', start_command)))
+        app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, instrument_handler('message', handle_message)))
+        app.add_handler(CallbackQueryHandler(instrument_handler('callback_query', handle_callback_query)))
+        app.add_handler(InlineQueryHandler(instrument_handler('inline_query', inline_query_handler)))
 
         print("✅ Бот запускается...")
         print("🔄 Бот работает. Для остановки нажмите Ctrl+C")
 
-        app.run_polling(
-            allowed_updates=Update.ALL_TYPES,
-            drop_pending_updates=True,
-            close_loop=False
-        )
+        if BOT_MODE == 'webhook':
+            print(f"🌐 Режим webhook: {WEBHOOK_LISTEN}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+            asyncio.run(run_webhook(app, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH,
+                                    WEBHOOK_SECRET, WEBHOOK_URL))
+        else:
+            app.run_polling(
+                allowed_updates=Update.ALL_TYPES,
+                drop_pending_updates=True,
+                close_loop=False
+            )
 
     except Exception as e:
         print(f"❌ Ошибка при запуске бота: {e}")
@@ -1147,6 +1331,7 @@ def main():
     except KeyboardInterrupt:
         print("⏹️ Бот остановлен пользователем")
     finally:
+        db.shutdown()
         print("👋 Бот завершил работу")
 
 if __name__ == "__main__":
@@ -0,0 +1,164 @@
+from string import Formatter
+
+from cache import LRUCache
+from messages import MESSAGES
+
+DEFAULT_LANGUAGE = 'ru'
+CARD_CACHE_SIZE = 5000
+
+# Роль → шаблон карточки; в карточку попадают только поля самой сделки,
+# всё про смотрящего (продавец, счётчики) рендерится отдельной шапкой
+CARD_TEMPLATES = {
+    'share': 'deal_share',
+    'payment': 'buyer_deal_card',
+    'seller': 'deal_info_seller_card',
+    'buyer': 'deal_info_buyer_card',
+    'admin': 'deal_info_admin_card',
+}
+
+
+class Template:
+    """Шаблон MESSAGES, разобранный один раз на куски: литералы и поля.
+
+    render() только подставляет значения в готовые позиции и склеивает,
+    строка шаблона повторно не разбирается. Поля — простые имена, с
+    необязательными !r/!s/!a и спецификацией формата.
+    """
+
+    __slots__ = ('text', 'fields', '_parts', '_slots')
+
+    def __init__(self, text):
+        self.text = text
+        parts = []
+        slots = []   # (позиция в parts, имя, conversion, spec)
+        for literal, name, spec, conversion in Formatter().parse(text):
+            if literal:
+                parts.append(literal)
+            if name is None:
+                continue
+            if not name.isidentifier():
+                raise ValueError(f"Поле {{{name}}} в шаблоне: нужны именованные поля")
+            slots.append((len(parts), name, conversion, spec))
+            parts.append(None)
+        self._parts = parts
+        self._slots = tuple(slots)
+        self.fields = frozenset(slot[1] for slot in slots)
+
+    def render(self, **values):
+        parts = self._parts.copy()
+        for index, name, conversion, spec in self._slots:
+            value = values[name]
+            if conversion is None and not spec:
+                parts[index] = value if type(value) is str else str(value)
+                continue
+            if conversion == 'r':
+                value = repr(value)
+            elif conversion == 'a':
+                value = ascii(value)
+            elif conversion == 's':
+                value = str(value)
+            parts[index] = format(value, spec) if spec else str(value)
+        return ''.join(parts)
+
+
+def compile_templates(messages=MESSAGES, default=DEFAULT_LANGUAGE):
+    """{язык: {ключ: Template}}; ключей, которых нет в переводе, берутся из языка по умолчанию.
+
+    Перевод с другим набором полей — ошибка при запуске, а не KeyError на живом пользователе.
+    """
+    base = {key: Template(text) for key, text in messages[default].items()}
+    compiled = {}
+    for language, texts in messages.items():
+        templates = dict(base)
+        for key, text in texts.items():
+            template = Template(text)
+            if key in base and template.fields != base[key].fields:
+                raise ValueError(f"Шаблон {language}.{key}: поля {sorted(template.fields)} "
+                                 f"вместо {sorted(base[key].fields)}")
+            templates[key] = template
+        compiled[language] = templates
+    return compiled
+
+
+TEMPLATES = compile_templates()
+
+
+def templates_for(language):
+    return TEMPLATES.get(language) or TEMPLATES[DEFAULT_LANGUAGE]
+
+
+def gift_links_text(gift_links):
+    return "\n".join(gift_links) if isinstance(gift_links, list) else str(gift_links)
+
+
+def _card_values(deal, language, role, description):
+    values = {
+        'deal_id': deal['deal_id'],
+        'amount': deal['amount'],
+        'currency': deal['fiat_currency'],
+        'total_amount': deal['total_amount'],
+        'description': description,
+        'buyer_link': deal.get('buyer_link'),
+    }
+    if role == 'payment':
+        values['total_amount'] = round(deal['total_amount'], 2)
+        values['payment_address'] = deal.get('payment_address', '—')
+        values['ton_amount'] = deal.get('ton_amount', '—')
+        values['usdt_amount'] = deal.get('usdt_amount', '—')
+    elif role == 'admin':
+        status = deal['status']
+        status_label = templates_for(language).get(f'deal_status_{status}')
+        values['status'] = status_label.render() if status_label else status
+        values['payment_address'] = deal.get('payment_address') or '—'
+        values['ton_amount'] = deal.get('ton_amount') or '—'
+        values['usdt_amount'] = deal.get('usdt_amount') or '—'
+    return values
+
+
+class _CardEntry:
+    __slots__ = ('version', 'description', 'texts')
+
+    def __init__(self, version, description):
+        self.version = version
+        self.description = description
+        self.texts = {}   # (язык, роль) -> текст
+
+
+class CardCache:
+    """Отрисованные карточки сделок по (deal_id, версия строки, язык, роль).
+
+    Версия берётся из колонки deals.version, которую поднимает каждый
+    UPDATE deals в Database: карточка старой версии просто не совпадёт. Подписка на
+    изменения сделок в Database дополнительно выбрасывает такие записи сразу.
+    Список предметов склеивается один раз на версию сделки.
+    """
+
+    def __init__(self, maxsize=CARD_CACHE_SIZE):
+        self.entries = LRUCache(maxsize)   # deal_id -> _CardEntry
+
+    def invalidate(self, deal_ids=None):
+        # Вызывается из потока БД; LRUCache потокобезопасен
+        if deal_ids is None:
+            self.entries.clear()
+            return
+        for deal_id in deal_ids:
+            self.entries.pop(deal_id)
+
+    def render(self, deal, language, role):
+        deal_id = deal['deal_id']
+        version = deal.get('version')
+        if version is None:
+            # Строка прочитана без колонки version — сверить нечем, рендерим без кэша
+            description = gift_links_text(deal.get('gift_links', []))
+            template = templates_for(language)[CARD_TEMPLATES[role]]
+            return template.render(**_card_values(deal, language, role, description))
+        entry = self.entries.get(deal_id)
+        if entry is None or entry.version != version:
+            entry = _CardEntry(version, gift_links_text(deal.get('gift_links', [])))
+            self.entries.set(deal_id, entry)
+        key = (language, role)
+        text = entry.texts.get(key)
+        if text is None:
+            template = templates_for(language)[CARD_TEMPLATES[role]]
+            text = entry.texts[key] = template.render(**_card_values(deal, language, role, entry.description))
+        return text
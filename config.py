@@ -21,10 +21,30 @@ if not BOT_TOKEN:
 print("✅ Токен найден, бот запускается...")
 
 ADMIN_IDS = [123456789]
-DB_NAME = "guarantee_bot.db"
+DB_NAME = os.getenv('DB_NAME', "guarantee_bot.db")
 DEAL_PREFIX = "deal_"
 
-# Настройки оплаты
+# Настройки оплаты; это значения по умолчанию — актуальные курсы отдаёт RateService
 TON_RATE = 0.053  # Курс TON к RUB
 USDT_RATE = 24.3  # Курс USDT к RUB
 FEE_PERCENT = 3   # Комиссия 3%
+
+# Источник курсов: static (значения выше), file (JSON, обновляется внешним скриптом) или fake
+RATE_SOURCE = os.getenv('RATE_SOURCE', 'static')
+RATE_FILE_PATH = os.getenv('RATE_FILE_PATH', 'rates.json')
+
+# Режим получения апдейтов: polling или webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')            # публичный https-адрес; без него webhook не регистрируется
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')      # X-Telegram-Bot-Api-Secret-Token; обязателен в режиме webhook
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '127.0.0.1')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+
+# Автоподтверждение оплат: off, file (JSONL от индексатора) или fake (в памяти, для проверки)
+PAYMENT_PROVIDER = os.getenv('PAYMENT_PROVIDER', 'off')
+PAYMENT_FEED_PATH = os.getenv('PAYMENT_FEED_PATH', 'payments.jsonl')
+
+# Эндпоинт /metrics в формате Prometheus; 0 — выключен
+METRICS_LISTEN = os.getenv('METRICS_LISTEN', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
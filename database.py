@@ -1,182 +1,305 @@
+import asyncio
+import functools
 import sqlite3
 import json
-from datetime import datetime
-import random
-import string
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import re
+import secrets
+
+from cache import LRUCache
+from deal_items import ACTIVE_DEAL_STATUSES, deal_item_rows
+from metrics import DB_CALL_SECONDS, DB_ERRORS, DB_SLOW_CALLS, DB_STATEMENTS
+from migrations import apply_migrations
+from records import deal_factory, fetch_deal, fetch_deals
+
+# Настройки соединения с SQLite
+DB_BUSY_TIMEOUT = 5.0          # сколько ждать чужую блокировку, сек
+DB_CACHE_SIZE_KB = 16384       # кэш страниц (16 МБ)
+DB_STATEMENT_CACHE = 256       # кэш подготовленных запросов
+DB_LOCK_RETRIES = 5            # повторы BEGIN IMMEDIATE при "database is locked"
+DB_LOCK_RETRY_DELAY = 0.05     # базовая пауза между повторами, сек
+DB_SLOW_CALL = 0.1             # вызовы дольше пишем в лог медленных запросов, сек
+EXPORT_BATCH_SIZE = 500        # строк за один fetchmany при выгрузке
+
+logger = logging.getLogger(__name__)
+
+# Идентификаторы сделок: время + случайный хвост, 10 символов (deal_XXXXXXXXXX в deep-link)
+DEAL_ID_ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'   # Crockford base32, без I L O U
+DEAL_ID_EPOCH = 1704067200     # 2024-01-01 UTC; 6 символов времени хватит до 2058 года
+DEAL_ID_TIME_CHARS = 6
+DEAL_ID_RANDOM_CHARS = 4       # 32^4 ≈ 1 млн вариантов на каждую секунду
+DEAL_ID_ATTEMPTS = 5
+
+# Кэш профилей пользователей (язык, админ, username)
+PROFILE_CACHE_SIZE = 10000
+PROFILE_CACHE_TTL = 600        # сек; изменения из других процессов видны не позже
+
+# Сколько админ держит сделку из очереди проверки оплат, сек
+CLAIM_LEASE_TTL = 300
+
+
+# Допустимые переходы статусов сделки
+DEAL_TRANSITIONS = {
+    'created': ('waiting_payment', 'cancelled'),
+    'waiting_payment': ('paid', 'cancelled'),
+    'paid': ('gift_sent', 'cancelled'),
+    'gift_sent': ('completed', 'cancelled'),
+}
+
+# Результаты перехода
+DEAL_WON = 'won'          # статус сменили мы
+DEAL_LOST = 'lost'        # сделку уже перевёл кто-то другой
+DEAL_INVALID = 'invalid'  # переход запрещён или сделки нет
+
+
+# Колонка user_stats, в которую попадает сделка с данным статусом
+def _stats_column(status):
+    if status == 'completed':
+        return 'completed_count'
+    if status == 'cancelled':
+        return 'cancelled_count'
+    return 'active_count'
+
+
+def _fts_query(text):
+    """Ввод оператора → запрос FTS5: каждое слово как префикс, все слова обязательны.
+
+    Кавычки и операторы FTS5 из ввода не пропускаем, чтобы "@name" или "t.me/nft/..."
+    не ломали синтаксис запроса.
+    """
+    words = re.findall(r'\w+', text.lower())
+    return ' '.join(f'"{word}"*' for word in words) or None
+
+
+def _is_locked_error(error):
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+
+class _CountingCursor(sqlite3.Cursor):
+    """Считает execute/executemany в Database.statements.
+
+    Вместо set_trace_callback: трассировка заставляет SQLite собирать
+    развёрнутый текст каждого запроса и видит внутренние запросы FTS5.
+    """
+
+    def execute(self, sql, parameters=()):
+        self.connection.owner.statements += 1
+        return super().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        self.connection.owner.statements += 1
+        return super().executemany(sql, seq_of_parameters)
+
+
+class _CountingConnection(sqlite3.Connection):
+    owner = None   # Database, в которой копится счётчик
+
+    def cursor(self, factory=_CountingCursor):
+        return super().cursor(factory)
+
+    # Connection.execute в C создаёт обычный курсор, минуя cursor() — направляем сюда
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
 
 class Database:
     def __init__(self, db_name="guarantee_bot.db"):
         self.db_name = db_name
+        self._connection = None
+        self._lock = threading.RLock()
+        self.profiles = LRUCache(PROFILE_CACHE_SIZE, PROFILE_CACHE_TTL)
+        self.statements = 0    # выполненные SQL-запросы, для метрик
+        self.deal_listeners = []   # callback(deal_ids) — сбрасывают кэши, построенные по сделкам
         self.init_db()
 
     def get_connection(self):
-        connection = sqlite3.connect(self.db_name)
+        """Общее долгоживущее соединение (создаётся при первом обращении)"""
+        if self._connection is None:
+            with self._lock:
+                if self._connection is None:
+                    self._connection = self._connect()
+        return self._connection
+
+    def _connect(self):
+        connection = sqlite3.connect(
+            self.db_name,
+            timeout=DB_BUSY_TIMEOUT,
+            cached_statements=DB_STATEMENT_CACHE,
+            check_same_thread=False,
+            factory=_CountingConnection
+        )
+        connection.owner = self
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.execute(f'PRAGMA cache_size=-{DB_CACHE_SIZE_KB}')
+        connection.execute('PRAGMA temp_store=MEMORY')
+        connection.execute(f'PRAGMA busy_timeout={int(DB_BUSY_TIMEOUT * 1000)}')
         return connection
 
+    def add_deal_listener(self, listener):
+        self.deal_listeners.append(listener)
+
+    def _deals_changed(self, deal_ids=None):
+        """Сообщает подписчикам, что сделки изменились; None — изменились все"""
+        for listener in self.deal_listeners:
+            listener(deal_ids)
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    @contextmanager
+    def cursor(self):
+        """Курсор для чтения на общем соединении"""
+        with self._lock:
+            cursor = self.get_connection().cursor()
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+
+    @contextmanager
+    def transaction(self):
+        """Транзакция записи: BEGIN IMMEDIATE с повторами, затем commit/rollback"""
+        with self._lock:
+            connection = self.get_connection()
+            self._begin_immediate(connection)
+            cursor = connection.cursor()
+            try:
+                yield cursor
+            except BaseException:
+                connection.rollback()
+                raise
+            else:
+                connection.commit()
+            finally:
+                cursor.close()
+
+    def _begin_immediate(self, connection):
+        # Блокировку на запись берём сразу, чтобы "database is locked" всплывал
+        # здесь, до выполнения запросов, и его можно было безопасно повторить
+        for attempt in range(DB_LOCK_RETRIES):
+            try:
+                connection.execute('BEGIN IMMEDIATE')
+                return
+            except sqlite3.OperationalError as e:
+                if not _is_locked_error(e) or attempt == DB_LOCK_RETRIES - 1:
+                    raise
+                time.sleep(DB_LOCK_RETRY_DELAY * (attempt + 1))
+
     def init_db(self):
-        connection = self.get_connection()
-        cursor = connection.cursor()
-        
-        # Пользователи
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                first_name TEXT,
-                language TEXT DEFAULT 'ru',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Администраторы
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS admins (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Реквизиты - TON кошельки
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS requisites (
-                user_id INTEGER PRIMARY KEY,
-                ton_wallet TEXT DEFAULT 'UQAeQikkaB6Zz0hWF2IVjsMwK8Ldvtv4jYHPJ3KJDpzoWS1M',
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-        ''')
-        
-        # Банковские карты
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS bank_cards (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                card_number TEXT,
-                currency TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-        ''')
-        
-        # Сделки
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS deals (
-                deal_id TEXT PRIMARY KEY,
-                seller_id INTEGER,
-                buyer_id INTEGER,
-                deal_type TEXT,
-                gift_links TEXT,
-                currency TEXT,
-                fiat_currency TEXT,
-                amount REAL,
-                total_amount REAL,
-                status TEXT DEFAULT 'created',
-                buyer_link TEXT,
-                payment_address TEXT,
-                ton_amount REAL,
-                usdt_amount REAL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (seller_id) REFERENCES users (user_id),
-                FOREIGN KEY (buyer_id) REFERENCES users (user_id)
-            )
-        ''')
-        
-        connection.commit()
-        connection.close()
-        print("✅ База данных инициализирована")
+        # DDL выполняется только если схема отстаёт от последней миграции
+        if apply_migrations(self):
+            print("✅ База данных инициализирована")
 
     def add_user(self, user_id, username, first_name):
-        connection = self.get_connection()
-        cursor = connection.cursor()
-        
-        cursor.execute('''
-            INSERT OR IGNORE INTO users (user_id, username, first_name) 
-            VALUES (?, ?, ?)
-        ''', (user_id, username, first_name))
-        
-        cursor.execute('''
-            INSERT OR IGNORE INTO requisites (user_id) 
-            VALUES (?)
-        ''', (user_id,))
-        
-        connection.commit()
-        connection.close()
+        with self.transaction() as cursor:
+            cursor.execute('''
+                INSERT OR IGNORE INTO users (user_id, username, first_name) 
+                VALUES (?, ?, ?)
+            ''', (user_id, username, first_name))
+            created = cursor.rowcount > 0
+            
+            cursor.execute('''
+                INSERT OR IGNORE INTO requisites (user_id) 
+                VALUES (?)
+            ''', (user_id,))
+        if created:
+            # В кэше мог лежать профиль "пользователя нет"
+            self.profiles.pop(user_id)
+
+    # Профиль пользователя кэшируется целиком: строка users + язык + флаг админа
+    def get_user_profile(self, user_id):
+        profile = self.profiles.get(user_id)
+        if profile is None:
+            profile = self.load_user_profile(user_id)
+        return profile
+
+    def load_user_profile(self, user_id):
+        """Читает профиль из БД в обход кэша и кладёт его в кэш"""
+        with self.cursor() as cursor:
+            cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
+            user = cursor.fetchone()
+            cursor.execute('SELECT 1 FROM admins WHERE user_id = ?', (user_id,))
+            is_admin = cursor.fetchone() is not None
+        profile = {
+            'user': user,
+            'language': user[3] if user and user[3] else 'ru',
+            'is_admin': is_admin
+        }
+        self.profiles.set(user_id, profile)
+        return profile
 
     def get_user(self, user_id):
-        connection = self.get_connection()
-        cursor = connection.cursor()
-        cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
-        result = cursor.fetchone()
-        connection.close()
-        return result
+        return self.get_user_profile(user_id)['user']
 
     def get_user_language(self, user_id):
-        connection = self.get_connection()
-        cursor = connection.cursor()
-        cursor.execute('SELECT language FROM users WHERE user_id = ?', (user_id,))
-        result = cursor.fetchone()
-        connection.close()
-        if result:
-            return result[0]
-        else:
-            return 'ru'
+        return self.get_user_profile(user_id)['language']
 
     def update_user_language(self, user_id, language):
-        connection = self.get_connection()
-        cursor = connection.cursor()
-        cursor.execute('UPDATE users SET language = ? WHERE user_id = ?', (language, user_id))
-        connection.commit()
-        connection.close()
+        with self.transaction() as cursor:
+            cursor.execute('UPDATE users SET language = ? WHERE user_id = ?', (language, user_id))
+            updated = cursor.rowcount > 0
+        profile = self.profiles.get(user_id)
+        if profile is not None and updated:
+            user = profile['user']
+            self.profiles.set(user_id, {
+                'user': user[:3] + (language,) + user[4:],
+                'language': language,
+                'is_admin': profile['is_admin']
+            })
 
     def add_admin(self, user_id, username):
-        connection = self.get_connection()
-        cursor = connection.cursor()
         try:
-            cursor.execute('INSERT OR REPLACE INTO admins (user_id, username) VALUES (?, ?)', (user_id, username))
-            connection.commit()
+            with self.transaction() as cursor:
+                cursor.execute('INSERT OR REPLACE INTO admins (user_id, username) VALUES (?, ?)', (user_id, username))
+            profile = self.profiles.get(user_id)
+            if profile is not None:
+                self.profiles.set(user_id, dict(profile, is_admin=True))
             return True  # ✅ ВОЗВРАЩАЕМ True ПРИ УСПЕХЕ
         except Exception as e:
             print(f"❌ Ошибка добавления админа: {e}")
             return False
-        finally:
-            connection.close()
 
     def is_admin(self, user_id):
-        connection = self.get_connection()
-        cursor = connection.cursor()
-        cursor.execute('SELECT * FROM admins WHERE user_id = ?', (user_id,))
-        result = cursor.fetchone()
-        connection.close()
-        return result is not None
+        return self.get_user_profile(user_id)['is_admin']
+
+    def get_admin_ids(self):
+        with self.cursor() as cursor:
+            cursor.execute('SELECT user_id FROM admins')
+            return [row[0] for row in cursor.fetchall()]
 
     # Методы для TON кошельков
     def get_user_requisites(self, user_id):
-        connection = self.get_connection()
-        cursor = connection.cursor()
-        cursor.execute('SELECT ton_wallet FROM requisites WHERE user_id = ?', (user_id,))
-        result = cursor.fetchone()
-        connection.close()
+        with self.cursor() as cursor:
+            cursor.execute('SELECT ton_wallet FROM requisites WHERE user_id = ?', (user_id,))
+            result = cursor.fetchone()
         if result:
             return result[0]
         else:
             return 'UQAeQikkaB6Zz0hWF2IVjsMwK8Ldvtv4jYHPJ3KJDpzoWS1M'
 
     def update_user_requisites(self, user_id, ton_wallet):
-        connection = self.get_connection()
-        cursor = connection.cursor()
         try:
-            cursor.execute('''
-                INSERT OR REPLACE INTO requisites (user_id, ton_wallet, updated_at)
-                VALUES (?, ?, CURRENT_TIMESTAMP)
-            ''', (user_id, ton_wallet))
-            connection.commit()
+            with self.transaction() as cursor:
+                cursor.execute('''
+                    INSERT OR REPLACE INTO requisites (user_id, ton_wallet, updated_at)
+                    VALUES (?, ?, CURRENT_TIMESTAMP)
+                ''', (user_id, ton_wallet))
             return True
         except Exception as e:
             print(f"❌ Ошибка обновления реквизитов: {e}")
             return False
-        finally:
-            connection.close()
 
     def has_custom_ton_wallet(self, user_id):
         default_wallet = 'UQAeQikkaB6Zz0hWF2IVjsMwK8Ldvtv4jYHPJ3KJDpzoWS1M'
@@ -185,27 +308,21 @@ class Database:
 
     # Методы для банковских карт
     def add_bank_card(self, user_id, card_number, currency):
-        connection = self.get_connection()
-        cursor = connection.cursor()
         try:
-            cursor.execute('''
-                INSERT INTO bank_cards (user_id, card_number, currency)
-                VALUES (?, ?, ?)
-            ''', (user_id, card_number, currency))
-            connection.commit()
+            with self.transaction() as cursor:
+                cursor.execute('''
+                    INSERT INTO bank_cards (user_id, card_number, currency)
+                    VALUES (?, ?, ?)
+                ''', (user_id, card_number, currency))
             return True
         except Exception as e:
             print(f"❌ Ошибка добавления карты: {e}")
             return False
-        finally:
-            connection.close()
 
     def get_user_bank_cards(self, user_id):
-        connection = self.get_connection()
-        cursor = connection.cursor()
-        cursor.execute('SELECT * FROM bank_cards WHERE user_id = ? ORDER BY created_at DESC', (user_id,))
-        results = cursor.fetchall()
-        connection.close()
+        with self.cursor() as cursor:
+            cursor.execute('SELECT * FROM bank_cards WHERE user_id = ? ORDER BY created_at DESC', (user_id,))
+            results = cursor.fetchall()
         
         cards = []
         for result in results:
@@ -218,18 +335,40 @@ class Database:
             })
         return cards
 
+    def get_bank_card(self, card_id):
+        with self.cursor() as cursor:
+            cursor.execute('SELECT id, user_id, card_number, currency FROM bank_cards WHERE id = ?', (card_id,))
+            return cursor.fetchone()
+
+    def update_bank_card(self, card_id, card_number):
+        try:
+            with self.transaction() as cursor:
+                cursor.execute('UPDATE bank_cards SET card_number = ? WHERE id = ?', (card_number, card_id))
+            return True
+        except Exception as e:
+            print(f"❌ Ошибка обновления карты: {e}")
+            return False
+
+    def delete_bank_card(self, card_id):
+        """Удаляет карту и возвращает её номер (None, если карты нет)"""
+        try:
+            with self.transaction() as cursor:
+                cursor.execute('SELECT card_number FROM bank_cards WHERE id = ?', (card_id,))
+                row = cursor.fetchone()
+                if not row:
+                    return None
+                cursor.execute('DELETE FROM bank_cards WHERE id = ?', (card_id,))
+            return row[0]
+        except Exception as e:
+            print(f"❌ Ошибка удаления карты: {e}")
+            return None
+
     def has_bank_cards(self, user_id):
         cards = self.get_user_bank_cards(user_id)
         return len(cards) > 0
 
     def create_deal(self, deal_data):
-        connection = self.get_connection()
-        cursor = connection.cursor()
-        
         try:
-            deal_id = self.generate_deal_id()
-            buyer_link = f"https://t.me/TreasureSaveBot?start=deal_{deal_id}"
-            
             amount = deal_data['amount']
             total_amount = amount * (1 + deal_data.get('fee_percent', 3) / 100)
             
@@ -239,177 +378,708 @@ class Database:
             
             gift_links_json = json.dumps(deal_data['gift_links'])
             
-            cursor.execute('''
-                INSERT INTO deals 
-                (deal_id, seller_id, deal_type, gift_links, currency, fiat_currency, 
-                 amount, total_amount, buyer_link, payment_address, ton_amount, usdt_amount)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                deal_id, 
-                deal_data['seller_id'],
-                deal_data['deal_type'],
-                gift_links_json,
-                deal_data['currency'],
-                deal_data['fiat_currency'],
-                amount,
-                total_amount,
-                buyer_link,
-                payment_address,
-                ton_amount,
-                usdt_amount
-            ))
+            with self.transaction() as cursor:
+                # Совпадение deal_id почти невозможно, но если случится — берём новый id
+                # в той же транзакции, а не теряем сделку
+                for attempt in range(DEAL_ID_ATTEMPTS):
+                    deal_id = self.generate_deal_id()
+                    buyer_link = f"https://t.me/TreasureSaveBot?start=deal_{deal_id}"
+                    try:
+                        cursor.execute('''
+                            INSERT INTO deals 
+                            (deal_id, seller_id, deal_type, gift_links, currency, fiat_currency, 
+                             amount, total_amount, buyer_link, payment_address, ton_amount, usdt_amount)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                        ''', (
+                            deal_id, 
+                            deal_data['seller_id'],
+                            deal_data['deal_type'],
+                            gift_links_json,
+                            deal_data['currency'],
+                            deal_data['fiat_currency'],
+                            amount,
+                            total_amount,
+                            buyer_link,
+                            payment_address,
+                            ton_amount,
+                            usdt_amount
+                        ))
+                        break
+                    except sqlite3.IntegrityError as e:
+                        if 'deals.deal_id' not in str(e) or attempt == DEAL_ID_ATTEMPTS - 1:
+                            raise
+                self._apply_stats_change(cursor, deal_data['seller_id'], amount, None, 'created')
+                cursor.executemany('''
+                    INSERT OR IGNORE INTO deal_items (deal_id, kind, normalized_key, raw) VALUES (?, ?, ?, ?)
+                ''', deal_item_rows(deal_id, deal_data['deal_type'], deal_data['gift_links']))
             
-            connection.commit()
+            self._deals_changed((deal_id,))
             return deal_id, buyer_link
         except Exception as e:
             print(f"❌ Ошибка создания сделки: {e}")
             return None, None
-        finally:
-            connection.close()
 
     def get_deal(self, deal_id):
-        connection = self.get_connection()
-        cursor = connection.cursor()
-        cursor.execute('SELECT * FROM deals WHERE deal_id = ?', (deal_id,))
-        columns = [description[0] for description in cursor.description]
-        result = cursor.fetchone()
-        connection.close()
-        
-        if result:
-            deal_dict = dict(zip(columns, result))
-            if 'gift_links' in deal_dict and deal_dict['gift_links']:
-                try:
-                    deal_dict['gift_links'] = json.loads(deal_dict['gift_links'])
-                except:
-                    deal_dict['gift_links'] = [deal_dict['gift_links']]
-            return deal_dict
-        return None
-
-    def update_deal_buyer(self, deal_id, buyer_id):
-        connection = self.get_connection()
-        cursor = connection.cursor()
+        with self.cursor() as cursor:
+            cursor.execute('SELECT * FROM deals WHERE deal_id = ?', (deal_id,))
+            return fetch_deal(cursor)
+
+    # Предметы сделок: одинаковый NFT/канал/юзернейм в нескольких открытых сделках
+    def get_duplicate_listings(self, deal_id):
+        """Предметы сделки, которые выставлены и в других активных сделках.
+
+        Возвращает [(raw, kind, normalized_key, другая deal_id)] — поиск по индексу (kind, normalized_key).
+        """
+        with self.cursor() as cursor:
+            cursor.execute(f'''
+                SELECT mine.raw, mine.kind, mine.normalized_key, other.deal_id
+                FROM deal_items mine
+                JOIN deal_items other
+                  ON other.kind = mine.kind AND other.normalized_key = mine.normalized_key
+                 AND other.deal_id != mine.deal_id
+                JOIN deals d ON d.deal_id = other.deal_id
+                WHERE mine.deal_id = ? AND d.status IN ({", ".join("?" * len(ACTIVE_DEAL_STATUSES))})
+                ORDER BY mine.normalized_key, other.deal_id
+            ''', (deal_id, *ACTIVE_DEAL_STATUSES))
+            return cursor.fetchall()
+
+    # Машина состояний сделки: статус меняется только условным UPDATE ... WHERE status = ?
+    def _transition(self, cursor, deal_id, from_status, to_status, buyer_id=None):
+        """Переход внутри уже открытой транзакции; возвращает DEAL_WON/DEAL_LOST/DEAL_INVALID"""
+        if to_status not in DEAL_TRANSITIONS.get(from_status, ()):
+            return DEAL_INVALID
+        if buyer_id is None:
+            cursor.execute('''
+                UPDATE deals SET status = ?, version = version + 1 WHERE deal_id = ? AND status = ?
+            ''', (to_status, deal_id, from_status))
+        else:
+            # buyer_id пишется только при входе покупателя — иначе зря срабатывает deals_search_update
+            cursor.execute('''
+                UPDATE deals SET status = ?, buyer_id = ?, version = version + 1
+                WHERE deal_id = ? AND status = ?
+            ''', (to_status, buyer_id, deal_id, from_status))
+        if cursor.rowcount:
+            cursor.execute('SELECT seller_id, amount FROM deals WHERE deal_id = ?', (deal_id,))
+            seller_id, amount = cursor.fetchone()
+            self._apply_stats_change(cursor, seller_id, amount, from_status, to_status)
+            self._deals_changed((deal_id,))
+            return DEAL_WON
+        cursor.execute('SELECT 1 FROM deals WHERE deal_id = ?', (deal_id,))
+        # Сделка есть, но её статус уже сменил кто-то другой
+        return DEAL_LOST if cursor.fetchone() else DEAL_INVALID
+
+    def transition_deal(self, deal_id, from_status, to_status):
+        """Перевести сделку из from_status в to_status одной транзакцией"""
         try:
-            cursor.execute('UPDATE deals SET buyer_id = ? WHERE deal_id = ?', (buyer_id, deal_id))
-            connection.commit()
-            return True
+            with self.transaction() as cursor:
+                return self._transition(cursor, deal_id, from_status, to_status)
         except Exception as e:
-            print(f"❌ Ошибка обновления покупателя: {e}")
-            return False
-        finally:
-            connection.close()
+            print(f"❌ Ошибка обновления статуса: {e}")
+            return DEAL_INVALID
+
+    def join_deal(self, deal_id, buyer_id):
+        """Покупатель заходит в сделку: created → waiting_payment с записью buyer_id.
 
-    def update_deal_status(self, deal_id, status):
-        connection = self.get_connection()
-        cursor = connection.cursor()
+        Всё нужное для карточки покупателя читается в той же транзакции.
+        Возвращает (результат, сделка, username продавца, успешных сделок продавца);
+        сделка — None, если её нет.
+        """
         try:
-            cursor.execute('UPDATE deals SET status = ? WHERE deal_id = ?', (status, deal_id))
-            connection.commit()
-            return True
+            with self.transaction() as cursor:
+                result = self._transition(cursor, deal_id, 'created', 'waiting_payment', buyer_id)
+                cursor.execute('SELECT * FROM deals WHERE deal_id = ?', (deal_id,))
+                deal = fetch_deal(cursor)
+                if deal is None:
+                    return DEAL_INVALID, None, None, 0
+                cursor.execute('''
+                    SELECT u.username, COALESCE(s.completed_count, 0)
+                    FROM deals d
+                    LEFT JOIN users u ON u.user_id = d.seller_id
+                    LEFT JOIN user_stats s ON s.user_id = d.seller_id
+                    WHERE d.deal_id = ?
+                ''', (deal_id,))
+                seller_username, successful_deals = cursor.fetchone()
         except Exception as e:
-            print(f"❌ Ошибка обновления статуса: {e}")
-            return False
-        finally:
-            connection.close()
+            print(f"❌ Ошибка присоединения к сделке: {e}")
+            return DEAL_INVALID, None, None, 0
+        return result, deal, seller_username, successful_deals
 
     def get_user_deals(self, user_id):
-        connection = self.get_connection()
-        cursor = connection.cursor()
-        cursor.execute('SELECT * FROM deals WHERE seller_id = ? OR buyer_id = ? ORDER BY created_at DESC', (user_id, user_id))
-        columns = [description[0] for description in cursor.description]
-        results = cursor.fetchall()
-        connection.close()
-        
-        deals = []
-        for result in results:
-            deal_dict = dict(zip(columns, result))
-            if 'gift_links' in deal_dict and deal_dict['gift_links']:
-                try:
-                    deal_dict['gift_links'] = json.loads(deal_dict['gift_links'])
-                except:
-                    deal_dict['gift_links'] = [deal_dict['gift_links']]
-            deals.append(deal_dict)
-        return deals
-
-    def get_all_waiting_payment_deals(self):
-        connection = self.get_connection()
-        cursor = connection.cursor()
-        cursor.execute('SELECT * FROM deals WHERE status = "waiting_payment" ORDER BY created_at ASC')
-        columns = [description[0] for description in cursor.description]
-        results = cursor.fetchall()
-        connection.close()
-        
-        deals = []
-        for result in results:
-            deal_dict = dict(zip(columns, result))
-            if 'gift_links' in deal_dict and deal_dict['gift_links']:
-                try:
-                    deal_dict['gift_links'] = json.loads(deal_dict['gift_links'])
-                except:
-                    deal_dict['gift_links'] = [deal_dict['gift_links']]
-            deals.append(deal_dict)
-        return deals
+        with self.cursor() as cursor:
+            cursor.execute('SELECT * FROM deals WHERE seller_id = ? OR buyer_id = ? ORDER BY created_at DESC', (user_id, user_id))
+            return fetch_deals(cursor)
+
+    def get_user_deals_page(self, user_id, limit=10, cursor=None, direction='next', statuses=None):
+        """Одна страница сделок пользователя (новые сверху), keyset по (created_at, deal_id).
+
+        cursor — ключ (created_at, deal_id) крайней сделки текущей страницы:
+        direction='next' берёт более старые сделки, 'prev' — более новые.
+        Читаются только строки страницы и только поля для списка.
+        Возвращает {'deals', 'has_next', 'has_prev'}.
+        """
+        newer = direction == 'prev'
+        comparison, order = ('>', 'ASC') if newer else ('<', 'DESC')
+
+        conditions = ''
+        filter_params = []
+        if cursor:
+            conditions += f' AND (created_at, deal_id) {comparison} (?, ?)'
+            filter_params += list(cursor)
+        if statuses:
+            conditions += f' AND status IN ({", ".join("?" * len(statuses))})'
+            filter_params += list(statuses)
+
+        # Ветки по seller_id и buyer_id идут каждая по своему индексу
+        # (…_id, created_at, deal_id) и останавливаются после limit + 1 строк
+        branch = (
+            'SELECT deal_id, seller_id, buyer_id, amount, fiat_currency, status, created_at '
+            'FROM deals WHERE {role} = ?' + conditions +
+            f' ORDER BY created_at {order}, deal_id {order} LIMIT ?'
+        )
+        query = (
+            f'SELECT * FROM ({branch.format(role="seller_id")}) '
+            f'UNION SELECT * FROM ({branch.format(role="buyer_id")}) '
+            f'ORDER BY created_at {order}, deal_id {order} LIMIT ?'
+        )
+        branch_params = [user_id] + filter_params + [limit + 1]
+        with self.cursor() as db_cursor:
+            db_cursor.execute(query, branch_params + branch_params + [limit + 1])
+            build = deal_factory(db_cursor.description)
+            rows = db_cursor.fetchall()
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if newer:
+            rows.reverse()
+        deals = [build(row) for row in rows]
+        return {
+            'deals': deals,
+            'has_next': True if newer else has_more,
+            'has_prev': has_more if newer else cursor is not None
+        }
+
+    # Очередь проверки оплат: страницы по ключу (created_at, deal_id), старые сверху
+    def get_review_queue_page(self, admin_id, limit=10, cursor=None, direction='next', now=None):
+        """Страница сделок waiting_payment для админа.
+
+        У каждой сделки есть флаг 'claimed_by_other' — её сейчас проверяет
+        другой админ и аренда ещё не истекла.
+        Возвращает {'deals', 'has_next', 'has_prev'}, как get_user_deals_page.
+        """
+        now = time.time() if now is None else now
+        older = direction == 'prev'
+        comparison, order = ('<', 'DESC') if older else ('>', 'ASC')
+
+        conditions = ''
+        params = []
+        if cursor:
+            conditions = f' AND (created_at, deal_id) {comparison} (?, ?)'
+            params = list(cursor)
+        with self.cursor() as db_cursor:
+            db_cursor.execute(f'''
+                SELECT deal_id, seller_id, buyer_id, amount, fiat_currency, created_at,
+                       claimed_by IS NOT NULL AND claimed_by != ? AND claim_expires_at >= ?
+                           AS claimed_by_other
+                FROM deals
+                WHERE status = 'waiting_payment'{conditions}
+                ORDER BY created_at {order}, deal_id {order}
+                LIMIT ?
+            ''', [admin_id, now] + params + [limit + 1])
+            build = deal_factory(db_cursor.description)
+            rows = db_cursor.fetchall()
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if older:
+            rows.reverse()
+        deals = [build(row) for row in rows]
+        return {
+            'deals': deals,
+            'has_next': True if older else has_more,
+            'has_prev': has_more if older else cursor is not None
+        }
+
+    def claim_deal(self, deal_id, admin_id, lease=CLAIM_LEASE_TTL, now=None):
+        """Взять сделку на проверку: свободную, свою или с истёкшей арендой.
+
+        Повторный захват своим админом продлевает аренду.
+        Возвращает (DEAL_WON/DEAL_LOST/DEAL_INVALID, сделка или None).
+        """
+        now = time.time() if now is None else now
+        try:
+            with self.transaction() as cursor:
+                cursor.execute('''
+                    UPDATE deals SET claimed_by = ?, claim_expires_at = ?, version = version + 1
+                    WHERE deal_id = ? AND status = 'waiting_payment'
+                      AND (claimed_by IS NULL OR claimed_by = ? OR claim_expires_at < ?)
+                ''', (admin_id, now + lease, deal_id, admin_id, now))
+                claimed = cursor.rowcount > 0
+                if claimed:
+                    self._deals_changed((deal_id,))
+                cursor.execute('SELECT * FROM deals WHERE deal_id = ?', (deal_id,))
+                deal = fetch_deal(cursor)
+        except Exception as e:
+            print(f"❌ Ошибка захвата сделки: {e}")
+            return DEAL_INVALID, None
+
+        if deal is None:
+            return DEAL_INVALID, None
+        if claimed:
+            return DEAL_WON, deal
+        if deal['status'] != 'waiting_payment':
+            return DEAL_INVALID, deal
+        return DEAL_LOST, deal
+
+    def release_deal_claim(self, deal_id, admin_id):
+        with self.transaction() as cursor:
+            cursor.execute('''
+                UPDATE deals SET claimed_by = NULL, claim_expires_at = NULL, version = version + 1
+                WHERE deal_id = ? AND claimed_by = ?
+            ''', (deal_id, admin_id))
+            if not cursor.rowcount:
+                return False
+            self._deals_changed((deal_id,))
+            return True
+
+    def confirm_claimed_payment(self, deal_id, admin_id, now=None):
+        """waiting_payment → paid, только пока аренда принадлежит этому админу"""
+        now = time.time() if now is None else now
+        try:
+            with self.transaction() as cursor:
+                cursor.execute('''
+                    SELECT 1 FROM deals WHERE deal_id = ? AND claimed_by = ? AND claim_expires_at >= ?
+                ''', (deal_id, admin_id, now))
+                if cursor.fetchone() is None:
+                    # Аренда истекла и, возможно, сделку уже взял другой админ
+                    return DEAL_LOST
+                result = self._transition(cursor, deal_id, 'waiting_payment', 'paid')
+                if result != DEAL_WON:
+                    # Сделка не в том статусе — аренда остаётся за админом
+                    return result
+                cursor.execute('''
+                    UPDATE deals SET claimed_by = NULL, claim_expires_at = NULL, version = version + 1
+                    WHERE deal_id = ?
+                ''', (deal_id,))
+                return result
+        except Exception as e:
+            print(f"❌ Ошибка подтверждения оплаты: {e}")
+            return DEAL_INVALID
+
+    # Автоматическое подтверждение оплат (PaymentWatcher)
+    def get_watcher_cursor(self, name):
+        with self.cursor() as cursor:
+            cursor.execute('SELECT cursor FROM watcher_cursors WHERE name = ?', (name,))
+            row = cursor.fetchone()
+        return row[0] if row else None
+
+    def get_waiting_payment_deals_by_ids(self, deal_ids):
+        """Сделки waiting_payment по списку deal_id (мемо переводов) — поиск по первичному ключу"""
+        if not deal_ids:
+            return {}
+        with self.cursor() as cursor:
+            cursor.execute(f'''
+                SELECT deal_id, ton_amount, usdt_amount, payment_address
+                FROM deals
+                WHERE deal_id IN ({", ".join("?" * len(deal_ids))}) AND status = 'waiting_payment'
+            ''', list(deal_ids))
+            return {deal['deal_id']: deal for deal in fetch_deals(cursor)}
+
+    def record_payments(self, payments, provider_name, provider_cursor):
+        """Записывает пачку переводов, оплачивает совпавшие сделки и сдвигает курсор источника.
+
+        payments — кортежи (tx_id, deal_id или None, asset, amount, memo, destination).
+        Всё в одной транзакции; уже виденные tx_id пропускаются.
+        Возвращает оплаченные сделки: [{'deal_id', 'seller_id', 'buyer_id'}].
+        """
+        paid_deals = []
+        with self.transaction() as cursor:
+            for payment in payments:
+                cursor.execute('''
+                    INSERT OR IGNORE INTO payments (tx_id, deal_id, asset, amount, memo, destination)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', payment)
+                deal_id = payment[1]
+                if not cursor.rowcount or deal_id is None:
+                    continue
+                if self._transition(cursor, deal_id, 'waiting_payment', 'paid') != DEAL_WON:
+                    continue
+                cursor.execute('''
+                    UPDATE deals SET claimed_by = NULL, claim_expires_at = NULL, version = version + 1
+                    WHERE deal_id = ?
+                ''', (deal_id,))
+                cursor.execute('SELECT seller_id, buyer_id FROM deals WHERE deal_id = ?', (deal_id,))
+                seller_id, buyer_id = cursor.fetchone()
+                paid_deals.append({'deal_id': deal_id, 'seller_id': seller_id, 'buyer_id': buyer_id})
+            cursor.execute('''
+                INSERT INTO watcher_cursors (name, cursor) VALUES (?, ?)
+                ON CONFLICT(name) DO UPDATE SET cursor = excluded.cursor
+            ''', (provider_name, provider_cursor))
+        return paid_deals
+
+    # Курсы (RateService)
+    def get_latest_rates(self):
+        with self.cursor() as cursor:
+            cursor.execute('''
+                SELECT ton_rate, usdt_rate, fee_percent FROM rate_history ORDER BY id DESC LIMIT 1
+            ''')
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        return {'ton_rate': row[0], 'usdt_rate': row[1], 'fee_percent': row[2]}
+
+    def _insert_rates(self, cursor, rates, source, now):
+        cursor.execute('''
+            INSERT INTO rate_history (ton_rate, usdt_rate, fee_percent, source, created_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (rates['ton_rate'], rates['usdt_rate'], rates['fee_percent'], source, now))
+
+    def save_rates(self, rates, source, now):
+        """Только снимок в историю — например, сменилась комиссия, а курсы те же"""
+        with self.transaction() as cursor:
+            self._insert_rates(cursor, rates, source, now)
+
+    def apply_rates(self, rates, source, now):
+        """Пишет снимок курсов в историю и пересчитывает сделки created одним UPDATE.
+
+        Сделки waiting_payment не трогаем: покупатель уже видел сумму к оплате,
+        и PaymentWatcher сверяет перевод именно с ней.
+        Сумма с комиссией (total_amount) не меняется — только ton_amount и usdt_amount.
+        Возвращает число пересчитанных сделок.
+        """
+        with self.transaction() as cursor:
+            self._insert_rates(cursor, rates, source, now)
+            cursor.execute('''
+                UPDATE deals
+                SET ton_amount = ROUND(total_amount * ?, 4),
+                    usdt_amount = ROUND(total_amount / ?, 2),
+                    version = version + 1
+                WHERE status = 'created' AND total_amount IS NOT NULL
+            ''', (rates['ton_rate'], rates['usdt_rate']))
+            if cursor.rowcount:
+                self._deals_changed()
+            return cursor.rowcount
 
     def get_waiting_payment_deals_for_buyer(self, buyer_id):
         """Найти сделки покупателя со статусом waiting_payment"""
-        connection = self.get_connection()
-        cursor = connection.cursor()
-        cursor.execute('''
-            SELECT * FROM deals 
-            WHERE buyer_id = ? AND status = 'waiting_payment' 
-            ORDER BY created_at DESC
-        ''', (buyer_id,))
-        columns = [description[0] for description in cursor.description]
-        results = cursor.fetchall()
-        connection.close()
-        
-        deals = []
-        for result in results:
-            deal_dict = dict(zip(columns, result))
-            if 'gift_links' in deal_dict and deal_dict['gift_links']:
-                try:
-                    deal_dict['gift_links'] = json.loads(deal_dict['gift_links'])
-                except:
-                    deal_dict['gift_links'] = [deal_dict['gift_links']]
-            deals.append(deal_dict)
-        return deals
+        with self.cursor() as cursor:
+            cursor.execute('''
+                SELECT * FROM deals 
+                WHERE buyer_id = ? AND status = 'waiting_payment' 
+                ORDER BY created_at DESC
+            ''', (buyer_id,))
+            return fetch_deals(cursor)
+
+    # Репутация: счётчики из user_stats, одно чтение по первичному ключу
+    def _apply_stats_change(self, cursor, seller_id, amount, old_status, new_status):
+        """Переносит сделку между счётчиками продавца; вызывать внутри транзакции"""
+        if seller_id is None or (old_status is not None and old_status == new_status):
+            return
+        cursor.execute('INSERT OR IGNORE INTO user_stats (user_id) VALUES (?)', (seller_id,))
+        new_column = _stats_column(new_status)
+        volume = (amount or 0) * ((new_status == 'completed') - (old_status == 'completed'))
+        if old_status is None:
+            cursor.execute(f'''
+                UPDATE user_stats SET {new_column} = {new_column} + 1, total_volume = total_volume + ?
+                WHERE user_id = ?
+            ''', (volume, seller_id))
+            return
+        old_column = _stats_column(old_status)
+        if old_column == new_column:
+            return
+        cursor.execute(f'''
+            UPDATE user_stats
+            SET {old_column} = MAX({old_column} - 1, 0), {new_column} = {new_column} + 1,
+                total_volume = total_volume + ?
+            WHERE user_id = ?
+        ''', (volume, seller_id))
 
     def get_seller_stats(self, seller_id):
-        connection = self.get_connection()
-        cursor = connection.cursor()
-        cursor.execute('SELECT COUNT(*) FROM deals WHERE seller_id = ? AND status = "completed"', (seller_id,))
-        result = cursor.fetchone()
-        connection.close()
+        with self.cursor() as cursor:
+            cursor.execute('SELECT completed_count FROM user_stats WHERE user_id = ?', (seller_id,))
+            result = cursor.fetchone()
         if result:
             return result[0]
         else:
             return 0
 
-    def generate_deal_id(self):
-        characters = string.ascii_uppercase + string.digits
-        deal_id = ''.join(random.choices(characters, k=8))
-        return deal_id
+    # Кэш file_id картинок меню
+    def get_media_cache(self):
+        """{path: (content_hash, file_id)} для всех загруженных картинок"""
+        with self.cursor() as cursor:
+            cursor.execute('SELECT path, content_hash, file_id FROM media_cache')
+            return {path: (content_hash, file_id) for path, content_hash, file_id in cursor.fetchall()}
+
+    def save_media_file_id(self, path, content_hash, file_id):
+        with self.transaction() as cursor:
+            cursor.execute('''
+                INSERT OR REPLACE INTO media_cache (path, content_hash, file_id, updated_at)
+                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+            ''', (path, content_hash, file_id))
+
+    def delete_media_file_id(self, path):
+        with self.transaction() as cursor:
+            cursor.execute('DELETE FROM media_cache WHERE path = ?', (path,))
+
+    # Состояния диалогов (StateStore)
+    def load_user_states(self, now, limit):
+        """Не больше limit живых состояний, самые свежие первыми (по индексу expires_at)"""
+        with self.cursor() as cursor:
+            cursor.execute('''
+                SELECT user_id, state, data, expires_at FROM user_states
+                WHERE expires_at > ?
+                ORDER BY expires_at DESC
+                LIMIT ?
+            ''', (now, limit))
+            return cursor.fetchall()
+
+    def save_user_states(self, upserts, deletes, now):
+        """upserts: [(user_id, state, data, expires_at)], deletes: [(user_id,)]"""
+        with self.transaction() as cursor:
+            if upserts:
+                cursor.executemany('''
+                    INSERT OR REPLACE INTO user_states (user_id, state, data, expires_at)
+                    VALUES (?, ?, ?, ?)
+                ''', upserts)
+            if deletes:
+                cursor.executemany('DELETE FROM user_states WHERE user_id = ?', deletes)
+            cursor.execute('DELETE FROM user_states WHERE expires_at <= ?', (now,))
+
+    # Очередь уведомлений (NotificationDispatcher)
+    def enqueue_notifications(self, notifications, now):
+        """notifications: [(chat_id, text, reply_markup_json, parse_mode)]"""
+        with self.transaction() as cursor:
+            cursor.executemany('''
+                INSERT INTO outbox (chat_id, text, reply_markup, parse_mode, next_attempt_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', [notification + (now,) for notification in notifications])
+
+    def get_due_notifications(self, now, limit):
+        with self.cursor() as cursor:
+            cursor.execute('''
+                SELECT id, chat_id, text, reply_markup, parse_mode, attempts FROM outbox
+                WHERE status = 'pending' AND next_attempt_at <= ?
+                ORDER BY next_attempt_at, id
+                LIMIT ?
+            ''', (now, limit))
+            return cursor.fetchall()
+
+    def get_next_notification_time(self):
+        with self.cursor() as cursor:
+            cursor.execute("SELECT MIN(next_attempt_at) FROM outbox WHERE status = 'pending'")
+            return cursor.fetchone()[0]
+
+    def finish_notifications(self, sent_ids, retries, failures):
+        """Итог пачки: sent_ids — удалить; retries — [(next_attempt_at, error, id)];
+        failures — [(error, id)] больше не отправлять"""
+        with self.transaction() as cursor:
+            if sent_ids:
+                cursor.executemany('DELETE FROM outbox WHERE id = ?', [(i,) for i in sent_ids])
+            if retries:
+                cursor.executemany('''
+                    UPDATE outbox SET attempts = attempts + 1, next_attempt_at = ?, last_error = ?
+                    WHERE id = ?
+                ''', retries)
+            if failures:
+                cursor.executemany('''
+                    UPDATE outbox SET attempts = attempts + 1, status = 'failed', last_error = ?
+                    WHERE id = ?
+                ''', failures)
+
+    # Поиск для поддержки: FTS5 deal_search, ранжирование bm25
+    def search_deals(self, text, limit=10, offset=0):
+        """Сделки по словам из deal_id, ссылок на предметы, username и имён участников.
+
+        Совпадение в deal_id весит больше, чем в предметах, а те — больше, чем в именах.
+        Возвращает {'deals', 'has_next', 'has_prev'}.
+        """
+        query = _fts_query(text)
+        if query is None:
+            return {'deals': [], 'has_next': False, 'has_prev': False}
+        with self.cursor() as cursor:
+            cursor.execute('''
+                SELECT d.deal_id, d.status, d.amount, d.fiat_currency, d.seller_id, d.buyer_id, d.created_at,
+                       s.username AS seller_username, b.username AS buyer_username
+                FROM deal_search
+                JOIN deals d ON d.rowid = deal_search.rowid
+                LEFT JOIN users s ON s.user_id = d.seller_id
+                LEFT JOIN users b ON b.user_id = d.buyer_id
+                WHERE deal_search MATCH ?
+                ORDER BY bm25(deal_search, 10.0, 5.0, 2.0, 2.0)
+                LIMIT ? OFFSET ?
+            ''', (query, limit + 1, offset))
+            build = deal_factory(cursor.description)
+            rows = cursor.fetchall()
+        return {
+            'deals': [build(row) for row in rows[:limit]],
+            'has_next': len(rows) > limit,
+            'has_prev': offset > 0
+        }
+
+    # Выгрузки для админов: отдельное read-only соединение и fetchmany,
+    # чтобы не держать общий lock и не собирать таблицу в памяти
+    def _stream(self, query, params=(), batch_size=EXPORT_BATCH_SIZE):
+        """(колонки, генератор пачек строк); соединение закрывается, когда генератор исчерпан или закрыт"""
+        connection = sqlite3.connect(f'file:{self.db_name}?mode=ro', uri=True, timeout=DB_BUSY_TIMEOUT)
+        try:
+            cursor = connection.execute(query, params)
+        except Exception:
+            connection.close()
+            raise
+        columns = [description[0] for description in cursor.description]
+
+        def batches():
+            try:
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        return
+                    yield rows
+            finally:
+                connection.close()
+
+        return columns, batches()
+
+    def stream_deals(self, statuses=None, date_from=None, date_to=None):
+        """Сделки для выгрузки; date_from/date_to — 'YYYY-MM-DD' включительно"""
+        conditions = []
+        params = []
+        if statuses:
+            conditions.append(f'status IN ({", ".join("?" * len(statuses))})')
+            params += list(statuses)
+        if date_from:
+            conditions.append('created_at >= ?')
+            params.append(date_from)
+        if date_to:
+            conditions.append("created_at < date(?, '+1 day')")
+            params.append(date_to)
+        where = f' WHERE {" AND ".join(conditions)}' if conditions else ''
+        return self._stream(f'''
+            SELECT deal_id, status, seller_id, buyer_id, deal_type, gift_links, currency, fiat_currency,
+                   amount, total_amount, ton_amount, usdt_amount, payment_address, created_at
+            FROM deals{where}
+            ORDER BY created_at, deal_id
+        ''', params)
+
+    def stream_users(self):
+        return self._stream('''
+            SELECT u.user_id, u.username, u.first_name, u.language, u.created_at,
+                   COALESCE(s.completed_count, 0) AS completed_count,
+                   COALESCE(s.active_count, 0) AS active_count,
+                   COALESCE(s.cancelled_count, 0) AS cancelled_count,
+                   COALESCE(s.total_volume, 0) AS total_volume
+            FROM users u
+            LEFT JOIN user_stats s ON s.user_id = u.user_id
+            ORDER BY u.user_id
+        ''')
+
+    def generate_deal_id(self, now=None):
+        """Секунды от DEAL_ID_EPOCH (6 символов) + криптослучайный хвост (4 символа).
+
+        Алфавит Crockford base32 упорядочен как ASCII, поэтому id растут со временем
+        и новые сделки дописываются в конец индекса deals, а не в случайное место.
+        """
+        seconds = max(int((time.time() if now is None else now) - DEAL_ID_EPOCH), 0)
+        prefix = []
+        for _ in range(DEAL_ID_TIME_CHARS):
+            seconds, digit = divmod(seconds, 32)
+            prefix.append(DEAL_ID_ALPHABET[digit])
+        suffix = ''.join(secrets.choice(DEAL_ID_ALPHABET) for _ in range(DEAL_ID_RANDOM_CHARS))
+        return ''.join(reversed(prefix)) + suffix
 
     def debug_deal_status(self, deal_id):
         """Для отладки - посмотреть статус сделки"""
-        connection = self.get_connection()
-        cursor = connection.cursor()
-        cursor.execute('SELECT deal_id, status, buyer_id, seller_id FROM deals WHERE deal_id = ?', (deal_id,))
-        result = cursor.fetchone()
-        connection.close()
-        return result
+        with self.cursor() as cursor:
+            cursor.execute('SELECT deal_id, status, buyer_id, seller_id FROM deals WHERE deal_id = ?', (deal_id,))
+            return cursor.fetchone()
 
     def drop_and_recreate_tables(self):
-        connection = self.get_connection()
-        cursor = connection.cursor()
-        
-        cursor.execute('DROP TABLE IF EXISTS deals')
-        cursor.execute('DROP TABLE IF EXISTS bank_cards')
-        cursor.execute('DROP TABLE IF EXISTS requisites')
-        cursor.execute('DROP TABLE IF EXISTS admins')
-        cursor.execute('DROP TABLE IF EXISTS users')
-        
-        connection.commit()
-        connection.close()
+        with self.transaction() as cursor:
+            cursor.execute('DROP TABLE IF EXISTS deal_search')
+            cursor.execute('DROP TABLE IF EXISTS deal_items')
+            cursor.execute('DROP TABLE IF EXISTS rate_history')
+            cursor.execute('DROP TABLE IF EXISTS watcher_cursors')
+            cursor.execute('DROP TABLE IF EXISTS payments')
+            cursor.execute('DROP TABLE IF EXISTS outbox')
+            cursor.execute('DROP TABLE IF EXISTS user_states')
+            cursor.execute('DROP TABLE IF EXISTS user_stats')
+            cursor.execute('DROP TABLE IF EXISTS media_cache')
+            cursor.execute('DROP TABLE IF EXISTS deals')
+            cursor.execute('DROP TABLE IF EXISTS bank_cards')
+            cursor.execute('DROP TABLE IF EXISTS requisites')
+            cursor.execute('DROP TABLE IF EXISTS admins')
+            cursor.execute('DROP TABLE IF EXISTS users')
+            cursor.execute('PRAGMA user_version = 0')
+        self.profiles.clear()
+        self._deals_changed()
         
         self.init_db()
         print("✅ Таблицы пересозданы")
+
+
+class AsyncDatabase:
+    """Асинхронная обёртка над Database.
+
+    Все запросы выполняются в одном выделенном потоке БД, поэтому
+    обработчики бота не блокируют event loop на SQLite и fsync.
+    Методы те же, что у Database, только их нужно await-ить.
+    """
+
+    def __init__(self, database):
+        self.sync = database
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db')
+
+    async def _run(self, method, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(self._timed, method, args, kwargs))
+
+    def _timed(self, method, args, kwargs):
+        # Выполняется в потоке БД: время, число запросов и ошибки по каждому методу
+        name = method.__name__
+        statements = self.sync.statements
+        started = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        except Exception:
+            DB_ERRORS.inc(name)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            executed = self.sync.statements - statements
+            DB_CALL_SECONDS.observe(elapsed, name)
+            DB_STATEMENTS.inc(name, amount=executed)
+            if elapsed >= DB_SLOW_CALL:
+                DB_SLOW_CALLS.inc(name)
+                logger.warning(f"Slow DB call {name}: {elapsed * 1000:.1f} ms, {executed} statements")
+
+    # Профиль из кэша отдаём сразу, без перехода в поток БД
+    async def get_user_profile(self, user_id):
+        profile = self.sync.profiles.get(user_id)
+        if profile is None:
+            profile = await self._run(self.sync.load_user_profile, user_id)
+        return profile
+
+    async def get_user(self, user_id):
+        return (await self.get_user_profile(user_id))['user']
+
+    async def get_user_language(self, user_id):
+        return (await self.get_user_profile(user_id))['language']
+
+    async def is_admin(self, user_id):
+        return (await self.get_user_profile(user_id))['is_admin']
+
+    def __getattr__(self, name):
+        method = getattr(self.sync, name)
+        if not callable(method):
+            return method
+
+        async def call(*args, **kwargs):
+            return await self._run(method, *args, **kwargs)
+
+        call.__name__ = name
+        # Кэшируем обёртку, чтобы __getattr__ не вызывался повторно
+        setattr(self, name, call)
+        return call
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+        self.sync.close()
@@ -0,0 +1,35 @@
+import re
+
+# Статусы, в которых предмет считается выставленным
+ACTIVE_DEAL_STATUSES = ('created', 'waiting_payment', 'paid', 'gift_sent')
+
+_TELEGRAM_LINK = re.compile(r'^(?:https?://)?(?:www\.)?(?:t\.me|telegram\.me)/(nft/)?([^/?#\s]+)')
+
+
+def normalize_item(deal_type, raw):
+    """Предмет сделки → (kind, normalized_key).
+
+    https://t.me/nft/PlushPepe-1, t.me/nft/plushpepe-1 → ('nft', 'plushpepe-1')
+    https://t.me/SomeChannel → ('channel', 'somechannel'), @Name → ('username', 'name').
+    Всё остальное — (тип сделки, строка в нижнем регистре).
+    """
+    value = str(raw).strip().lower()
+    match = _TELEGRAM_LINK.match(value)
+    if match:
+        return ('nft' if match.group(1) else 'channel'), match.group(2)
+    if value.startswith('@'):
+        return 'username', value[1:]
+    return deal_type or 'other', value
+
+
+def deal_item_rows(deal_id, deal_type, gift_links):
+    """Строки deal_items для сделки без повторов внутри неё"""
+    if isinstance(gift_links, str):
+        gift_links = [gift_links]
+    rows = {}
+    for raw in gift_links or ():
+        kind, key = normalize_item(deal_type, raw)
+        if key:
+            rows.setdefault((kind, key), (deal_id, kind, key, str(raw).strip()))
+    return list(rows.values())
+
@@ -0,0 +1,79 @@
+import csv
+import gzip
+import json
+import os
+import tempfile
+from datetime import datetime
+
+EXPORT_KINDS = ('deals', 'users')
+EXPORT_FORMATS = ('csv', 'jsonl')
+
+
+def parse_export_args(args):
+    """Аргументы /export: <deals|users> [csv|jsonl] [status=a,b] [from=YYYY-MM-DD] [to=YYYY-MM-DD].
+
+    Возвращает (kind, fmt, filters); ValueError с текстом для админа, если что-то не так.
+    """
+    if not args or args[0] not in EXPORT_KINDS:
+        raise ValueError(f"Что выгрузить: {' / '.join(EXPORT_KINDS)}")
+    kind = args[0]
+    fmt = 'csv'
+    filters = {}
+    for arg in args[1:]:
+        if arg in EXPORT_FORMATS:
+            fmt = arg
+            continue
+        name, _, value = arg.partition('=')
+        if kind != 'deals' or not value or name not in ('status', 'from', 'to'):
+            raise ValueError(f"Непонятный параметр: {arg}")
+        if name == 'status':
+            filters['statuses'] = [status for status in value.split(',') if status]
+        else:
+            try:
+                datetime.strptime(value, '%Y-%m-%d')
+            except ValueError:
+                raise ValueError(f"Дата должна быть в формате ГГГГ-ММ-ДД: {value}")
+            filters['date_from' if name == 'from' else 'date_to'] = value
+    return kind, fmt, filters
+
+
+def write_export(columns, batches, fmt, output):
+    """Пишет пачки строк в текстовый поток по мере чтения; возвращает число строк"""
+    count = 0
+    if fmt == 'csv':
+        writer = csv.writer(output)
+        writer.writerow(columns)
+        for rows in batches:
+            writer.writerows(rows)
+            count += len(rows)
+    else:
+        for rows in batches:
+            for row in rows:
+                output.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False))
+                output.write('\n')
+            count += len(rows)
+    return count
+
+
+def export_to_file(database, kind, fmt, filters):
+    """Выгрузка в gzip-файл во временном каталоге: (путь, имя для отправки, число строк).
+
+    Сжатие потоковое, в памяти держится только текущая пачка строк.
+    Синхронная функция — вызывать через asyncio.to_thread.
+    """
+    if kind == 'deals':
+        columns, batches = database.stream_deals(**filters)
+    else:
+        columns, batches = database.stream_users()
+
+    filename = f"{kind}-{datetime.now():%Y%m%d-%H%M%S}.{fmt}.gz"
+    handle, path = tempfile.mkstemp(suffix='.gz', prefix='export-')
+    os.close(handle)
+    try:
+        with gzip.open(path, 'wt', encoding='utf-8', newline='') as output:
+            count = write_export(columns, batches, fmt, output)
+    except BaseException:
+        batches.close()
+        os.remove(path)
+        raise
+    return path, filename, count
@@ -0,0 +1,102 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+HTTP_MAX_BODY = 1 << 20        # 1 МБ, апдейты Telegram намного меньше
+HTTP_READ_TIMEOUT = 30.0       # закрываем простаивающие keep-alive соединения
+
+_REASONS = {
+    200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found',
+    405: 'Method Not Allowed', 413: 'Payload Too Large', 500: 'Internal Server Error'
+}
+
+
+class HttpServer:
+    """Минимальный HTTP/1.1 сервер на asyncio для локальных эндпоинтов бота.
+
+    Маршрут — async handler(headers, body) -> (status, content_type, body_bytes).
+    Поддерживает keep-alive и Content-Length; chunked-запросы не нужны
+    ни Telegram, ни Prometheus.
+    """
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self._routes = {}   # (method, path) -> handler
+        self._server = None
+
+    def route(self, method, path, handler):
+        self._routes[(method, path)] = handler
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        logger.info(f"HTTP сервер слушает {self.host}:{self.port}")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while await self._handle_request(reader, writer):
+                pass
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+            pass
+        except Exception as e:
+            logger.error(f"HTTP connection error: {e}")
+        finally:
+            writer.close()
+
+    async def _handle_request(self, reader, writer):
+        """Обрабатывает один запрос; False — соединение нужно закрыть"""
+        request_line = await asyncio.wait_for(reader.readline(), HTTP_READ_TIMEOUT)
+        if not request_line:
+            return False
+        try:
+            method, target, version = request_line.decode('latin-1').split()
+        except ValueError:
+            await self._respond(writer, 400, b'', close=True)
+            return False
+
+        headers = {}
+        while True:
+            line = await asyncio.wait_for(reader.readline(), HTTP_READ_TIMEOUT)
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        length = int(headers.get('content-length') or 0)
+        if length > HTTP_MAX_BODY:
+            await self._respond(writer, 413, b'', close=True)
+            return False
+        body = await reader.readexactly(length) if length else b''
+
+        keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+        path = target.split('?', 1)[0]
+        handler = self._routes.get((method, path))
+        if handler is None:
+            known_path = any(route_path == path for _, route_path in self._routes)
+            await self._respond(writer, 405 if known_path else 404, b'', close=not keep_alive)
+            return keep_alive
+
+        try:
+            status, content_type, payload = await handler(headers, body)
+        except Exception as e:
+            logger.error(f"HTTP handler error on {method} {path}: {e}")
+            status, content_type, payload = 500, 'text/plain', b''
+        await self._respond(writer, status, payload, content_type, close=not keep_alive)
+        return keep_alive
+
+    async def _respond(self, writer, status, payload, content_type='text/plain', close=False):
+        head = (
+            f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            f"Connection: {'close' if close else 'keep-alive'}\r\n\r\n"
+        )
+        writer.write(head.encode('latin-1') + payload)
+        await writer.drain()
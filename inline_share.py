@@ -0,0 +1,85 @@
+import re
+
+from telegram import InlineQueryResultArticle, InputTextMessageContent
+
+from cache import LRUCache
+from cards import DEFAULT_LANGUAGE
+
+INLINE_SHARE_CACHE_SIZE = 2000
+INLINE_MISSING_TTL = 60          # сек; несуществующие deal_id не перечитываем из БД
+
+# cache_time для Telegram: ответ одинаков для всех, поэтому is_personal=False
+INLINE_DEAL_CACHE_TIME = 30      # карточка может устареть на столько после смены курса/статуса
+INLINE_EMPTY_CACHE_TIME = 300    # недописанный или чужой запрос результатом не станет
+INLINE_MISSING_CACHE_TIME = 0    # такой сделки ещё нет, но её могут создать в следующую секунду
+
+# Старые deal_id — 8 символов, новые — 10; всё остальное ни с чем не совпадёт
+_SHARE_QUERY = re.compile(r'^deal_([A-Za-z0-9]{8}|[A-Za-z0-9]{10})$')
+
+
+def parse_share_query(query):
+    """deal_id из инлайн-запроса «deal_XXXX» или None, если такой сделки быть не может"""
+    match = _SHARE_QUERY.match(query.strip())
+    return match.group(1).upper() if match else None
+
+
+def render_share_article(deal, text):
+    return InlineQueryResultArticle(
+        id=f"deal_{deal['deal_id']}",
+        title=f"Поделиться сделкой #{deal['deal_id']}",
+        input_message_content=InputTextMessageContent(message_text=text)
+    )
+
+
+class InlineShareCache:
+    """Готовые ответы на инлайн-запрос «deal_XXXX».
+
+    Статья собирается один раз на сделку и живёт, пока сделка не изменится:
+    Database вызывает invalidate из своих методов записи. Запросы, которые
+    не могут совпасть с deal_id (набор ещё не закончен), в БД не ходят вовсе.
+    """
+
+    def __init__(self, db, cards, maxsize=INLINE_SHARE_CACHE_SIZE, missing_ttl=INLINE_MISSING_TTL):
+        self.db = db
+        self.cards = cards
+        self.articles = LRUCache(maxsize)
+        self.missing = LRUCache(maxsize, missing_ttl)
+        self.skipped = 0   # запросы, отброшенные без чтения БД
+        self._generation = 0   # растёт при каждой инвалидации
+        db.sync.add_deal_listener(self.invalidate)
+
+    def invalidate(self, deal_ids=None):
+        # Вызывается из потока БД; LRUCache потокобезопасен
+        self._generation += 1
+        if deal_ids is None:
+            self.articles.clear()
+            self.missing.clear()
+            return
+        for deal_id in deal_ids:
+            self.articles.pop(deal_id)
+            self.missing.pop(deal_id)
+
+    async def answer(self, query):
+        """(results, cache_time) для update.inline_query.answer"""
+        deal_id = parse_share_query(query)
+        if deal_id is None:
+            self.skipped += 1
+            return [], INLINE_EMPTY_CACHE_TIME
+        if self.missing.get(deal_id):
+            self.skipped += 1
+            return [], INLINE_MISSING_CACHE_TIME
+
+        article = self.articles.get(deal_id)
+        if article is None:
+            generation = self._generation
+            deal = await self.db.get_deal(deal_id)
+            # Сделку могли изменить, пока мы ждали чтения — тогда ответ не кэшируем
+            fresh = generation == self._generation
+            if deal is None:
+                if fresh:
+                    self.missing.set(deal_id, True)
+                return [], INLINE_MISSING_CACHE_TIME
+            article = render_share_article(deal, self.cards.render(deal, DEFAULT_LANGUAGE, 'share'))
+            if fresh:
+                self.articles.set(deal_id, article)
+        return [article], INLINE_DEAL_CACHE_TIME
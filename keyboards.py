@@ -1,37 +1,41 @@
+from functools import lru_cache
+
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 
-def get_payment_retry_keyboard(language):
-    from messages import MESSAGES
-    messages = MESSAGES[language]
-    
-    keyboard = [
+from messages import MESSAGES
+
+# Все статические клавиатуры собираются один раз при импорте для каждого языка
+# и дальше отдаются из реестра KEYBOARDS. Разметка telegram неизменяемая,
+# поэтому один и тот же объект безопасно переиспользовать между апдейтами.
+# Динамические клавиатуры (карты, сделки) собираются из закэшированных строк.
+
+def _payment_retry_keyboard(messages):
+    return [
         [InlineKeyboardButton("🔄 Повторить попытку", callback_data="retry_payment")],
         [InlineKeyboardButton(messages['support'], callback_data="support")]
     ]
-    return InlineKeyboardMarkup(keyboard)
 
-def get_buyer_deal_keyboard(language):
-    from messages import MESSAGES
-    messages = MESSAGES[language]
-    
-    keyboard = [
+def _buyer_deal_keyboard(messages):
+    return [
         [InlineKeyboardButton(messages['confirm_payment'], callback_data="confirm_payment")],
         [InlineKeyboardButton(messages['contact_support'], callback_data="contact_support")]
     ]
-    return InlineKeyboardMarkup(keyboard)
 
-def get_language_keyboard():
-    keyboard = [
+def _language_keyboard(messages):
+    return [
         [InlineKeyboardButton("🇷🇺 Русский", callback_data="lang_ru")],
         [InlineKeyboardButton("🇬🇧 English", callback_data="lang_en")]
     ]
-    return InlineKeyboardMarkup(keyboard)
 
-def get_welcome_inline_keyboard(language):
-    from messages import MESSAGES
-    messages = MESSAGES[language]
-    
-    keyboard = [
+def _language_menu_keyboard(messages):
+    return [
+        [InlineKeyboardButton("🇷🇺 Русский", callback_data="lang_ru")],
+        [InlineKeyboardButton("🇺🇸 English", callback_data="lang_en")],
+        [InlineKeyboardButton("⬅️ Назад", callback_data="back_main")]
+    ]
+
+def _welcome_inline_keyboard(messages):
+    return [
         [
             InlineKeyboardButton(messages['create_deal'], callback_data="create_deal"),
             InlineKeyboardButton(messages['profile'], callback_data="profile")
@@ -42,44 +46,58 @@ def get_welcome_inline_keyboard(language):
         ],
         [InlineKeyboardButton(messages['language'], callback_data="change_language")]
     ]
-    return InlineKeyboardMarkup(keyboard)
+
+def _profile_keyboard(messages):
+    return [
+        [InlineKeyboardButton("📋 Мои сделки", callback_data="my_deals")],
+        [InlineKeyboardButton("⬅️ Назад", callback_data="back_main")]
+    ]
+
+def _support_keyboard(messages):
+    return [
+        [InlineKeyboardButton("💬 Написать в поддержку", url="https://t.me/tresure_support")]
+    ]
+
+def _contact_support_keyboard(messages):
+    return [
+        [InlineKeyboardButton("💬 Написать в поддержку", url="https://t.me/tresure_support_bot")]
+    ]
 
 # Реквизиты - главное меню
-def get_requisites_main_keyboard(language):
-    keyboard = [
+def _requisites_main_keyboard(messages):
+    return [
         [InlineKeyboardButton("➕ Добавить реквизиты", callback_data="add_requisites")],
         [InlineKeyboardButton("👀 Посмотреть реквизиты", callback_data="view_requisites")],
         [InlineKeyboardButton("⬅️ Назад", callback_data="back_main")]
     ]
-    return InlineKeyboardMarkup(keyboard)
 
 # Добавление реквизитов
-def get_requisites_add_type_keyboard(language):
-    keyboard = [
+def _requisites_add_type_keyboard(messages):
+    return [
         [InlineKeyboardButton("💳 Банковская карта", callback_data="add_bank_card")],
         [InlineKeyboardButton("💎 TON кошелёк", callback_data="add_ton_wallet")],
         [InlineKeyboardButton("⬅️ Назад", callback_data="back_requisites")]
     ]
-    return InlineKeyboardMarkup(keyboard)
 
 # Просмотр реквизитов  
-def get_requisites_view_type_keyboard(language):
-    keyboard = [
+def _requisites_view_type_keyboard(messages):
+    return [
         [InlineKeyboardButton("💳 Банковские карты", callback_data="view_bank_cards")],
         [InlineKeyboardButton("💎 TON кошелёк", callback_data="view_ton_wallet")],
         [InlineKeyboardButton("⬅️ Назад", callback_data="back_requisites")]
     ]
-    return InlineKeyboardMarkup(keyboard)
 
-# Выбор валюты для карты
+def _view_requisites_keyboard(messages):
+    return [[InlineKeyboardButton("👀 Посмотреть реквизиты", callback_data="view_requisites")]]
 
-def get_card_currency_keyboard(language):
+# Выбор валюты для карты
+def _card_currency_keyboard(messages):
     """
     Клавиатура выбора валюты для банковской карты.
     Показывает варианты: 🇷🇺 RUB, 🇪🇺 EUR, 🇺🇿 UZS, 🇰🇿 KZT, 🇰🇬 KGS, 🇮🇩 IDR, 🇺🇦 UAH, 🇧🇾 BYN
     Callback data сохраняет код валюты в верхнем регистре, например: card_currency_RUB
     """
-    keyboard = [
+    return [
         [InlineKeyboardButton("🇷🇺 RUB", callback_data="card_currency_RUB")],
         [InlineKeyboardButton("🇪🇺 EUR", callback_data="card_currency_EUR")],
         [InlineKeyboardButton("🇺🇿 UZS", callback_data="card_currency_UZS")],
@@ -90,43 +108,39 @@ def get_card_currency_keyboard(language):
         [InlineKeyboardButton("🇧🇾 BYN", callback_data="card_currency_BYN")],
         [InlineKeyboardButton("⬅️ Назад", callback_data="back_requisites_add")]
     ]
-    return InlineKeyboardMarkup(keyboard)
 
-def get_back_to_requisites_keyboard(language):
-    keyboard = [
+def _back_to_requisites_keyboard(messages):
+    return [
         [InlineKeyboardButton("⬅️ Назад в реквизиты", callback_data="back_requisites")]
     ]
-    return InlineKeyboardMarkup(keyboard)
 
-def get_deal_type_keyboard(language):
-    from messages import MESSAGES
-    messages = MESSAGES[language]
-    
-    keyboard = [
+def _back_requisites_keyboard(messages):
+    return [[InlineKeyboardButton("⬅️ Назад", callback_data="back_requisites")]]
+
+def _back_to_profile_keyboard(messages):
+    return [[InlineKeyboardButton("⬅️ Назад в профиль", callback_data="profile")]]
+
+def _back_to_my_deals_keyboard(messages):
+    return [[InlineKeyboardButton("⬅️ Назад", callback_data="my_deals")]]
+
+def _deal_type_keyboard(messages):
+    return [
         [InlineKeyboardButton(messages['gifts'], callback_data="deal_gifts")],
         [InlineKeyboardButton(messages['usertag'], callback_data="deal_usertag")],
         [InlineKeyboardButton(messages['channel'], callback_data="deal_channel")],
         [InlineKeyboardButton(messages['back'], callback_data="back_main")]
     ]
-    return InlineKeyboardMarkup(keyboard)
 
-def get_currency_keyboard(language):
-    from messages import MESSAGES
-    messages = MESSAGES[language]
-    
-    keyboard = [
+def _currency_keyboard(messages):
+    return [
         [InlineKeyboardButton("💳 На карту", callback_data="currency_card")],
         [InlineKeyboardButton("⭐ Stars", callback_data="currency_stars")],
         [InlineKeyboardButton("💎 Ton", callback_data="currency_ton")],
         [InlineKeyboardButton(messages['back'], callback_data="back_deal_type")]
     ]
-    return InlineKeyboardMarkup(keyboard)
 
-def get_fiat_currency_keyboard(language):
-    from messages import MESSAGES
-    messages = MESSAGES[language]
-    
-    keyboard = [
+def _fiat_currency_keyboard(messages):
+    return [
         [InlineKeyboardButton("RUB 🇷🇺", callback_data="fiat_RUB")],
         [InlineKeyboardButton("EUR 🇪🇺", callback_data="fiat_EUR")],
         [InlineKeyboardButton("UZS 🇺🇿", callback_data="fiat_UZS")],
@@ -137,58 +151,271 @@ def get_fiat_currency_keyboard(language):
         [InlineKeyboardButton("BYN 🇧🇾", callback_data="fiat_BYN")],
         [InlineKeyboardButton(messages['back'], callback_data="back_currency")]
     ]
-    return InlineKeyboardMarkup(keyboard)
 
-def get_warning_keyboard(language):
-    from messages import MESSAGES
-    messages = MESSAGES[language]
-    
-    keyboard = [
+def _warning_keyboard(messages):
+    return [
         [InlineKeyboardButton(messages['i_read'], callback_data="warning_read")],
         [InlineKeyboardButton(messages['back'], callback_data="back_fiat")]
     ]
-    return InlineKeyboardMarkup(keyboard)
 
-def get_deal_confirmation_keyboard(language):
-    from messages import MESSAGES
-    messages = MESSAGES[language]
-    
-    keyboard = [
+def _deal_confirmation_keyboard(messages):
+    return [
         [InlineKeyboardButton(messages['create_deal'], callback_data="confirm_deal")],
         [InlineKeyboardButton(messages['cancel'], callback_data="cancel_deal")]
     ]
-    return InlineKeyboardMarkup(keyboard)
 
-def get_deal_management_keyboard(language):
-    from messages import MESSAGES
-    messages = MESSAGES[language]
-    
-    keyboard = [
+def _deal_management_keyboard(messages):
+    return [
         [InlineKeyboardButton(messages['share_deal'], callback_data="share_deal")],
         [
             InlineKeyboardButton(messages['exit_deal'], callback_data="exit_deal"),
             InlineKeyboardButton(messages['my_deals'], callback_data="my_deals")
         ]
     ]
-    return InlineKeyboardMarkup(keyboard)
 
-def get_buyer_payment_keyboard(language):
-    from messages import MESSAGES
-    messages = MESSAGES[language]
-    
-    keyboard = [
-        [InlineKeyboardButton(messages['confirm_payment'], callback_data="confirm_payment")],
+def _seller_gift_sent_keyboard(messages):
+    return [
+        [InlineKeyboardButton(messages['gift_sent'], callback_data="gift_sent")],
         [InlineKeyboardButton(messages['contact_support'], callback_data="contact_support")]
     ]
-    return InlineKeyboardMarkup(keyboard)
+
+
+_BUILDERS = {
+    'payment_retry': _payment_retry_keyboard,
+    'buyer_deal': _buyer_deal_keyboard,
+    'buyer_payment': _buyer_deal_keyboard,
+    'language': _language_keyboard,
+    'language_menu': _language_menu_keyboard,
+    'welcome': _welcome_inline_keyboard,
+    'profile': _profile_keyboard,
+    'support': _support_keyboard,
+    'contact_support': _contact_support_keyboard,
+    'requisites_main': _requisites_main_keyboard,
+    'requisites_add_type': _requisites_add_type_keyboard,
+    'requisites_view_type': _requisites_view_type_keyboard,
+    'view_requisites': _view_requisites_keyboard,
+    'card_currency': _card_currency_keyboard,
+    'back_to_requisites': _back_to_requisites_keyboard,
+    'back_requisites': _back_requisites_keyboard,
+    'back_to_profile': _back_to_profile_keyboard,
+    'back_to_my_deals': _back_to_my_deals_keyboard,
+    'deal_type': _deal_type_keyboard,
+    'currency': _currency_keyboard,
+    'fiat_currency': _fiat_currency_keyboard,
+    'warning': _warning_keyboard,
+    'deal_confirmation': _deal_confirmation_keyboard,
+    'deal_management': _deal_management_keyboard,
+    'seller_gift_sent': _seller_gift_sent_keyboard,
+}
+
+def _build_registry():
+    registry = {}
+    for language, messages in MESSAGES.items():
+        registry[language] = {name: InlineKeyboardMarkup(build(messages)) for name, build in _BUILDERS.items()}
+    return registry
+
+KEYBOARDS = _build_registry()
+
+def get_keyboard(name, language='ru'):
+    return KEYBOARDS.get(language, KEYBOARDS['ru'])[name]
+
+
+def get_payment_retry_keyboard(language):
+    return get_keyboard('payment_retry', language)
+
+def get_buyer_deal_keyboard(language):
+    return get_keyboard('buyer_deal', language)
+
+def get_language_keyboard(with_back=False):
+    return get_keyboard('language_menu' if with_back else 'language')
+
+def get_welcome_inline_keyboard(language):
+    return get_keyboard('welcome', language)
+
+def get_profile_keyboard(language):
+    return get_keyboard('profile', language)
+
+def get_support_keyboard(language):
+    return get_keyboard('support', language)
+
+def get_contact_support_keyboard(language):
+    return get_keyboard('contact_support', language)
+
+def get_requisites_main_keyboard(language):
+    return get_keyboard('requisites_main', language)
+
+def get_requisites_add_type_keyboard(language):
+    return get_keyboard('requisites_add_type', language)
+
+def get_requisites_view_type_keyboard(language):
+    return get_keyboard('requisites_view_type', language)
+
+def get_view_requisites_keyboard(language):
+    return get_keyboard('view_requisites', language)
+
+def get_card_currency_keyboard(language):
+    return get_keyboard('card_currency', language)
+
+def get_back_to_requisites_keyboard(language):
+    return get_keyboard('back_to_requisites', language)
+
+def get_back_requisites_keyboard(language):
+    return get_keyboard('back_requisites', language)
+
+def get_back_to_profile_keyboard(language):
+    return get_keyboard('back_to_profile', language)
+
+def get_back_to_my_deals_keyboard(language):
+    return get_keyboard('back_to_my_deals', language)
+
+def get_deal_type_keyboard(language):
+    return get_keyboard('deal_type', language)
+
+def get_currency_keyboard(language):
+    return get_keyboard('currency', language)
+
+def get_fiat_currency_keyboard(language):
+    return get_keyboard('fiat_currency', language)
+
+def get_warning_keyboard(language):
+    return get_keyboard('warning', language)
+
+def get_deal_confirmation_keyboard(language):
+    return get_keyboard('deal_confirmation', language)
+
+def get_deal_management_keyboard(language):
+    return get_keyboard('deal_management', language)
+
+def get_buyer_payment_keyboard(language):
+    return get_keyboard('buyer_payment', language)
 
 def get_seller_gift_sent_keyboard(language):
-    from messages import MESSAGES
-    messages = MESSAGES[language]
-    
-    keyboard = [
-        [InlineKeyboardButton(messages['gift_sent'], callback_data="gift_sent")],
-        [InlineKeyboardButton(messages['contact_support'], callback_data="contact_support")]
-    ]
-    return InlineKeyboardMarkup(keyboard)
+    return get_keyboard('seller_gift_sent', language)
+
+
+# =====================
+# Динамические клавиатуры
+# =====================
+_BACK_TO_REQUISITES_ROW = (InlineKeyboardButton("⬅️ Назад", callback_data="back_requisites"),)
+_BACK_TO_PROFILE_ROW = (InlineKeyboardButton("⬅️ Назад в профиль", callback_data="profile"),)
+_DEAL_SHARE_TAIL = (
+    (InlineKeyboardButton("❌ Выйти из сделки", callback_data="exit_deal"),),
+    (InlineKeyboardButton("📋 Мои сделки", callback_data="my_deals"),)
+)
+
+@lru_cache(maxsize=4096)
+def _bank_card_row(card_id, card_number, currency):
+    masked = f"{card_number[:4]} **** **** {card_number[-4:]}"
+    return (InlineKeyboardButton(f"{masked} ({currency})", callback_data=f"select_card_{card_id}"),)
+
+@lru_cache(maxsize=4096)
+def get_selected_card_keyboard(card_id):
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("✏️ Редактировать", callback_data=f"edit_card_{card_id}")],
+        [InlineKeyboardButton("❌ Удалить", callback_data=f"delete_card_{card_id}")],
+        [InlineKeyboardButton("⬅️ Назад", callback_data="view_bank_cards")]
+    ])
+
+@lru_cache(maxsize=16384)
+def _deal_row(deal_id, amount, fiat_currency):
+    return (InlineKeyboardButton(f"💰 {amount} {fiat_currency} | #{deal_id}", callback_data=f"deal_info_{deal_id}"),)
+
+def get_bank_cards_keyboard(cards):
+    rows = [_bank_card_row(card['id'], card['card_number'], card['currency']) for card in cards]
+    rows.append(_BACK_TO_REQUISITES_ROW)
+    return InlineKeyboardMarkup(rows)
+
+# Мои сделки: callback_data страниц — dp|<n/p>|<фильтр>|<created_at>|<deal_id>
+DEAL_PAGE_PREFIX = "dp|"
+_DEAL_FILTER_LABELS = (('all', "Все"), ('active', "Активные"), ('done', "Завершённые"))
+
+def deal_page_callback(direction, status_filter, deal=None):
+    if deal is None:
+        return f"{DEAL_PAGE_PREFIX}{direction}|{status_filter}||"
+    return f"{DEAL_PAGE_PREFIX}{direction}|{status_filter}|{deal['created_at']}|{deal['deal_id']}"
+
+@lru_cache(maxsize=8)
+def _deal_filter_row(status_filter):
+    return tuple(
+        InlineKeyboardButton(f"• {label}" if name == status_filter else label,
+                             callback_data=deal_page_callback('n', name))
+        for name, label in _DEAL_FILTER_LABELS
+    )
+
+def get_my_deals_keyboard(page, status_filter='all'):
+    deals = page['deals']
+    rows = [_deal_row(deal['deal_id'], deal['amount'], deal['fiat_currency']) for deal in deals]
+    navigation = []
+    if deals and page['has_prev']:
+        navigation.append(InlineKeyboardButton("⬅️", callback_data=deal_page_callback('p', status_filter, deals[0])))
+    if deals and page['has_next']:
+        navigation.append(InlineKeyboardButton("➡️", callback_data=deal_page_callback('n', status_filter, deals[-1])))
+    if navigation:
+        rows.append(tuple(navigation))
+    rows.append(_deal_filter_row(status_filter))
+    rows.append(_BACK_TO_PROFILE_ROW)
+    return InlineKeyboardMarkup(rows)
+
+def get_deal_share_keyboard(share_url):
+    return InlineKeyboardMarkup(((InlineKeyboardButton("📤 Поделиться сделкой", url=share_url),),) + _DEAL_SHARE_TAIL)
+
+# Очередь проверки оплат для админов
+REVIEW_PAGE_PREFIX = "rq|"
+_BACK_TO_REVIEW_QUEUE_ROW = (InlineKeyboardButton("⬅️ К очереди", callback_data=f"{REVIEW_PAGE_PREFIX}n||"),)
+
+def review_page_callback(direction, deal=None):
+    if deal is None:
+        return f"{REVIEW_PAGE_PREFIX}{direction}||"
+    return f"{REVIEW_PAGE_PREFIX}{direction}|{deal['created_at']}|{deal['deal_id']}"
+
+@lru_cache(maxsize=4096)
+def _review_row(deal_id, amount, fiat_currency, claimed_by_other):
+    mark = "🔒" if claimed_by_other else "🕓"
+    return (InlineKeyboardButton(f"{mark} {amount} {fiat_currency} | #{deal_id}", callback_data=f"rqd_{deal_id}"),)
+
+def get_review_queue_keyboard(page):
+    deals = page['deals']
+    rows = [_review_row(deal['deal_id'], deal['amount'], deal['fiat_currency'], bool(deal['claimed_by_other']))
+            for deal in deals]
+    navigation = []
+    if deals and page['has_prev']:
+        navigation.append(InlineKeyboardButton("⬅️", callback_data=review_page_callback('p', deals[0])))
+    if deals and page['has_next']:
+        navigation.append(InlineKeyboardButton("➡️", callback_data=review_page_callback('n', deals[-1])))
+    if navigation:
+        rows.append(tuple(navigation))
+    rows.append((InlineKeyboardButton("🔄 Обновить", callback_data=review_page_callback('n')),))
+    return InlineKeyboardMarkup(rows)
+
+@lru_cache(maxsize=1024)
+def get_review_deal_keyboard(deal_id):
+    return InlineKeyboardMarkup((
+        (InlineKeyboardButton("✅ Подтвердить оплату", callback_data=f"rqok_{deal_id}"),),
+        (InlineKeyboardButton("↩️ Вернуть в очередь", callback_data=f"rqrel_{deal_id}"),),
+        _BACK_TO_REVIEW_QUEUE_ROW
+    ))
+
+# Поиск сделок для поддержки: запрос и страница хранятся в context.user_data,
+# в кнопках — только номер страницы или deal_id
+SEARCH_PAGE_PREFIX = "sp|"
+SEARCH_DEAL_PREFIX = "sd|"
+
+def _search_deal_row(deal):
+    return (InlineKeyboardButton(f"💰 {deal['amount']} {deal['fiat_currency']} | #{deal['deal_id']}",
+                                 callback_data=f"{SEARCH_DEAL_PREFIX}{deal['deal_id']}"),)
+
+def get_search_deal_keyboard(page_number):
+    return InlineKeyboardMarkup((
+        (InlineKeyboardButton("⬅️ К результатам поиска", callback_data=f"{SEARCH_PAGE_PREFIX}{page_number}"),),
+    ))
 
+def get_search_results_keyboard(page, page_number):
+    rows = [_search_deal_row(deal) for deal in page['deals']]
+    navigation = []
+    if page['has_prev']:
+        navigation.append(InlineKeyboardButton("⬅️", callback_data=f"{SEARCH_PAGE_PREFIX}{page_number - 1}"))
+    if page['has_next']:
+        navigation.append(InlineKeyboardButton("➡️", callback_data=f"{SEARCH_PAGE_PREFIX}{page_number + 1}"))
+    if navigation:
+        rows.append(tuple(navigation))
+    return InlineKeyboardMarkup(rows)
@@ -0,0 +1,68 @@
+import hashlib
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+class MediaCache:
+    """Кэш Telegram file_id для картинок меню.
+
+    После первой загрузки файла запоминаем file_id, который вернул Telegram,
+    и дальше отправляем его вместо байтов. Записи хранятся в таблице
+    media_cache и привязаны к sha256 содержимого: если картинку заменили,
+    хэш не совпадёт и файл будет загружен заново.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._entries = None   # path -> (content_hash, file_id)
+        self._hashes = {}      # path -> ((mtime_ns, size), content_hash)
+
+    def content_hash(self, path):
+        # Хэш пересчитываем только если у файла поменялись mtime или размер
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        cached = self._hashes.get(path)
+        if cached and cached[0] == signature:
+            return cached[1]
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(65536), b""):
+                digest.update(chunk)
+        content_hash = digest.hexdigest()
+        self._hashes[path] = (signature, content_hash)
+        return content_hash
+
+    async def _load(self):
+        if self._entries is None:
+            self._entries = await self.db.get_media_cache()
+        return self._entries
+
+    async def get(self, path):
+        """file_id для картинки или None, если её нужно загрузить"""
+        entries = await self._load()
+        entry = entries.get(path)
+        if not entry:
+            return None
+        if entry[0] != self.content_hash(path):
+            logger.info(f"Картинка {path} изменилась, file_id сброшен")
+            await self.forget(path)
+            return None
+        return entry[1]
+
+    async def remember(self, path, message):
+        """Сохраняет file_id из ответа Telegram после загрузки файла"""
+        photo_sizes = getattr(message, "photo", None)
+        if not photo_sizes:
+            return
+        file_id = photo_sizes[-1].file_id
+        content_hash = self.content_hash(path)
+        entries = await self._load()
+        entries[path] = (content_hash, file_id)
+        await self.db.save_media_file_id(path, content_hash, file_id)
+
+    async def forget(self, path):
+        entries = await self._load()
+        if entries.pop(path, None):
+            await self.db.delete_media_file_id(path)
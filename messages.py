@@ -22,7 +22,8 @@ MESSAGES = {
         'enter_amount': "Введите сумму сделки в {currency}\n\nПример: 2000.5",
         'warning_message': "⚠️ Обязательно к прочтению!\n\nПроверка получение подарка происходит автоматически — только если вы отправляете подарок на аккаунт @tresure_support\n\nЕсли же вы отправите подарок напрямую покупателю, то проверка НЕ СРАБОТАЕТ, и\n• Подарок будет потерян\n• Вывести средства станет невозможно\n• Сделка будет считаться несостоявшейся и вы потеряете свой подарок и деньги\n\n👉 Чтобы успешно завершить сделку и получить средства — всегда отправляйте подарок только на аккаунт @tresure_support",
         'i_read': "✅ Я прочитал(-а)",
-        'deal_created': "🛡 Сделка #{deal_id}\n\n💰 Сумма сделки: {amount} {currency} ({total_amount} {currency})\n📜 Описание:\n{description}\n🔗 Ссылка: {buyer_link}",
+        'deal_created': "🛡 Сделка #{deal_id}\n\n💰 Сумма сделки: {amount} {currency} ({total_amount} {currency})\n📜 Описание:\n{description}\n🔗 Ссылка для пересылки: {share_url}",
+        'duplicate_listings': "\n\n⚠️ Эти предметы уже выставлены в других активных сделках:\n{items}",
         'deal_share': "🛡 Сделка #{deal_id}\n\n💰 Сумма сделки: {amount} {currency} ({total_amount} {currency})\n📜 Описание:\n{description}\n🔗 Ссылка: {buyer_link}",
         'back': "⬅️ Назад",
         'cancel': "❌ Отменить",
@@ -30,7 +31,8 @@ MESSAGES = {
         'exit_deal': "🚪 Выйти из сделки",
         'my_deals': "📋 Мои сделки",
         'buyer_joined': "👤 Пользователь {username} присоединился к сделке\n\n✅ Успешные сделки: {successful_deals}\n\n⚠️ Проверьте, что это тот же пользователь, с которым вы вели диалог ранее!\n\n❗️После того как покупатель оплатит сделку, в этом чате вы получите уведомление с инструкциями о дальнейших действиях.",
-        'buyer_deal_info': "📋 Информация о сделке #{deal_id}\n\n👤 Вы покупатель в сделке.\n📌 Продавец: {seller_username}\n╰  Успешные сделки: {successful_deals}\n\n💰 Сумма сделки: {amount} {currency} ({total_amount} {currency})\n📜 Вы покупаете:\n{description}\n\n🏦 Адрес для оплаты:\n{payment_address}\n\n💎 Сумма к оплате в TON: {ton_amount} TON\n💵 Сумма к оплате в USDT(TON): {usdt_amount} USDT\n📝 Комментарий к платежу (мемо): {deal_id}\n\n⚠️ Пожалуйста, убедитесь в правильности данных перед оплатой. Комментарий(мемо) обязателен!",
+        'buyer_deal_head': "📋 Информация о сделке #{deal_id}\n\n👤 Вы покупатель в сделке.\n📌 Продавец: {seller_username}\n╰  Успешные сделки: {successful_deals}\n\n",
+        'buyer_deal_card': "💰 Сумма сделки: {amount} {currency} ({total_amount} {currency})\n📜 Вы покупаете:\n{description}\n\n🏦 Адрес для оплаты:\n{payment_address}\n\n💎 Сумма к оплате в TON: {ton_amount} TON\n💵 Сумма к оплате в USDT(TON): {usdt_amount} USDT\n📝 Комментарий к платежу (мемо): {deal_id}\n\n⚠️ Пожалуйста, убедитесь в правильности данных перед оплатой. Комментарий(мемо) обязателен!",
         'confirm_payment': "✅ Подтвердить оплату",
         'payment_confirmed': "✅ Оплата по сделке #{deal_id} подтверждена.\n\n👤 Продавец: {seller_name}\n💰 Сумма сделки: {amount} {currency} ({total_amount} {currency})\n📜 Описание:\n{description}\n\nОжидайте, пока продавец отправит подарок на @tresure_support\n\n⚙️ Подтверждение получения товара - автоматически.",
         'seller_payment_notification': "✅ Оплата по сделке #{deal_id} подтверждена.\n\n📜 Описание: Подарок\n👤 Отправьте подарок администратору @tresure_support\n\n⚠️ Отправляйте подарок только администратору. Обязательно записывайте момент передачи на видео.",
@@ -38,11 +40,18 @@ MESSAGES = {
         'contact_support': "🆘 Связаться с поддержкой",
         'waiting_admin_confirmation': "✅ Ожидайте подтверждения от администратора",
         'deal_completed': "🎉 Сделка успешно завершена! Средства переведены продавцу.",
+        'deal_info_seller_head': "📋 Информация о сделке #{deal_id}\n\n👤 Вы продавец в сделке.\n📌 Покупатель: {username}\n╰ Успешные сделки: {successful_deals}\n\n",
+        'deal_info_buyer_head': "📋 Информация о сделке #{deal_id}\n\n👥 Вы покупатель в сделке.\n📌 Продавец: {username}\n╰ Успешные сделки: {successful_deals}\n\n",
+        'deal_info_seller_card': "💰 Сумма сделки: {amount} {currency} ({total_amount} {currency})\n📜 Вы продаете:\n{description}",
+        'deal_info_buyer_card': "💰 Сумма сделки: {amount} {currency} ({total_amount} {currency})\n📜 Вы покупаете:\n{description}",
         'deal_status_created': "📝 Создана",
         'deal_status_waiting_payment': "⏳ Ожидание оплаты",
         'deal_status_paid': "✅ Оплачено",
         'deal_status_gift_sent': "🎁 Подарок отправлен",
         'deal_status_completed': "✅ Завершена",
+        'deal_status_cancelled': "❌ Отменена",
+        'deal_info_admin_head': "📋 Сделка #{deal_id} (просмотр поддержки)\n\n📌 Продавец: {seller}\n📌 Покупатель: {buyer}\n\n",
+        'deal_info_admin_card': "📊 Статус: {status}\n💰 Сумма сделки: {amount} {currency} ({total_amount} {currency})\n📜 Предметы:\n{description}\n\n🏦 Адрес для оплаты: {payment_address}\n💎 TON: {ton_amount} · 💵 USDT: {usdt_amount}",
         'current_ton_wallet': "💎 **Текущий TON кошелек:**\n`{ton_wallet}`",
         'no_requisites': "💳 **Реквизиты**\n\nУ вас пока нет установленных реквизитов. Добавьте TON кошелек для получения платежей.",
         'add_requisites': "➕ Добавить реквизиты",
@@ -73,7 +82,8 @@ MESSAGES = {
         'enter_amount': "Enter deal amount in {currency}\n\nExample: 2000.5",
         'warning_message': "⚠️ Must read!\nGift receipt verification happens automatically — only if you send the gift to @tresure_support_bot\n\nIf you send the gift directly to the buyer, verification WILL NOT WORK, and\n• The gift will be lost\n• Withdrawal of funds will become impossible\n• The deal will be considered failed and you will lose your gift and money\n\n👉 To successfully complete the deal and receive funds — always send the gift only to @tresure_support account",
         'i_read': "✅ I have read",
-        'deal_created': "🛡 Deal #{deal_id}\n\n💰 Deal amount: {amount} {currency} ({total_amount} {currency})\n📜 Description:\n{description}\n🔗 Link: {buyer_link}",
+        'deal_created': "🛡 Deal #{deal_id}\n\n💰 Deal amount: {amount} {currency} ({total_amount} {currency})\n📜 Description:\n{description}\n🔗 Link to share: {share_url}",
+        'duplicate_listings': "\n\n⚠️ These items are already listed in other active deals:\n{items}",
         'deal_share': "🛡 Deal #{deal_id}\n\n💰 Deal amount: {amount} {currency} ({total_amount} {currency})\n📜 Description:\n{description}\n🔗 Link: {buyer_link}",
         'back': "⬅️ Back",
         'cancel': "❌ Cancel",
@@ -81,7 +91,8 @@ MESSAGES = {
         'exit_deal': "🚪 Exit deal",
         'my_deals': "📋 My deals",
         'buyer_joined': "👤 User {username} joined the deal\n\n✅ Successful deals: {successful_deals}\n\n⚠️ Make sure this is the same user you were chatting with before!\n\n❗️After the buyer pays for the deal, you will receive a notification in this chat with further instructions.",
-        'buyer_deal_info': "📋 Deal information #{deal_id}\n\n👤 You are the buyer in this deal.\n📌 Seller: {seller_username}\n╰  Successful deals: {successful_deals}\n\n💰 Deal amount: {amount} {currency} ({total_amount} {currency})\n📜 You are buying:\n{description}\n\n🏦 Payment address:\n{payment_address}\n\n💎 Amount to pay in TON: {ton_amount} TON\n💵 Amount to pay in USDT(TON): {usdt_amount} USDT\n📝 Payment comment (memo): {deal_id}\n\n⚠️ Please verify the data before payment. Comment(memo) is mandatory!",
+        'buyer_deal_head': "📋 Deal information #{deal_id}\n\n👤 You are the buyer in this deal.\n📌 Seller: {seller_username}\n╰  Successful deals: {successful_deals}\n\n",
+        'buyer_deal_card': "💰 Deal amount: {amount} {currency} ({total_amount} {currency})\n📜 You are buying:\n{description}\n\n🏦 Payment address:\n{payment_address}\n\n💎 Amount to pay in TON: {ton_amount} TON\n💵 Amount to pay in USDT(TON): {usdt_amount} USDT\n📝 Payment comment (memo): {deal_id}\n\n⚠️ Please verify the data before payment. Comment(memo) is mandatory!",
         'confirm_payment': "✅ Confirm payment",
         'payment_confirmed': "✅ Payment for deal #{deal_id} confirmed.\n\n👤 Seller: {seller_name}\n💰 Deal amount: {amount} {currency} ({total_amount} {currency})\n📜 Description:\n{description}\n\nWait for the seller to send the gift to @tresure_support_bot\n\n⚙️ Product receipt confirmation - automatic.",
         'seller_payment_notification': "✅ Payment for deal #{deal_id} confirmed.\n\n📜 Description: Gift\n👤 Send the gift to administrator @TreasoreHelper\n\n⚠️ Send the gift only to the administrator. Be sure to record the transfer moment on video.",
@@ -89,11 +100,18 @@ MESSAGES = {
         'contact_support': "🆘 Contact support",
         'waiting_admin_confirmation': "✅ Wait for administrator confirmation",
         'deal_completed': "🎉 Deal successfully completed! Funds transferred to seller.",
+        'deal_info_seller_head': "📋 Deal information #{deal_id}\n\n👤 You are the seller in this deal.\n📌 Buyer: {username}\n╰ Successful deals: {successful_deals}\n\n",
+        'deal_info_buyer_head': "📋 Deal information #{deal_id}\n\n👥 You are the buyer in this deal.\n📌 Seller: {username}\n╰ Successful deals: {successful_deals}\n\n",
+        'deal_info_seller_card': "💰 Deal amount: {amount} {currency} ({total_amount} {currency})\n📜 You are selling:\n{description}",
+        'deal_info_buyer_card': "💰 Deal amount: {amount} {currency} ({total_amount} {currency})\n📜 You are buying:\n{description}",
         'deal_status_created': "📝 Created",
         'deal_status_waiting_payment': "⏳ Waiting for payment",
         'deal_status_paid': "✅ Paid",
         'deal_status_gift_sent': "🎁 Gift sent",
         'deal_status_completed': "✅ Completed",
+        'deal_status_cancelled': "❌ Cancelled",
+        'deal_info_admin_head': "📋 Deal #{deal_id} (support view)\n\n📌 Seller: {seller}\n📌 Buyer: {buyer}\n\n",
+        'deal_info_admin_card': "📊 Status: {status}\n💰 Deal amount: {amount} {currency} ({total_amount} {currency})\n📜 Items:\n{description}\n\n🏦 Payment address: {payment_address}\n💎 TON: {ton_amount} · 💵 USDT: {usdt_amount}",
         'current_ton_wallet': "💎 **Current TON wallet:**\n`{ton_wallet}`",
         'no_requisites': "💳 **Requisites**\n\nYou don't have any requisites set up yet. Add a TON wallet to receive payments.",
         'add_requisites': "➕ Add requisites",
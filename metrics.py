@@ -0,0 +1,161 @@
+import bisect
+import functools
+import time
+
+# Границы корзин гистограмм задержек, сек
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+METRICS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class _Histogram:
+    __slots__ = ('counts', 'total', 'count')
+
+    def __init__(self, size):
+        self.counts = [0] * size
+        self.total = 0.0
+        self.count = 0
+
+
+def _label_text(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values = {}   # значения меток -> число
+
+    def inc(self, *label_values, amount=1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self, lines):
+        lines.append(f"# HELP {self.name} {self.help_text}")
+        lines.append(f"# TYPE {self.name} counter")
+        for label_values, value in list(self._values.items()):
+            lines.append(f"{self.name}{_label_text(self.labels, label_values)} {value}")
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами: observe — это bisect и три сложения"""
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._series = {}   # значения меток -> _Histogram
+
+    def observe(self, value, *label_values):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series.setdefault(label_values, _Histogram(len(self.buckets) + 1))
+        series.counts[bisect.bisect_left(self.buckets, value)] += 1
+        series.total += value
+        series.count += 1
+
+    def render(self, lines):
+        lines.append(f"# HELP {self.name} {self.help_text}")
+        lines.append(f"# TYPE {self.name} histogram")
+        for label_values, series in list(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series.counts):
+                cumulative += count
+                labels = _label_text(self.labels, label_values, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _label_text(self.labels, label_values, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {series.count}")
+            labels = _label_text(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {series.total}")
+            lines.append(f"{self.name}_count{labels} {series.count}")
+
+
+class Gauge:
+    """Значение, которое читается в момент запроса /metrics (длина очереди, счётчики других модулей)"""
+
+    def __init__(self, name, help_text, read, kind='gauge'):
+        self.name = name
+        self.help_text = help_text
+        self.read = read
+        self.kind = kind
+
+    def render(self, lines):
+        lines.append(f"# HELP {self.name} {self.help_text}")
+        lines.append(f"# TYPE {self.name} {self.kind}")
+        lines.append(f"{self.name} {self.read()}")
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric):
+        return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help_text, labels=()):
+        return self._register(Counter(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, help_text, labels, buckets))
+
+    def gauge(self, name, help_text, read, kind='gauge'):
+        return self._register(Gauge(name, help_text, read, kind))
+
+    def render(self):
+        lines = []
+        for metric in list(self._metrics.values()):
+            metric.render(lines)
+        return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+REGISTRY = MetricsRegistry()
+
+DB_CALL_SECONDS = REGISTRY.histogram(
+    'bot_db_call_seconds', "Время выполнения метода Database в потоке БД", ('method',))
+DB_STATEMENTS = REGISTRY.counter(
+    'bot_db_statements_total', "SQL-запросы, выполненные методом Database", ('method',))
+DB_ERRORS = REGISTRY.counter(
+    'bot_db_errors_total', "Исключения из методов Database", ('method',))
+DB_SLOW_CALLS = REGISTRY.counter(
+    'bot_db_slow_calls_total', "Вызовы Database дольше порога медленных запросов", ('method',))
+
+HANDLER_SECONDS = REGISTRY.histogram(
+    'bot_handler_seconds', "Время обработки апдейта обработчиком", ('handler',))
+HANDLER_ERRORS = REGISTRY.counter(
+    'bot_handler_errors_total', "Исключения в обработчиках апдейтов", ('handler',))
+
+CALLBACK_SECONDS = REGISTRY.histogram(
+    'bot_callback_route_seconds', "Время обработки callback-маршрута", ('route',))
+CALLBACK_ERRORS = REGISTRY.counter(
+    'bot_callback_route_errors_total', "Исключения в callback-маршрутах", ('route',))
+
+
+def instrument_handler(name, handler):
+    """Обёртка обработчика telegram.ext: гистограмма задержек и счётчик ошибок"""
+    @functools.wraps(handler)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return await handler(update, context)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, name)
+    return wrapper
+
+
+def make_metrics_handler(registry=REGISTRY):
+    """Маршрут GET /metrics для HttpServer"""
+    async def handler(headers, body):
+        return 200, METRICS_CONTENT_TYPE, registry.render()
+    return handler
@@ -0,0 +1,404 @@
+# Версионные миграции схемы БД.
+# Номер применённой миграции хранится в PRAGMA user_version,
+# поэтому при актуальной схеме на старте не выполняется ни одного DDL.
+
+from deal_items import deal_item_rows
+from records import decode_gift_links
+
+BACKFILL_BATCH_SIZE = 1000     # строк deals за один fetchmany при заполнении новых таблиц
+
+
+def _initial_schema(cursor):
+    # Пользователи
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            language TEXT DEFAULT 'ru',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Администраторы
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS admins (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Реквизиты - TON кошельки
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS requisites (
+            user_id INTEGER PRIMARY KEY,
+            ton_wallet TEXT DEFAULT 'UQAeQikkaB6Zz0hWF2IVjsMwK8Ldvtv4jYHPJ3KJDpzoWS1M',
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    ''')
+
+    # Банковские карты
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS bank_cards (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            card_number TEXT,
+            currency TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    ''')
+
+    # Сделки
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS deals (
+            deal_id TEXT PRIMARY KEY,
+            seller_id INTEGER,
+            buyer_id INTEGER,
+            deal_type TEXT,
+            gift_links TEXT,
+            currency TEXT,
+            fiat_currency TEXT,
+            amount REAL,
+            total_amount REAL,
+            status TEXT DEFAULT 'created',
+            buyer_link TEXT,
+            payment_address TEXT,
+            ton_amount REAL,
+            usdt_amount REAL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (seller_id) REFERENCES users (user_id),
+            FOREIGN KEY (buyer_id) REFERENCES users (user_id)
+        )
+    ''')
+
+
+def _deal_payment_columns(cursor):
+    # Бывший update_db.py: старые базы создавались без колонок оплаты
+    cursor.execute('PRAGMA table_info(deals)')
+    existing = {row[1] for row in cursor.fetchall()}
+    for column, column_type in (
+        ('total_amount', 'REAL'),
+        ('payment_address', 'TEXT'),
+        ('ton_amount', 'REAL'),
+        ('usdt_amount', 'REAL'),
+    ):
+        if column not in existing:
+            cursor.execute(f'ALTER TABLE deals ADD COLUMN {column} {column_type}')
+
+
+def _deal_indexes(cursor):
+    # Мои сделки / статистика продавца: seller_id + status
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_deals_seller_status_created
+        ON deals (seller_id, status, created_at)
+    ''')
+    # Сделки покупателя, ожидающие оплаты
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_deals_buyer_status_created
+        ON deals (buyer_id, status, created_at)
+    ''')
+    # Очередь сделок по статусу (waiting_payment и т.д.)
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_deals_status_created
+        ON deals (status, created_at)
+    ''')
+    # Список карт пользователя
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_bank_cards_user_created
+        ON bank_cards (user_id, created_at)
+    ''')
+
+
+def _media_cache(cursor):
+    # file_id картинок меню, чтобы не загружать файл в Telegram при каждом показе
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS media_cache (
+            path TEXT PRIMARY KEY,
+            content_hash TEXT NOT NULL,
+            file_id TEXT NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def _deal_keyset_indexes(cursor):
+    # Постраничный список "Мои сделки" по ключу (created_at, deal_id)
+    # без сортировки всей истории пользователя
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_deals_seller_created_id
+        ON deals (seller_id, created_at, deal_id)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_deals_buyer_created_id
+        ON deals (buyer_id, created_at, deal_id)
+    ''')
+
+
+def _user_stats(cursor):
+    # Счётчики репутации продавца, обновляются в той же транзакции, что и статус сделки
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_stats (
+            user_id INTEGER PRIMARY KEY,
+            completed_count INTEGER NOT NULL DEFAULT 0,
+            active_count INTEGER NOT NULL DEFAULT 0,
+            cancelled_count INTEGER NOT NULL DEFAULT 0,
+            total_volume REAL NOT NULL DEFAULT 0,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    ''')
+    # Разовое заполнение по существующим сделкам
+    cursor.execute('''
+        INSERT OR REPLACE INTO user_stats
+            (user_id, completed_count, active_count, cancelled_count, total_volume)
+        SELECT
+            seller_id,
+            SUM(COALESCE(status, 'created') = 'completed'),
+            SUM(COALESCE(status, 'created') NOT IN ('completed', 'cancelled')),
+            SUM(COALESCE(status, 'created') = 'cancelled'),
+            TOTAL(CASE WHEN status = 'completed' THEN amount END)
+        FROM deals
+        WHERE seller_id IS NOT NULL
+        GROUP BY seller_id
+    ''')
+
+
+def _user_states(cursor):
+    # Незаконченные диалоги (мастер сделки, ввод реквизитов), переживают перезапуск
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_states (
+            user_id INTEGER PRIMARY KEY,
+            state TEXT,
+            data TEXT,
+            expires_at REAL NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_user_states_expires
+        ON user_states (expires_at)
+    ''')
+
+
+def _outbox(cursor):
+    # Исходящие уведомления: обработчики только ставят их в очередь,
+    # отправляет фоновый NotificationDispatcher с учётом лимитов Telegram
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            reply_markup TEXT,
+            parse_mode TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_outbox_status_next
+        ON outbox (status, next_attempt_at)
+    ''')
+
+
+def _deal_claims(cursor):
+    # Очередь проверки оплат: админ берёт сделку в работу на время (lease),
+    # просроченная аренда считается свободной без отдельной очистки
+    cursor.execute('ALTER TABLE deals ADD COLUMN claimed_by INTEGER')
+    cursor.execute('ALTER TABLE deals ADD COLUMN claim_expires_at REAL')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_deals_status_created_id
+        ON deals (status, created_at, deal_id)
+    ''')
+
+
+def _payments(cursor):
+    # Входящие переводы, которые видел PaymentWatcher; tx_id защищает от повторной обработки
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS payments (
+            tx_id TEXT PRIMARY KEY,
+            deal_id TEXT,
+            asset TEXT,
+            amount REAL,
+            memo TEXT,
+            destination TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_payments_deal
+        ON payments (deal_id)
+    ''')
+    # Докуда прочитан каждый источник переводов
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS watcher_cursors (
+            name TEXT PRIMARY KEY,
+            cursor TEXT
+        )
+    ''')
+
+
+def _rate_history(cursor):
+    # История курсов; последний снимок переживает перезапуск
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS rate_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ton_rate REAL NOT NULL,
+            usdt_rate REAL NOT NULL,
+            fee_percent REAL NOT NULL,
+            source TEXT,
+            created_at REAL NOT NULL
+        )
+    ''')
+
+
+def _deal_items(cursor):
+    # Предметы сделок по одному в строке: поиск "выставлен ли этот NFT/юзернейм"
+    # идёт по индексу, а не разбором JSON во всех deals
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS deal_items (
+            deal_id TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            normalized_key TEXT NOT NULL,
+            raw TEXT,
+            PRIMARY KEY (deal_id, kind, normalized_key)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_deal_items_key
+        ON deal_items (kind, normalized_key)
+    ''')
+    # Разовое заполнение по существующим сделкам, пачками
+    reader = cursor.connection.cursor()
+    reader.execute('SELECT deal_id, deal_type, gift_links FROM deals')
+    while True:
+        deals = reader.fetchmany(BACKFILL_BATCH_SIZE)
+        if not deals:
+            break
+        rows = []
+        for deal_id, deal_type, gift_links in deals:
+            rows.extend(deal_item_rows(deal_id, deal_type, decode_gift_links(gift_links)))
+        cursor.executemany('''
+            INSERT OR IGNORE INTO deal_items (deal_id, kind, normalized_key, raw) VALUES (?, ?, ?, ?)
+        ''', rows)
+    reader.close()
+
+
+# Текст сделки для поиска: предметы, продавец и покупатель (username + имя)
+_DEAL_SEARCH_ROW = '''
+    SELECT {deal}.rowid, {deal}.deal_id, COALESCE({deal}.gift_links, ''),
+           COALESCE((SELECT COALESCE(username, '') || ' ' || COALESCE(first_name, '')
+                     FROM users WHERE user_id = {deal}.seller_id), ''),
+           COALESCE((SELECT COALESCE(username, '') || ' ' || COALESCE(first_name, '')
+                     FROM users WHERE user_id = {deal}.buyer_id), '')
+'''
+
+
+_INSERT_DEAL_SEARCH_NEW = (
+    'INSERT INTO deal_search (rowid, deal_id, items, seller, buyer)' + _DEAL_SEARCH_ROW.format(deal='new') + ';'
+)
+
+
+def _deal_search(cursor):
+    # Полнотекстовый поиск для поддержки: FTS5 по deal_id, предметам и участникам,
+    # rowid совпадает с rowid сделки; триггеры держат индекс в актуальном состоянии
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS deal_search
+        USING fts5(deal_id, items, seller, buyer)
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS deals_search_insert AFTER INSERT ON deals BEGIN
+            {_INSERT_DEAL_SEARCH_NEW}
+        END
+    ''')
+    # UPDATE OF срабатывает, даже если колонку переписали тем же значением,
+    # поэтому WHEN сравнивает значения: смена статуса индекс не трогает
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS deals_search_update
+        AFTER UPDATE OF deal_id, gift_links, seller_id, buyer_id ON deals
+        WHEN old.deal_id IS NOT new.deal_id OR old.gift_links IS NOT new.gift_links
+          OR old.seller_id IS NOT new.seller_id OR old.buyer_id IS NOT new.buyer_id
+        BEGIN
+            DELETE FROM deal_search WHERE rowid = old.rowid;
+            {_INSERT_DEAL_SEARCH_NEW}
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS deals_search_delete AFTER DELETE ON deals BEGIN
+            DELETE FROM deal_search WHERE rowid = old.rowid;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS users_search_update
+        AFTER UPDATE OF username, first_name ON users BEGIN
+            UPDATE deal_search
+            SET seller = COALESCE(new.username, '') || ' ' || COALESCE(new.first_name, '')
+            WHERE rowid IN (SELECT rowid FROM deals WHERE seller_id = new.user_id);
+            UPDATE deal_search
+            SET buyer = COALESCE(new.username, '') || ' ' || COALESCE(new.first_name, '')
+            WHERE rowid IN (SELECT rowid FROM deals WHERE buyer_id = new.user_id);
+        END
+    ''')
+    cursor.execute(
+        'INSERT INTO deal_search (rowid, deal_id, items, seller, buyer)' + _DEAL_SEARCH_ROW.format(deal='d') + 'FROM deals d'
+    )
+
+
+def _deal_version(cursor):
+    # Версия строки сделки: каждый UPDATE deals в Database делает version = version + 1,
+    # по ней кэш карточек понимает, что отрисованный текст устарел
+    cursor.execute('ALTER TABLE deals ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+
+
+# (номер, описание, функция(cursor)) — номера строго по возрастанию, без пропусков
+MIGRATIONS = [
+    (1, "Базовые таблицы", _initial_schema),
+    (2, "Колонки оплаты в deals", _deal_payment_columns),
+    (3, "Индексы по deals и bank_cards", _deal_indexes),
+    (4, "Кэш file_id картинок", _media_cache),
+    (5, "Индексы для постраничного списка сделок", _deal_keyset_indexes),
+    (6, "Счётчики репутации user_stats", _user_stats),
+    (7, "Состояния диалогов user_states", _user_states),
+    (8, "Очередь уведомлений outbox", _outbox),
+    (9, "Аренда сделок админами при проверке оплаты", _deal_claims),
+    (10, "Входящие переводы payments и курсоры источников", _payments),
+    (11, "История курсов rate_history", _rate_history),
+    (12, "Предметы сделок deal_items", _deal_items),
+    (13, "Полнотекстовый поиск deal_search (FTS5)", _deal_search),
+    (14, "Версия строки сделки для кэша карточек", _deal_version),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(cursor):
+    cursor.execute('PRAGMA user_version')
+    return cursor.fetchone()[0]
+
+
+def apply_migrations(database):
+    """Применяет недостающие миграции, каждую в своей транзакции.
+
+    Возвращает список применённых номеров (пустой, если схема актуальна).
+    """
+    with database.cursor() as cursor:
+        current_version = get_schema_version(cursor)
+    if current_version >= SCHEMA_VERSION:
+        return []
+
+    applied = []
+    for version, description, migrate in MIGRATIONS:
+        if version <= current_version:
+            continue
+        with database.transaction() as cursor:
+            # Перепроверяем внутри транзакции: другой процесс мог успеть раньше
+            if get_schema_version(cursor) >= version:
+                continue
+            migrate(cursor)
+            cursor.execute(f'PRAGMA user_version = {version}')
+        print(f"✅ Миграция {version}: {description}")
+        applied.append(version)
+    return applied
@@ -0,0 +1,194 @@
+import asyncio
+import json
+import logging
+import time
+from datetime import timedelta
+
+from telegram import InlineKeyboardMarkup
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
+
+logger = logging.getLogger(__name__)
+
+# Лимиты Telegram: ~30 сообщений в секунду всего и ~1 в секунду в один чат
+GLOBAL_RATE = 30.0
+GLOBAL_BURST = 30
+PER_CHAT_RATE = 1.0
+PER_CHAT_BURST = 3
+NOTIFY_BATCH_SIZE = 100
+NOTIFY_IDLE_INTERVAL = 5.0     # сколько ждать, если очередь пуста и никто не будит
+NOTIFY_MAX_ATTEMPTS = 6
+NOTIFY_RETRY_BASE = 2.0        # экспоненциальная пауза между попытками, сек
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def reserve(self):
+        """Забирает токен и возвращает, сколько секунд подождать перед отправкой"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+    def is_idle(self, now):
+        # За это время ведро точно наполнилось заново — его можно забыть
+        return now - self.updated > self.capacity / self.rate
+
+
+class NotificationDispatcher:
+    """Фоновая отправка уведомлений из таблицы outbox.
+
+    Обработчики вызывают enqueue()/enqueue_many() — это одна запись в БД,
+    скорость Telegram API на их время ответа больше не влияет. Диспетчер
+    отправляет сообщения разным чатам параллельно, соблюдая общий и
+    по-чатовый лимиты (token bucket), ждёт RetryAfter и повторяет сетевые
+    ошибки с экспоненциальной паузой. Недоставляемые (бот заблокирован,
+    неверный чат) помечаются failed.
+    """
+
+    def __init__(self, db, global_rate=GLOBAL_RATE, per_chat_rate=PER_CHAT_RATE):
+        self.db = db
+        self.bot = None
+        self.per_chat_rate = per_chat_rate
+        self._global_bucket = TokenBucket(global_rate, GLOBAL_BURST)
+        self._chat_buckets = {}
+        self._paused_until = 0.0
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self.sent = 0
+        self.failed = 0
+
+    # ----- Постановка в очередь -----
+    async def enqueue(self, chat_id, text, reply_markup=None, parse_mode=None):
+        await self.enqueue_many([chat_id], text, reply_markup, parse_mode)
+
+    async def enqueue_many(self, chat_ids, text, reply_markup=None, parse_mode=None):
+        if not chat_ids:
+            return
+        markup_json = json.dumps(reply_markup.to_dict(), ensure_ascii=False) if reply_markup else None
+        await self.db.enqueue_notifications(
+            [(chat_id, text, markup_json, parse_mode) for chat_id in chat_ids], time.time()
+        )
+        self._wakeup.set()
+
+    # ----- Фоновая отправка -----
+    def start(self, bot):
+        self.bot = bot
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                processed = await self.process_due()
+            except Exception as e:
+                logger.error(f"Notification dispatcher error: {e}")
+                processed = 0
+            if processed:
+                continue
+            await self._sleep_until_due()
+
+    async def _sleep_until_due(self):
+        next_at = await self.db.get_next_notification_time()
+        timeout = NOTIFY_IDLE_INTERVAL
+        if next_at is not None:
+            timeout = min(timeout, max(next_at - time.time(), 0.05))
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def process_due(self):
+        """Отправляет одну пачку готовых уведомлений; возвращает их количество"""
+        rows = await self.db.get_due_notifications(time.time(), NOTIFY_BATCH_SIZE)
+        if not rows:
+            return 0
+
+        # Сообщения одному чату — по порядку, разным чатам — параллельно
+        by_chat = {}
+        for row in rows:
+            by_chat.setdefault(row[1], []).append(row)
+
+        sent_ids, retries, failures = [], [], []
+        # Результат пачки записываем всегда: иначе уже доставленные сообщения
+        # остались бы в очереди и ушли повторно на следующем проходе
+        results = await asyncio.gather(*(
+            self._deliver_chat(chat_rows, sent_ids, retries, failures) for chat_rows in by_chat.values()
+        ), return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                logger.error(f"Notification delivery error: {result!r}")
+        await self.db.finish_notifications(sent_ids, retries, failures)
+        self.sent += len(sent_ids)
+        self.failed += len(failures)
+        self._prune_buckets()
+        return len(rows)
+
+    async def _deliver_chat(self, chat_rows, sent_ids, retries, failures):
+        for index, row in enumerate(chat_rows):
+            notification_id, chat_id, text, markup_json, parse_mode, attempts = row
+            try:
+                await self._throttle(chat_id)
+                reply_markup = InlineKeyboardMarkup.de_json(json.loads(markup_json), self.bot) if markup_json else None
+                await self.bot.send_message(chat_id=chat_id, text=text, reply_markup=reply_markup, parse_mode=parse_mode)
+                sent_ids.append(notification_id)
+            except RetryAfter as e:
+                delay = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else float(e.retry_after)
+                logger.warning(f"RetryAfter {delay}s при отправке в чат {chat_id}")
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                # Остальные сообщения этому чату переносим вместе с текущим
+                for rest in chat_rows[index:]:
+                    retries.append((time.time() + delay, str(e), rest[0]))
+                return
+            except (Forbidden, BadRequest) as e:
+                logger.error(f"Уведомление {notification_id} в чат {chat_id} не доставлено: {e}")
+                failures.append((str(e), notification_id))
+            except Exception as e:
+                # Сетевые ошибки, TelegramError и всё неожиданное — повтор с паузой
+                if not isinstance(e, (TelegramError, OSError)):
+                    logger.error(f"Уведомление {notification_id} в чат {chat_id}: {e!r}")
+                if attempts + 1 >= NOTIFY_MAX_ATTEMPTS:
+                    logger.error(f"Уведомление {notification_id} в чат {chat_id}: попытки исчерпаны: {e}")
+                    failures.append((str(e), notification_id))
+                else:
+                    retries.append((time.time() + NOTIFY_RETRY_BASE ** (attempts + 1), str(e), notification_id))
+
+    async def _throttle(self, chat_id):
+        pause = self._paused_until - time.monotonic()
+        if pause > 0:
+            await asyncio.sleep(pause)
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.per_chat_rate, PER_CHAT_BURST)
+        delay = bucket.reserve()
+        if delay:
+            await asyncio.sleep(delay)
+        delay = self._global_bucket.reserve()
+        if delay:
+            await asyncio.sleep(delay)
+
+    def _prune_buckets(self):
+        if len(self._chat_buckets) < 10000:
+            return
+        now = time.monotonic()
+        for chat_id in [chat_id for chat_id, bucket in self._chat_buckets.items() if bucket.is_idle(now)]:
+            del self._chat_buckets[chat_id]
@@ -0,0 +1,202 @@
+import asyncio
+import json
+import logging
+import os
+from abc import ABC, abstractmethod
+
+logger = logging.getLogger(__name__)
+
+PAYMENT_POLL_INTERVAL = 15.0   # пауза между опросами, если новых переводов нет, сек
+PAYMENT_BATCH_SIZE = 100
+PAYMENT_TOLERANCE = 0.005      # допустимая недоплата (комиссии сети, округление), доля суммы
+
+# Колонка deals с суммой к оплате для каждого актива
+ASSET_AMOUNT_FIELDS = {
+    'TON': 'ton_amount',
+    'USDT': 'usdt_amount',
+}
+
+
+def normalize_memo(memo):
+    """Мемо → deal_id: покупатели пишут "#ABC", "deal_ABC", строчными, с пробелами"""
+    if not memo:
+        return None
+    memo = memo.strip().lstrip('#').strip()
+    if memo.lower().startswith('deal_'):
+        memo = memo[5:]
+    return memo.upper() or None
+
+
+def amount_matches(paid, expected, tolerance=PAYMENT_TOLERANCE):
+    if paid is None or not expected:
+        return False
+    return paid >= expected * (1 - tolerance)
+
+
+# ----- Источники переводов -----
+# Источник отдаёт входящие переводы пачками начиная с курсора.
+# Перевод — словарь: tx_id, destination, memo, asset ('TON'/'USDT'), amount.
+# Курсор — строка, которую источник понимает сам; watcher хранит её в БД.
+
+class TransferProvider(ABC):
+    name = 'base'
+
+    @abstractmethod
+    async def fetch_transfers(self, cursor, limit):
+        """Возвращает (переводы, новый курсор)"""
+
+
+class FakeTransferProvider(TransferProvider):
+    """Переводы в памяти — для локальной проверки и тестов"""
+    name = 'fake'
+
+    def __init__(self, transfers=None):
+        self.transfers = list(transfers or [])
+
+    def add_transfer(self, memo, amount, asset='TON', destination=None, tx_id=None):
+        self.transfers.append({
+            'tx_id': tx_id or f"fake-{len(self.transfers) + 1}",
+            'destination': destination,
+            'memo': memo,
+            'asset': asset,
+            'amount': amount,
+        })
+
+    async def fetch_transfers(self, cursor, limit):
+        start = int(cursor or 0)
+        batch = self.transfers[start:start + limit]
+        return batch, str(start + len(batch))
+
+
+class FileTransferProvider(TransferProvider):
+    """Переводы из JSONL-файла, который дописывает внешний индексатор.
+
+    Курсор — смещение в байтах, поэтому каждая строка читается один раз.
+    """
+    name = 'file'
+
+    def __init__(self, path):
+        self.path = path
+
+    async def fetch_transfers(self, cursor, limit):
+        return await asyncio.to_thread(self._read, int(cursor or 0), limit)
+
+    def _read(self, offset, limit):
+        if not os.path.exists(self.path):
+            return [], str(offset)
+        transfers = []
+        with open(self.path, 'rb') as feed:
+            feed.seek(offset)
+            while len(transfers) < limit:
+                line = feed.readline()
+                # Недописанную строку оставляем до следующего опроса
+                if not line.endswith(b'\n'):
+                    break
+                offset = feed.tell()
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    transfers.append(json.loads(line))
+                except ValueError:
+                    logger.warning(f"Skipping malformed transfer line at byte {offset}")
+        return transfers, str(offset)
+
+
+class PaymentWatcher:
+    """Фоновое подтверждение оплат по входящим переводам.
+
+    Забирает у источника пачку переводов, находит сделки по мемо
+    (deal_id — первичный ключ, так что это один индексный запрос на пачку),
+    сверяет адрес и сумму с допуском и переводит совпавшие сделки
+    waiting_payment → paid. Переводы записываются в payments по tx_id,
+    поэтому повторная доставка той же пачки ничего не меняет.
+    """
+
+    def __init__(self, db, provider, on_paid=None, interval=PAYMENT_POLL_INTERVAL,
+                 batch_size=PAYMENT_BATCH_SIZE, tolerance=PAYMENT_TOLERANCE):
+        self.db = db
+        self.provider = provider
+        self.on_paid = on_paid
+        self.interval = interval
+        self.batch_size = batch_size
+        self.tolerance = tolerance
+        self._task = None
+        self.matched = 0
+        self.unmatched = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                fetched = await self.poll_once()
+            except Exception as e:
+                logger.error(f"Payment watcher error: {e}")
+                fetched = 0
+            # Полная пачка — источник, скорее всего, отдал не всё
+            if fetched < self.batch_size:
+                await asyncio.sleep(self.interval)
+
+    async def poll_once(self):
+        """Обрабатывает одну пачку переводов; возвращает их количество"""
+        cursor = await self.db.get_watcher_cursor(self.provider.name)
+        transfers, new_cursor = await self.provider.fetch_transfers(cursor, self.batch_size)
+        if not transfers:
+            if new_cursor != cursor:
+                await self.db.record_payments([], self.provider.name, new_cursor)
+            return 0
+
+        memos = {normalize_memo(transfer.get('memo')) for transfer in transfers}
+        memos.discard(None)
+        waiting = await self.db.get_waiting_payment_deals_by_ids(list(memos))
+
+        payments = []
+        for transfer in transfers:
+            deal_id = self._match(transfer, waiting)
+            if deal_id is not None:
+                # Одна сделка — одна оплата, даже если в пачке два перевода
+                waiting.pop(deal_id)
+            payments.append((
+                str(transfer['tx_id']), deal_id, transfer.get('asset'),
+                transfer.get('amount'), transfer.get('memo'), transfer.get('destination')
+            ))
+
+        paid_deals = await self.db.record_payments(payments, self.provider.name, new_cursor)
+        self.matched += len(paid_deals)
+        self.unmatched += len(transfers) - len(paid_deals)
+        for deal in paid_deals:
+            logger.info(f"Payment for deal {deal['deal_id']} confirmed automatically")
+            if self.on_paid is not None:
+                try:
+                    await self.on_paid(deal)
+                except Exception as e:
+                    logger.error(f"on_paid callback failed for deal {deal['deal_id']}: {e}")
+        return len(transfers)
+
+    def _match(self, transfer, waiting):
+        deal = waiting.get(normalize_memo(transfer.get('memo')))
+        if deal is None:
+            return None
+        field = ASSET_AMOUNT_FIELDS.get(str(transfer.get('asset', '')).upper())
+        if field is None or not amount_matches(transfer.get('amount'), deal[field], self.tolerance):
+            return None
+        # Перевод засчитываем, только если он пришёл ровно на адрес сделки:
+        # без адреса у сделки или без адреса получателя у перевода это не доказать
+        destination = transfer.get('destination')
+        if not deal['payment_address'] or destination != deal['payment_address']:
+            logger.warning(f"Transfer {transfer.get('tx_id')} for deal {deal['deal_id']} rejected: "
+                           f"destination {destination!r}, deal address {deal['payment_address']!r}")
+            return None
+        return deal['deal_id']
@@ -0,0 +1,146 @@
+import asyncio
+import json
+import logging
+import time
+from abc import ABC, abstractmethod
+
+logger = logging.getLogger(__name__)
+
+RATE_TTL = 60.0                # сколько держим курсы в памяти, сек
+RATE_REQUOTE_THRESHOLD = 0.005 # пересчитываем открытые сделки, если курс сдвинулся больше чем на 0.5%
+
+# Курсы в тех же единицах, что и раньше в config.py:
+# ton_rate — TON за единицу фиата (умножаем), usdt_rate — фиат за 1 USDT (делим)
+RATE_FIELDS = ('ton_rate', 'usdt_rate', 'fee_percent')
+
+
+# ----- Источники курсов -----
+# Источник возвращает словарь с ключами RATE_FIELDS; fee_percent можно не отдавать.
+
+class RateSource(ABC):
+    name = 'base'
+
+    @abstractmethod
+    async def fetch(self):
+        """Возвращает словарь курсов"""
+
+
+class StaticRateSource(RateSource):
+    """Значения из config.py — поведение как до появления сервиса"""
+    name = 'static'
+
+    def __init__(self, ton_rate, usdt_rate, fee_percent):
+        self.rates = {'ton_rate': ton_rate, 'usdt_rate': usdt_rate, 'fee_percent': fee_percent}
+
+    async def fetch(self):
+        return dict(self.rates)
+
+
+class FakeRateSource(StaticRateSource):
+    """Курсы, которые меняются вручную — для локальной проверки пересчёта"""
+    name = 'fake'
+
+    def set_rates(self, **rates):
+        self.rates.update(rates)
+
+
+class FileRateSource(RateSource):
+    """JSON-файл вида {"ton_rate": 0.05, "usdt_rate": 25.1}; его обновляет внешний скрипт"""
+    name = 'file'
+
+    def __init__(self, path):
+        self.path = path
+
+    async def fetch(self):
+        return await asyncio.to_thread(self._read)
+
+    def _read(self):
+        with open(self.path, encoding='utf-8') as rates_file:
+            return json.load(rates_file)
+
+
+def _moved(old, new, threshold):
+    for field in ('ton_rate', 'usdt_rate'):
+        if not old.get(field):
+            return True
+        if abs(new[field] - old[field]) / old[field] > threshold:
+            return True
+    return False
+
+
+class RateService:
+    """Курсы TON/USDT и комиссия с кэшем в памяти.
+
+    get_rates() отдаёт снимок из памяти, пока он свежее ttl, иначе
+    перечитывает источник. Если курс сдвинулся больше порога, снимок
+    пишется в rate_history, и сделки, в которые ещё не зашёл покупатель (created),
+    пересчитываются одним UPDATE в той же транзакции. Смена одной комиссии
+    только записывается в историю: на ton_amount/usdt_amount она не влияет. Если источник
+    недоступен, остаётся последний известный снимок.
+    """
+
+    def __init__(self, db, source, fallback, ttl=RATE_TTL, threshold=RATE_REQUOTE_THRESHOLD):
+        self.db = db
+        self.source = source
+        self.fallback = dict(fallback)
+        self.ttl = ttl
+        self.threshold = threshold
+        self._rates = None
+        self._expires_at = 0.0
+        self._refresh_lock = asyncio.Lock()
+        self._task = None
+
+    async def get_rates(self):
+        if self._rates is not None and time.monotonic() < self._expires_at:
+            return self._rates
+        return await self.refresh()
+
+    async def refresh(self):
+        async with self._refresh_lock:
+            # Пока ждали блокировку, курсы мог обновить другой обработчик
+            if self._rates is not None and time.monotonic() < self._expires_at:
+                return self._rates
+            if self._rates is None:
+                self._rates = await self.db.get_latest_rates() or self.fallback
+            try:
+                fetched = await self.source.fetch()
+                rates = {field: float(fetched.get(field, self._rates[field])) for field in RATE_FIELDS}
+            except Exception as e:
+                logger.error(f"Rate source {self.source.name} failed: {e}")
+                self._expires_at = time.monotonic() + self.ttl
+                return self._rates
+
+            if _moved(self._rates, rates, self.threshold):
+                requoted = await self.db.apply_rates(rates, self.source.name, time.time())
+                logger.info(f"Rates updated from {self.source.name}: {rates}, requoted {requoted} deals")
+                self._rates = rates
+            elif rates['fee_percent'] != self._rates['fee_percent']:
+                # Новая комиссия нужна только новым сделкам — открытые не пересчитываем
+                await self.db.save_rates(rates, self.source.name, time.time())
+                logger.info(f"Fee updated from {self.source.name}: {rates['fee_percent']}%")
+                self._rates = dict(self._rates, fee_percent=rates['fee_percent'])
+            self._expires_at = time.monotonic() + self.ttl
+            return self._rates
+
+    # Фоновое обновление: открытые сделки пересчитываются и без входящих апдейтов
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.get_rates()
+            except Exception as e:
+                logger.error(f"Rate refresh error: {e}")
+            await asyncio.sleep(self.ttl)
+
@@ -0,0 +1,109 @@
+import json
+
+# Колонки deals (и вычисляемые поля запросов), под которые у записи есть слоты
+DEAL_FIELDS = (
+    'deal_id', 'seller_id', 'buyer_id', 'deal_type', 'currency', 'fiat_currency',
+    'amount', 'total_amount', 'status', 'buyer_link', 'payment_address',
+    'ton_amount', 'usdt_amount', 'created_at', 'claimed_by', 'claim_expires_at',
+    'claimed_by_other', 'version',
+)
+_FIELD_SET = frozenset(DEAL_FIELDS)
+_MISSING = object()
+
+
+def decode_gift_links(raw):
+    """JSON-список ссылок; старые строки без JSON превращаются в список из одной ссылки"""
+    if not raw:
+        return raw
+    try:
+        return json.loads(raw)
+    except (TypeError, ValueError):
+        return [raw]
+
+
+class DealRecord:
+    """Строка deals без словаря на каждый экземпляр.
+
+    Читается как dict: deal['amount'], deal.get('buyer_id'), 'status' in deal —
+    так обработчики работают и дальше. gift_links хранится как JSON-строка
+    и разбирается только при первом обращении: спискам сделок он не нужен.
+    Колонки, которых не было в SELECT, ведут себя как отсутствующие ключи.
+    """
+
+    __slots__ = DEAL_FIELDS + ('_gift_links', '_extra')
+
+    @property
+    def gift_links(self):
+        raw = getattr(self, '_gift_links', _MISSING)
+        if raw is _MISSING:
+            raise AttributeError('gift_links')
+        if isinstance(raw, str):
+            raw = self._gift_links = decode_gift_links(raw)
+        return raw
+
+    def __getitem__(self, key):
+        if key in _FIELD_SET or key == 'gift_links':
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        extra = getattr(self, '_extra', None)
+        if extra and key in extra:
+            return extra[key]
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def keys(self):
+        names = [name for name in DEAL_FIELDS if hasattr(self, name)]
+        if hasattr(self, '_gift_links'):
+            names.append('gift_links')
+        names.extend(getattr(self, '_extra', None) or ())
+        return names
+
+    def as_dict(self):
+        return {key: self[key] for key in self.keys()}
+
+    def __repr__(self):
+        return f"DealRecord({self.get('deal_id')!r}, status={self.get('status')!r})"
+
+
+def deal_factory(description):
+    """Фабрика строк для cursor.description: один разбор колонок на запрос, дальше — только setattr"""
+    slots = []
+    extra_columns = []
+    for index, column in enumerate(description):
+        name = column[0]
+        if name in _FIELD_SET:
+            slots.append((index, name))
+        elif name == 'gift_links':
+            slots.append((index, '_gift_links'))
+        else:
+            extra_columns.append((index, name))
+
+    def build(row):
+        record = DealRecord.__new__(DealRecord)
+        for index, slot in slots:
+            setattr(record, slot, row[index])
+        if extra_columns:
+            record._extra = {name: row[index] for index, name in extra_columns}
+        return record
+
+    return build
+
+
+def fetch_deal(cursor):
+    row = cursor.fetchone()
+    return deal_factory(cursor.description)(row) if row is not None else None
+
+
+def fetch_deals(cursor):
+    build = deal_factory(cursor.description)
+    return [build(row) for row in cursor.fetchall()]
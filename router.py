@@ -0,0 +1,110 @@
+import time
+
+from metrics import CALLBACK_ERRORS, CALLBACK_SECONDS
+
+
+class RouteStats:
+    __slots__ = ('calls', 'errors', 'total_time', 'max_time')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def record(self, elapsed, failed):
+        self.calls += 1
+        self.total_time += elapsed
+        if elapsed > self.max_time:
+            self.max_time = elapsed
+        if failed:
+            self.errors += 1
+
+    def as_dict(self):
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'avg_ms': round(self.total_time / self.calls * 1000, 2) if self.calls else 0.0,
+            'max_ms': round(self.max_time * 1000, 2)
+        }
+
+
+class _TrieNode:
+    __slots__ = ('children', 'route')
+
+    def __init__(self):
+        self.children = {}
+        self.route = None
+
+
+class CallbackRouter:
+    """Маршрутизация callback_data по таблице вместо цепочки if.
+
+    Точные маршруты лежат в словаре (O(1)), префиксные (deal_info_, lang_ ...)
+    в префиксном дереве: выбирается самый длинный совпавший префикс,
+    остаток строки передаётся обработчику аргументом.
+    Обработчик: async def handler(update, context, user_language, arg).
+    """
+
+    def __init__(self):
+        self._exact = {}
+        self._prefixes = _TrieNode()
+        self.stats = {}   # имя маршрута -> RouteStats
+
+    def exact(self, *callbacks):
+        def decorator(handler):
+            for callback in callbacks:
+                self._exact[callback] = (callback, handler)
+                self.stats.setdefault(callback, RouteStats())
+            return handler
+        return decorator
+
+    def prefix(self, prefix):
+        def decorator(handler):
+            node = self._prefixes
+            for char in prefix:
+                node = node.children.setdefault(char, _TrieNode())
+            node.route = (prefix + '*', handler)
+            self.stats.setdefault(prefix + '*', RouteStats())
+            return handler
+        return decorator
+
+    def resolve(self, callback_data):
+        """(имя маршрута, обработчик, аргумент) или None"""
+        route = self._exact.get(callback_data)
+        if route:
+            return route[0], route[1], None
+
+        node = self._prefixes
+        found, found_length = None, 0
+        for position, char in enumerate(callback_data):
+            node = node.children.get(char)
+            if node is None:
+                break
+            if node.route:
+                found, found_length = node.route, position + 1
+        if found:
+            return found[0], found[1], callback_data[found_length:]
+        return None
+
+    async def dispatch(self, callback_data, update, context, user_language):
+        """Вызывает обработчик; False — если маршрут не найден. Ошибки пробрасываются"""
+        resolved = self.resolve(callback_data)
+        if resolved is None:
+            return False
+        name, handler, arg = resolved
+        started = time.perf_counter()
+        failed = True
+        try:
+            await handler(update, context, user_language, arg)
+            failed = False
+        finally:
+            elapsed = time.perf_counter() - started
+            self.stats[name].record(elapsed, failed)
+            CALLBACK_SECONDS.observe(elapsed, name)
+            if failed:
+                CALLBACK_ERRORS.inc(name)
+        return True
+
+    def report(self):
+        return {name: stats.as_dict() for name, stats in self.stats.items() if stats.calls}
@@ -0,0 +1,121 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+STATE_TTL = 6 * 3600           # брошенный мастер сделки живёт 6 часов
+STATE_MAX_ENTRIES = 50000      # больше — вытесняем самые старые
+STATE_FLUSH_INTERVAL = 5.0     # как часто сбрасывать изменения в SQLite, сек
+
+
+def _pack(data):
+    return json.dumps(data, separators=(',', ':'), ensure_ascii=False) if data else ''
+
+
+def _unpack(payload):
+    return json.loads(payload) if payload else {}
+
+
+class StateStore:
+    """Состояния диалогов пользователей (мастер создания сделки, ввод реквизитов).
+
+    Тот же API, что у прежнего UserState: set_state / get_state / clear_state.
+    Записи живут STATE_TTL секунд, их не больше STATE_MAX_ENTRIES (LRU),
+    изменения копятся в памяти и пачкой пишутся в таблицу user_states,
+    поэтому незаконченные сделки переживают перезапуск бота.
+    """
+
+    def __init__(self, db=None, ttl=STATE_TTL, max_entries=STATE_MAX_ENTRIES,
+                 flush_interval=STATE_FLUSH_INTERVAL):
+        self.db = db
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.flush_interval = flush_interval
+        self.states = OrderedDict()   # user_id -> (expires_at, state, data)
+        self._dirty = {}              # user_id -> (state, payload, expires_at) или None = удалить
+        self._flush_task = None
+
+    def set_state(self, user_id, state, data=None):
+        if data is None:
+            data = {}
+        expires_at = time.time() + self.ttl
+        self.states[user_id] = (expires_at, state, data)
+        self.states.move_to_end(user_id)
+        self._dirty[user_id] = (state, _pack(data), expires_at)
+        while len(self.states) > self.max_entries:
+            evicted_id, _ = self.states.popitem(last=False)
+            self._dirty[evicted_id] = None
+
+    def get_state(self, user_id):
+        entry = self.states.get(user_id)
+        if entry is None:
+            return {'state': None, 'data': {}}
+        expires_at, state, data = entry
+        if expires_at <= time.time():
+            self.clear_state(user_id)
+            return {'state': None, 'data': {}}
+        return {'state': state, 'data': data}
+
+    def clear_state(self, user_id):
+        if user_id in self.states:
+            del self.states[user_id]
+            self._dirty[user_id] = None
+
+    def __len__(self):
+        return len(self.states)
+
+    def evict_expired(self):
+        now = time.time()
+        expired = [user_id for user_id, entry in self.states.items() if entry[0] <= now]
+        for user_id in expired:
+            self.clear_state(user_id)
+        return len(expired)
+
+    # ----- Сохранение в SQLite -----
+    async def load(self):
+        if self.db is None:
+            return
+        now = time.time()
+        rows = await self.db.load_user_states(now, self.max_entries)
+        # Те же ограничения, что и в set_state: срок не дольше ttl, в LRU самые старые — первыми
+        for user_id, state, payload, expires_at in reversed(rows):
+            self.states[user_id] = (min(expires_at, now + self.ttl), state, _unpack(payload))
+        logger.info(f"Восстановлено состояний пользователей: {len(rows)}")
+
+    async def flush(self):
+        """Пишет накопленные изменения одной транзакцией"""
+        self.evict_expired()
+        if self.db is None or not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, {}
+        upserts = [(user_id,) + value for user_id, value in dirty.items() if value is not None]
+        deletes = [(user_id,) for user_id, value in dirty.items() if value is None]
+        try:
+            await self.db.save_user_states(upserts, deletes, time.time())
+        except Exception as e:
+            logger.error(f"Не удалось сохранить состояния: {e}")
+            # Вернём изменения, чтобы записать их при следующем сбросе
+            for user_id, value in dirty.items():
+                self._dirty.setdefault(user_id, value)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self):
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
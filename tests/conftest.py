@@ -0,0 +1,34 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database
+
+
+@pytest.fixture
+def db(tmp_path):
+    database = Database(str(tmp_path / 'test.db'))
+    yield database
+    database.close()
+
+
+@pytest.fixture
+def make_deal(db):
+    """Создаёт сделку продавца seller_id и возвращает её deal_id"""
+    def make(seller_id=1, amount=100.0, **fields):
+        deal_data = {
+            'seller_id': seller_id,
+            'deal_type': 'gift',
+            'gift_links': ['https://t.me/nft/TestGift-1'],
+            'currency': 'RUB',
+            'fiat_currency': 'RUB',
+            'amount': amount,
+        }
+        deal_data.update(fields)
+        deal_id, _ = db.create_deal(deal_data)
+        assert deal_id is not None
+        return deal_id
+    return make
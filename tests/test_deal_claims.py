@@ -0,0 +1,90 @@
+import pytest
+
+from database import DEAL_INVALID, DEAL_LOST, DEAL_WON
+
+NOW = 1_000_000.0
+LEASE = 300
+
+
+@pytest.fixture
+def waiting_deal(db, make_deal):
+    deal_id = make_deal()
+    db.join_deal(deal_id, 2)
+    return deal_id
+
+
+def _claim(db, deal_id):
+    deal = db.get_deal(deal_id)
+    return deal['claimed_by'], deal['claim_expires_at']
+
+
+def test_claim_excludes_other_admins_until_lease_expires(db, waiting_deal):
+    result, deal = db.claim_deal(waiting_deal, 10, lease=LEASE, now=NOW)
+    assert result == DEAL_WON
+    assert deal['claimed_by'] == 10
+
+    result, deal = db.claim_deal(waiting_deal, 11, lease=LEASE, now=NOW + 10)
+    assert result == DEAL_LOST
+    assert deal['claimed_by'] == 10
+
+    # Аренда истекла — сделку может взять другой админ
+    result, _ = db.claim_deal(waiting_deal, 11, lease=LEASE, now=NOW + LEASE + 1)
+    assert result == DEAL_WON
+    assert _claim(db, waiting_deal) == (11, NOW + 2 * LEASE + 1)
+
+
+def test_reclaim_extends_own_lease(db, waiting_deal):
+    db.claim_deal(waiting_deal, 10, lease=LEASE, now=NOW)
+    result, _ = db.claim_deal(waiting_deal, 10, lease=LEASE, now=NOW + 100)
+    assert result == DEAL_WON
+    assert _claim(db, waiting_deal) == (10, NOW + 100 + LEASE)
+
+
+def test_only_waiting_payment_deals_can_be_claimed(db, make_deal):
+    deal_id = make_deal()
+    assert db.claim_deal(deal_id, 10, now=NOW)[0] == DEAL_INVALID
+    assert db.claim_deal('NOSUCHID', 10, now=NOW) == (DEAL_INVALID, None)
+
+
+def test_confirm_requires_live_own_lease(db, waiting_deal):
+    db.claim_deal(waiting_deal, 10, lease=LEASE, now=NOW)
+    assert db.confirm_claimed_payment(waiting_deal, 11, now=NOW + 1) == DEAL_LOST
+    assert db.confirm_claimed_payment(waiting_deal, 10, now=NOW + LEASE + 1) == DEAL_LOST
+    assert db.get_deal(waiting_deal)['status'] == 'waiting_payment'
+
+    assert db.confirm_claimed_payment(waiting_deal, 10, now=NOW + 1) == DEAL_WON
+    assert db.get_deal(waiting_deal)['status'] == 'paid'
+    assert _claim(db, waiting_deal) == (None, None)
+
+
+def test_failed_confirm_keeps_the_lease(db, waiting_deal):
+    db.claim_deal(waiting_deal, 10, lease=LEASE, now=NOW)
+    # Пока админ проверял, сделку отменили
+    db.transition_deal(waiting_deal, 'waiting_payment', 'cancelled')
+    assert db.confirm_claimed_payment(waiting_deal, 10, now=NOW + 1) == DEAL_LOST
+    assert _claim(db, waiting_deal) == (10, NOW + LEASE)
+
+
+def test_release_only_by_owner(db, waiting_deal):
+    db.claim_deal(waiting_deal, 10, lease=LEASE, now=NOW)
+    assert not db.release_deal_claim(waiting_deal, 11)
+    assert db.release_deal_claim(waiting_deal, 10)
+    assert _claim(db, waiting_deal) == (None, None)
+
+
+def test_review_queue_marks_deals_held_by_others(db, make_deal):
+    deal_ids = []
+    for _ in range(3):
+        deal_id = make_deal()
+        db.join_deal(deal_id, 2)
+        deal_ids.append(deal_id)
+    db.claim_deal(deal_ids[0], 11, lease=LEASE, now=NOW)
+    db.claim_deal(deal_ids[1], 10, lease=LEASE, now=NOW)
+
+    page = db.get_review_queue_page(10, limit=10, now=NOW + 1)
+    flags = {deal['deal_id']: bool(deal['claimed_by_other']) for deal in page['deals']}
+    assert flags == {deal_ids[0]: True, deal_ids[1]: False, deal_ids[2]: False}
+
+    # Чужая аренда истекла — сделка снова свободна
+    page = db.get_review_queue_page(10, limit=10, now=NOW + LEASE + 1)
+    assert not any(deal['claimed_by_other'] for deal in page['deals'])
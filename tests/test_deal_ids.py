@@ -0,0 +1,40 @@
+from database import DEAL_ID_ALPHABET, DEAL_ID_EPOCH
+
+NOW = DEAL_ID_EPOCH + 86400 * 365
+
+
+def test_deal_id_format(db):
+    deal_id = db.generate_deal_id(now=NOW)
+    assert len(deal_id) == 10
+    assert set(deal_id) <= set(DEAL_ID_ALPHABET)
+
+
+def test_alphabet_sorts_like_its_digits():
+    assert list(DEAL_ID_ALPHABET) == sorted(DEAL_ID_ALPHABET)
+
+
+def test_deal_ids_grow_with_time(db):
+    earlier = [db.generate_deal_id(now=NOW + second) for second in range(0, 100, 7)]
+    assert earlier == sorted(earlier)
+    assert db.generate_deal_id(now=NOW)[:6] == db.generate_deal_id(now=NOW + 0.5)[:6]
+    # Время в старших символах: следующая секунда больше при любом хвосте
+    assert db.generate_deal_id(now=NOW + 1) > db.generate_deal_id(now=NOW)
+
+
+def test_create_deal_retries_on_id_collision(db, make_deal, monkeypatch):
+    taken = make_deal()
+    fresh = db.generate_deal_id()
+    candidates = iter([taken, taken, fresh])
+    monkeypatch.setattr(db, 'generate_deal_id', lambda: next(candidates))
+    assert make_deal() == fresh
+    assert db.get_deal(taken)['deal_id'] == taken
+
+
+def test_create_deal_gives_up_after_attempts(db, make_deal, monkeypatch):
+    taken = make_deal()
+    monkeypatch.setattr(db, 'generate_deal_id', lambda: taken)
+    deal_id, buyer_link = db.create_deal({
+        'seller_id': 1, 'deal_type': 'gift', 'gift_links': [], 'currency': 'RUB',
+        'fiat_currency': 'RUB', 'amount': 10,
+    })
+    assert (deal_id, buyer_link) == (None, None)
@@ -0,0 +1,61 @@
+import pytest
+
+
+@pytest.fixture
+def deals(db):
+    """25 сделок продавца 1 (часть с одинаковым created_at), 5 — где он покупатель, 5 чужих"""
+    rows = []
+    for number in range(25):
+        rows.append((f'S{number:07d}', 1, None, 'created' if number % 2 else 'completed',
+                     f'2024-01-01 00:00:{number // 3:02d}'))
+    for number in range(5):
+        rows.append((f'B{number:07d}', 2, 1, 'waiting_payment', f'2024-01-01 00:01:{number:02d}'))
+    for number in range(5):
+        rows.append((f'X{number:07d}', 3, 4, 'created', f'2024-01-01 00:02:{number:02d}'))
+    with db.transaction() as cursor:
+        cursor.executemany('''
+            INSERT INTO deals (deal_id, seller_id, buyer_id, status, created_at, amount, fiat_currency)
+            VALUES (?, ?, ?, ?, ?, 10, 'RUB')
+        ''', rows)
+    mine = [row for row in rows if 1 in (row[1], row[2])]
+    # Новые сверху, при равном created_at — по deal_id
+    mine.sort(key=lambda row: (row[4], row[0]), reverse=True)
+    return mine
+
+
+def _key(deal):
+    return deal['created_at'], deal['deal_id']
+
+
+def test_pages_cover_all_deals_once_in_order(db, deals):
+    seen = []
+    page = db.get_user_deals_page(1, limit=7)
+    assert not page['has_prev']
+    while True:
+        seen.extend(deal['deal_id'] for deal in page['deals'])
+        if not page['has_next']:
+            break
+        page = db.get_user_deals_page(1, limit=7, cursor=_key(page['deals'][-1]))
+        assert page['has_prev']
+    assert seen == [row[0] for row in deals]
+
+
+def test_prev_returns_the_previous_page(db, deals):
+    first = db.get_user_deals_page(1, limit=5)
+    second = db.get_user_deals_page(1, limit=5, cursor=_key(first['deals'][-1]))
+    back = db.get_user_deals_page(1, limit=5, cursor=_key(second['deals'][0]), direction='prev')
+    assert [deal['deal_id'] for deal in back['deals']] == [deal['deal_id'] for deal in first['deals']]
+    assert not back['has_prev']
+    assert back['has_next']
+
+
+def test_status_filter(db, deals):
+    page = db.get_user_deals_page(1, limit=50, statuses=('waiting_payment', 'created'))
+    expected = [row[0] for row in deals if row[3] in ('waiting_payment', 'created')]
+    assert [deal['deal_id'] for deal in page['deals']] == expected
+    assert not page['has_next']
+
+
+def test_page_of_user_without_deals(db, deals):
+    page = db.get_user_deals_page(99)
+    assert page == {'deals': [], 'has_next': False, 'has_prev': False}
@@ -0,0 +1,71 @@
+import threading
+
+from database import DEAL_INVALID, DEAL_LOST, DEAL_TRANSITIONS, DEAL_WON
+
+
+def _status(db, deal_id):
+    return db.get_deal(deal_id)['status']
+
+
+def test_join_sets_buyer_once(db, make_deal):
+    deal_id = make_deal()
+    result, deal, _, _ = db.join_deal(deal_id, 2)
+    assert result == DEAL_WON
+    assert deal['status'] == 'waiting_payment'
+    assert deal['buyer_id'] == 2
+
+    result, deal, _, _ = db.join_deal(deal_id, 3)
+    assert result == DEAL_LOST
+    assert deal['buyer_id'] == 2
+
+
+def test_full_path_to_completed(db, make_deal):
+    deal_id = make_deal()
+    db.join_deal(deal_id, 2)
+    for from_status, to_status in (('waiting_payment', 'paid'), ('paid', 'gift_sent'),
+                                   ('gift_sent', 'completed')):
+        assert db.transition_deal(deal_id, from_status, to_status) == DEAL_WON
+    assert _status(db, deal_id) == 'completed'
+    # Завершённую сделку уже не отменить
+    assert 'completed' not in DEAL_TRANSITIONS
+    assert db.transition_deal(deal_id, 'completed', 'cancelled') == DEAL_INVALID
+    assert db.get_seller_stats(1) == 1
+
+
+def test_forbidden_transition_changes_nothing(db, make_deal):
+    deal_id = make_deal()
+    assert db.transition_deal(deal_id, 'created', 'paid') == DEAL_INVALID
+    assert _status(db, deal_id) == 'created'
+
+
+def test_stale_from_status_loses(db, make_deal):
+    deal_id = make_deal()
+    db.join_deal(deal_id, 2)
+    assert db.transition_deal(deal_id, 'created', 'cancelled') == DEAL_LOST
+    assert _status(db, deal_id) == 'waiting_payment'
+
+
+def test_unknown_deal_is_invalid(db):
+    assert db.transition_deal('NOSUCHID', 'created', 'cancelled') == DEAL_INVALID
+
+
+def test_concurrent_transitions_have_one_winner(db, make_deal):
+    deal_id = make_deal()
+    db.join_deal(deal_id, 2)
+    results = []
+    barrier = threading.Barrier(2)
+
+    def move(to_status):
+        barrier.wait()
+        results.append((to_status, db.transition_deal(deal_id, 'waiting_payment', to_status)))
+
+    threads = [threading.Thread(target=move, args=(status,)) for status in ('paid', 'cancelled')]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    winners = [status for status, result in results if result == DEAL_WON]
+    assert len(winners) == 1
+    assert [result for _, result in results].count(DEAL_LOST) == 1
+    assert _status(db, deal_id) == winners[0]
@@ -0,0 +1,75 @@
+import sqlite3
+
+from database import Database
+from migrations import MIGRATIONS, SCHEMA_VERSION, apply_migrations
+
+
+def _schema_version(path):
+    with sqlite3.connect(path) as connection:
+        return connection.execute('PRAGMA user_version').fetchone()[0]
+
+
+def _index_names(database):
+    with database.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+        return {row[0] for row in cursor.fetchall()}
+
+
+def test_migration_numbers_are_consecutive():
+    assert [version for version, _, _ in MIGRATIONS] == list(range(1, len(MIGRATIONS) + 1))
+    assert SCHEMA_VERSION == len(MIGRATIONS)
+
+
+def test_fresh_database_is_migrated_to_latest(db, tmp_path):
+    assert _schema_version(str(tmp_path / 'test.db')) == SCHEMA_VERSION
+    assert {'idx_deals_seller_status_created', 'idx_deals_buyer_status_created',
+            'idx_bank_cards_user_created'} <= _index_names(db)
+
+
+def test_current_schema_runs_no_migrations(db, tmp_path):
+    assert apply_migrations(db) == []
+    db.close()
+    reopened = Database(str(tmp_path / 'test.db'))
+    try:
+        assert apply_migrations(reopened) == []
+    finally:
+        reopened.close()
+
+
+def test_legacy_database_is_upgraded_in_place(tmp_path):
+    # База из времён update_db.py: user_version = 0, в deals нет колонок оплаты
+    path = str(tmp_path / 'legacy.db')
+    with sqlite3.connect(path) as connection:
+        connection.execute('''
+            CREATE TABLE deals (
+                deal_id TEXT PRIMARY KEY,
+                seller_id INTEGER,
+                buyer_id INTEGER,
+                deal_type TEXT,
+                gift_links TEXT,
+                currency TEXT,
+                fiat_currency TEXT,
+                amount REAL,
+                status TEXT DEFAULT 'created',
+                buyer_link TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        connection.execute('''
+            INSERT INTO deals (deal_id, seller_id, deal_type, gift_links, currency, fiat_currency, amount)
+            VALUES ('LEGACY01', 1, 'gift', '["https://t.me/nft/Old-1"]', 'RUB', 'RUB', 100)
+        ''')
+
+    database = Database(path)
+    try:
+        with database.cursor() as cursor:
+            cursor.execute('PRAGMA table_info(deals)')
+            columns = {row[1] for row in cursor.fetchall()}
+            cursor.execute('SELECT seller_id, amount FROM deals WHERE deal_id = ?', ('LEGACY01',))
+            row = cursor.fetchone()
+    finally:
+        database.close()
+
+    assert {'total_amount', 'payment_address', 'ton_amount', 'usdt_amount'} <= columns
+    assert row == (1, 100)
+    assert _schema_version(path) == SCHEMA_VERSION
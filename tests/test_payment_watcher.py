@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+
+from database import AsyncDatabase
+from payment_watcher import (
+    FakeTransferProvider, PaymentWatcher, TransferProvider, amount_matches, normalize_memo
+)
+
+WALLET = 'UQTestWalletAddress000000000000000000000000000001'
+OTHER_WALLET = 'UQSomeoneElse0000000000000000000000000000000000002'
+
+
+@pytest.fixture
+def waiting_deal(db, make_deal):
+    db.update_user_requisites(1, WALLET)
+    deal_id = make_deal()
+    db.join_deal(deal_id, 2)
+    return db.get_deal(deal_id)
+
+
+def _poll(db, provider):
+    async def run():
+        async_db = AsyncDatabase(db)
+        paid = []
+
+        async def on_paid(deal):
+            paid.append(deal['deal_id'])
+
+        watcher = PaymentWatcher(async_db, provider, on_paid=on_paid)
+        await watcher.poll_once()
+        return watcher, paid
+    return asyncio.run(run())
+
+
+def test_normalize_memo():
+    assert normalize_memo(' #deal_abc123 ') == 'ABC123'
+    assert normalize_memo('Deal_XyZ') == 'XYZ'
+    assert normalize_memo('#') is None
+    assert normalize_memo(None) is None
+
+
+def test_amount_matches_with_tolerance():
+    assert amount_matches(10.0, 10.0)
+    assert amount_matches(9.96, 10.0)
+    assert not amount_matches(9.9, 10.0)
+    assert not amount_matches(None, 10.0)
+    assert not amount_matches(10.0, None)
+
+
+def test_provider_without_fetch_transfers_cannot_be_created():
+    class Incomplete(TransferProvider):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_matching_transfer_pays_the_deal(db, waiting_deal):
+    provider = FakeTransferProvider()
+    provider.add_transfer(f"#{waiting_deal['deal_id'].lower()}", waiting_deal['ton_amount'], destination=WALLET)
+    watcher, paid = _poll(db, provider)
+    assert paid == [waiting_deal['deal_id']]
+    assert watcher.matched == 1
+    assert db.get_deal(waiting_deal['deal_id'])['status'] == 'paid'
+
+
+@pytest.mark.parametrize('amount_share, asset, destination', [
+    (0.9, 'TON', WALLET),          # недоплата
+    (1.0, 'TON', OTHER_WALLET),    # деньги ушли на другой кошелёк
+    (1.0, 'TON', None),            # у перевода нет адреса получателя
+    (1.0, 'BTC', WALLET),          # неизвестный актив
+])
+def test_mismatched_transfer_is_ignored(db, waiting_deal, amount_share, asset, destination):
+    provider = FakeTransferProvider()
+    provider.add_transfer(waiting_deal['deal_id'], waiting_deal['ton_amount'] * amount_share,
+                          asset=asset, destination=destination)
+    watcher, paid = _poll(db, provider)
+    assert paid == []
+    assert watcher.unmatched == 1
+    assert db.get_deal(waiting_deal['deal_id'])['status'] == 'waiting_payment'
+
+
+def test_deal_without_payment_address_is_not_paid(db, waiting_deal):
+    with db.transaction() as cursor:
+        cursor.execute('UPDATE deals SET payment_address = NULL WHERE deal_id = ?', (waiting_deal['deal_id'],))
+    provider = FakeTransferProvider()
+    provider.add_transfer(waiting_deal['deal_id'], waiting_deal['ton_amount'], destination=WALLET)
+    _, paid = _poll(db, provider)
+    assert paid == []
+
+
+def test_second_transfer_and_redelivery_change_nothing(db, waiting_deal):
+    provider = FakeTransferProvider()
+    provider.add_transfer(waiting_deal['deal_id'], waiting_deal['ton_amount'], destination=WALLET, tx_id='tx-1')
+    provider.add_transfer(waiting_deal['deal_id'], waiting_deal['ton_amount'], destination=WALLET, tx_id='tx-2')
+    _, paid = _poll(db, provider)
+    assert paid == [waiting_deal['deal_id']]
+
+    # Источник отдал ту же пачку ещё раз
+    redelivered = FakeTransferProvider(provider.transfers)
+    redelivered.name = 'redelivered'
+    _, paid = _poll(db, redelivered)
+    assert paid == []
+    with db.cursor() as cursor:
+        cursor.execute('SELECT tx_id FROM payments WHERE deal_id IS NOT NULL')
+        assert [row[0] for row in cursor.fetchall()] == ['tx-1']
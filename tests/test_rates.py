@@ -0,0 +1,102 @@
+import asyncio
+
+import pytest
+
+from database import AsyncDatabase
+from rates import FakeRateSource, RateService, RateSource
+
+RATES = {'ton_rate': 0.05, 'usdt_rate': 25.0, 'fee_percent': 3.0}
+
+
+class FailingRateSource(RateSource):
+    name = 'failing'
+
+    async def fetch(self):
+        raise ConnectionError("source is down")
+
+
+def _amounts(db, deal_id):
+    deal = db.get_deal(deal_id)
+    return deal['ton_amount'], deal['usdt_amount'], deal['total_amount']
+
+
+def _history_rows(db):
+    with db.cursor() as cursor:
+        cursor.execute('SELECT COUNT(*) FROM rate_history')
+        return cursor.fetchone()[0]
+
+
+def _refresh(service):
+    # ttl=0: каждый вызов перечитывает источник
+    return asyncio.run(service.get_rates())
+
+
+@pytest.fixture
+def deals(db, make_deal):
+    created = make_deal(**RATES)
+    waiting = make_deal(**RATES)
+    db.join_deal(waiting, 2)
+    return created, waiting
+
+
+def _service(db, source):
+    return RateService(AsyncDatabase(db), source, fallback=RATES, ttl=0, threshold=0.005)
+
+
+def test_small_move_requotes_nothing(db, deals):
+    created, _ = deals
+    source = FakeRateSource(**RATES)
+    service = _service(db, source)
+    _refresh(service)
+    before = _amounts(db, created)
+
+    source.set_rates(ton_rate=RATES['ton_rate'] * 1.001)
+    assert _refresh(service)['ton_rate'] == RATES['ton_rate']
+    assert _amounts(db, created) == before
+
+
+def test_large_move_requotes_created_deals_only(db, deals):
+    created, waiting = deals
+    source = FakeRateSource(**RATES)
+    service = _service(db, source)
+    _refresh(service)
+    created_before = _amounts(db, created)
+    waiting_before = _amounts(db, waiting)
+
+    source.set_rates(ton_rate=0.06)
+    assert _refresh(service)['ton_rate'] == 0.06
+
+    ton_amount, usdt_amount, total_amount = _amounts(db, created)
+    assert total_amount == created_before[2]
+    assert ton_amount == pytest.approx(round(total_amount * 0.06, 4))
+    assert usdt_amount == created_before[1]
+    # Покупатель уже видел сумму к оплате — её не меняем
+    assert _amounts(db, waiting) == waiting_before
+
+
+def test_fee_change_is_recorded_without_requote(db, deals):
+    created, _ = deals
+    source = FakeRateSource(**RATES)
+    service = _service(db, source)
+    _refresh(service)
+    before = _amounts(db, created)
+    rows = _history_rows(db)
+
+    source.set_rates(fee_percent=5.0)
+    assert _refresh(service)['fee_percent'] == 5.0
+    assert _amounts(db, created) == before
+    assert _history_rows(db) == rows + 1
+    assert db.get_latest_rates()['fee_percent'] == 5.0
+
+
+def test_failing_source_keeps_last_snapshot(db):
+    service = _service(db, FailingRateSource())
+    assert _refresh(service) == RATES
+
+
+def test_source_without_fetch_cannot_be_created():
+    class Incomplete(RateSource):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
@@ -1,38 +1,11 @@
-# Создайте файл update_db.py
-import sqlite3
+# Обновление схемы существующей базы до последней миграции
+from database import Database
+from migrations import SCHEMA_VERSION
 
 def update_database():
-    conn = sqlite3.connect("guarantee_bot.db")
-    cursor = conn.cursor()
-    
-    # Добавляем недостающие колонки
-    try:
-        cursor.execute('ALTER TABLE deals ADD COLUMN total_amount REAL')
-        print("✅ Добавлена колонка total_amount")
-    except:
-        print("⚠️ Колонка total_amount уже существует")
-    
-    try:
-        cursor.execute('ALTER TABLE deals ADD COLUMN payment_address TEXT')
-        print("✅ Добавлена колонка payment_address")
-    except:
-        print("⚠️ Колонка payment_address уже существует")
-    
-    try:
-        cursor.execute('ALTER TABLE deals ADD COLUMN ton_amount REAL')
-        print("✅ Добавлена колонка ton_amount")
-    except:
-        print("⚠️ Колонка ton_amount уже существует")
-    
-    try:
-        cursor.execute('ALTER TABLE deals ADD COLUMN usdt_amount REAL')
-        print("✅ Добавлена колонка usdt_amount")
-    except:
-        print("⚠️ Колонка usdt_amount уже существует")
-    
-    conn.commit()
-    conn.close()
-    print("✅ База данных обновлена!")
+    db = Database("guarantee_bot.db")
+    print(f"✅ База данных обновлена! Версия схемы: {SCHEMA_VERSION}")
+    db.close()
 
 if __name__ == '__main__':
     update_database()
@@ -0,0 +1,80 @@
+import asyncio
+import hmac
+import json
+import logging
+
+from telegram import Update
+
+from http_server import HttpServer
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'x-telegram-bot-api-secret-token'
+
+
+def make_webhook_handler(secret_token, on_update):
+    """Обработчик POST от Telegram: проверяет секрет и сразу отвечает 200.
+
+    Сам апдейт только кладётся в очередь через on_update(data),
+    обработка идёт асинхронно и не задерживает ответ Telegram.
+    Без секрета порт принимал бы поддельные апдейты от кого угодно,
+    поэтому пустой secret_token — ошибка.
+    """
+    if not secret_token:
+        raise ValueError("WEBHOOK_SECRET не задан: webhook без секрета не запускаем")
+    expected = secret_token.encode('utf-8')
+
+    async def handle(headers, body):
+        received = headers.get(SECRET_HEADER, '')
+        # compare_digest падает на не-ASCII строках, поэтому сравниваем байты
+        if not received.isascii() or not hmac.compare_digest(received.encode('ascii'), expected):
+            logger.warning("Webhook: неверный secret token")
+            return 403, 'text/plain', b''
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return 400, 'text/plain', b''
+        if not isinstance(data, dict):
+            # Апдейт Telegram — всегда JSON-объект; [] или 1 Update.de_json не разберёт
+            return 400, 'text/plain', b''
+        on_update(data)
+        return 200, 'text/plain', b''
+    return handle
+
+
+async def run_webhook(app, listen, port, path, secret_token, webhook_url=None):
+    """Запускает бота в режиме webhook поверх локального HTTP сервера.
+
+    Если webhook_url задан, регистрирует его в Telegram без
+    drop_pending_updates, чтобы накопившиеся апдейты не терялись при рестарте.
+    Без webhook_url сервер просто принимает POST-запросы (например, от
+    webhook_standin.py при локальной проверке). Без secret_token не стартует:
+    это проверяет make_webhook_handler ещё до запуска приложения.
+    """
+    server = HttpServer(listen, port)
+    server.route('POST', path, make_webhook_handler(
+        secret_token,
+        lambda data: app.update_queue.put_nowait(Update.de_json(data, app.bot))
+    ))
+
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    await app.start()
+    await server.start()
+    try:
+        if webhook_url:
+            await app.bot.set_webhook(
+                url=webhook_url,
+                secret_token=secret_token,
+                allowed_updates=Update.ALL_TYPES,
+                drop_pending_updates=False
+            )
+            logger.info(f"Webhook зарегистрирован: {webhook_url}")
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+        await app.stop()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+        await app.shutdown()
@@ -0,0 +1,48 @@
+# Локальная замена Telegram для проверки webhook-режима:
+# отправляет апдейт (JSON из файла или тестовый /start) на локальный сервер бота.
+#   python webhook_standin.py [update.json]
+import json
+import sys
+import time
+import urllib.error
+import urllib.request
+
+from config import WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET
+
+def sample_update(user_id=123456789, text='/start'):
+    now = int(time.time())
+    return {
+        'update_id': now,
+        'message': {
+            'message_id': 1,
+            'date': now,
+            'chat': {'id': user_id, 'type': 'private', 'first_name': 'Test'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Test', 'username': 'test_user'},
+            'text': text,
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(text)}] if text.startswith('/') else []
+        }
+    }
+
+def post_update(update, secret=WEBHOOK_SECRET):
+    request = urllib.request.Request(
+        f"http://{WEBHOOK_LISTEN}:{WEBHOOK_PORT}{WEBHOOK_PATH}",
+        data=json.dumps(update).encode('utf-8'),
+        headers={
+            'Content-Type': 'application/json',
+            'X-Telegram-Bot-Api-Secret-Token': secret or ''
+        },
+        method='POST'
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], encoding='utf-8') as f:
+            update = json.load(f)
+    else:
+        update = sample_update()
+    print(f"✅ Ответ сервера: {post_update(update)}")